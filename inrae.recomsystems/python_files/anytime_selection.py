@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""Anytime query selection under a time budget.
+
+@author: Maeva.Caillat
+
+This module selects the query of a heuristic (EVOI, IGB or ESB) within a
+time budget, whatever the size of the group. The candidate queries are
+evaluated in a priority order, the most uncertain answers (p closest to
+1/2) first, and the best query found so far is returned when the budget
+is spent, or the most uncertain one ranked if none was evaluated. The
+deadline is checked before the ranking of every candidate, every pass of
+the winning probabilities of the current state and every evaluation, so
+it is exceeded by one of these steps at most.
+
+IGB and ESB estimate their values by Monte Carlo: the candidates are
+evaluated by passes, every pass doubling the number of samples of the
+estimates (up to gamma) and refining the best candidates first.
+EVOI is exact, so its candidates are evaluated once each.
+
+"""
+
+import logging
+import timeit
+from itertools import combinations
+import numpy as np
+from numpy import random as rd
+import scipy.stats as st
+from borda_voting_protocol import borda_permut
+from elicitation_log import log_event
+from item_winning_proba import win_proba
+from other_useful_functions import posterior_distrib, proba_query
+
+
+# pylint: disable=C0103
+FIRST_PASS_FRACTION = 8
+"""int: The first pass of IGB and ESB draws gamma / FIRST_PASS_FRACTION.
+
+The next passes double the samples of the estimates, so the last one
+reaches gamma after log2(FIRST_PASS_FRACTION) + 1 passes.
+"""
+
+
+def candidate_queries(v, c, vc, distrib, queries, rng=None, deadline=None):
+    """
+    Return the candidate queries, the most uncertain answers first.
+
+    Parameters
+    ----------
+    v : ARRAY
+        The set of voters.
+    c : ARRAY
+        The set of candidates.
+    vc : ARRAY
+        The set of permutations.
+    distrib : ARRAY
+        The current permutation distribution.
+    queries : LIST
+        The queries [vi, cj, ck] already known, with cj < ck.
+    rng : GENERATOR
+        The random generator breaking the ties (a new unseeded one
+        by default).
+    deadline : FLOAT
+        If given, the time (timeit.default_timer) when the ranking stops,
+        the candidates not ranked yet coming last in a random order.
+
+    Returns
+    -------
+    candidates : LIST
+        The queries [vi, cj, ck] not known yet.
+    p : ARRAY
+        The probabilities of the answers cj > ck (nan for the candidates
+        not ranked).
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+    candidates = [[int(vi), int(cj), int(ck)]
+                  for vi in v
+                  for cj, ck in combinations(c, 2)
+                  if [vi, cj, ck] not in queries]
+    # The candidates are ranked in a random order, which breaks the ties
+    # and spreads the ranked ones over the voters if the deadline falls.
+    candidates = [candidates[i] for i in rng.permutation(len(candidates))]
+    p = np.full(len(candidates), np.nan)
+    for i, (vi, cj, ck) in enumerate(candidates):
+        if deadline is not None and timeit.default_timer() >= deadline:
+            break
+        p[i] = proba_query(vc, cj, ck, distrib, vi)
+    order = np.argsort(-p * (1 - p), kind='stable')
+    return([candidates[i] for i in order], p[order])
+
+
+def branch_posteriors(vc, query, distrib):
+    """Return the posterior distributions knowing cj > ck and ck > cj."""
+    vi, cj, ck = query
+    return(posterior_distrib(vc, cj, ck, distrib, vi),
+           posterior_distrib(vc, ck, cj, distrib, vi))
+
+
+def weighted_gain(heuristic, pr_win, post_pr_win, p):
+    """
+    Return the WIG or the WEM of a query from its winning probabilities.
+
+    Parameters
+    ----------
+    heuristic : STRING
+        IGB (weighted information gain) or ESB (weighted expected maximum).
+    pr_win : ARRAY
+        The winning probabilities of the current distribution.
+    post_pr_win : ARRAY
+        The winning probabilities knowing cj > ck and knowing ck > cj
+        (a 2 x m array, a null row for an impossible answer).
+    p : FLOAT
+        The probability of the answer cj > ck.
+
+    Returns
+    -------
+    FLOAT
+        The gain weighted by the probabilities of the answers.
+
+    """
+    if heuristic == 'IGB':
+        gains = (st.entropy(pk=pr_win, base=2)
+                 - np.array([st.entropy(pk=x, base=2) if x.any()
+                             else 0 for x in post_pr_win]))
+    else:
+        gains = post_pr_win.max(axis=1) - max(pr_win)
+    return p * gains[0] + (1 - p) * gains[1]
+
+
+def anytime_evoi(v, c, vc, distrib, queries, deadline, rng=None):
+    """
+    Return the best EVOI query evaluated before a deadline.
+
+    Parameters
+    ----------
+    v : ARRAY
+        The set of voters.
+    c : ARRAY
+        The set of candidates.
+    vc : ARRAY
+        The set of permutations.
+    distrib : ARRAY
+        The current permutation distribution.
+    queries : LIST
+        The queries [vi, cj, ck] already known, with cj < ck.
+    deadline : FLOAT
+        The time (timeit.default_timer) when the best query is returned.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    chosen_query : LIST
+        The query with the highest EVOI among the evaluated ones,
+        the most uncertain one ranked if none could be evaluated.
+    max_chosen_query : FLOAT
+        The EVOI of the chosen query (0 if none was evaluated).
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+    candidates, p = candidate_queries(v, c, vc, distrib, queries, rng,
+                                      deadline)
+    values = np.full(len(candidates), np.nan)
+    if timeit.default_timer() >= deadline:
+        return choose_evaluated(candidates, values, 'EVOI', rng)
+    score_init = max(borda_permut(distrib, vc).values())
+    for i, query in enumerate(candidates):
+        if timeit.default_timer() >= deadline:
+            break
+        value = -score_init
+        for proba, post in zip((p[i], 1 - p[i]),
+                               branch_posteriors(vc, query, distrib)):
+            if proba > 0:
+                value += proba * max(borda_permut(post, vc).values())
+        values[i] = round(value, 4)
+    return choose_evaluated(candidates, values, 'EVOI', rng)
+
+
+def anytime_mc(heuristic, v, c, vc, gamma, distrib, queries, deadline,
+               rng=None):
+    """
+    Return the best IGB or ESB query estimated before a deadline.
+
+    Parameters
+    ----------
+    heuristic : STRING
+        IGB (weighted information gain) or ESB (weighted expected maximum).
+    v : ARRAY
+        The set of voters.
+    c : ARRAY
+        The set of candidates.
+    vc : ARRAY
+        The set of permutations.
+    gamma : INT
+        The sample size of the final estimates.
+    distrib : ARRAY
+        The current permutation distribution.
+    queries : LIST
+        The queries [vi, cj, ck] already known, with cj < ck.
+    deadline : FLOAT
+        The time (timeit.default_timer) when the best query is returned.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    chosen_query : LIST
+        The query with the highest estimated value among the evaluated
+        ones, the most uncertain one ranked if none could be evaluated.
+    max_chosen_query : FLOAT
+        The estimated value of the chosen query (0 if none was evaluated).
+
+    """
+    if heuristic not in ('IGB', 'ESB'):
+        raise ValueError('Invalid heuristic')
+    if rng is None:
+        rng = rd.default_rng()
+    candidates, p = candidate_queries(v, c, vc, distrib, queries, rng,
+                                      deadline)
+    # The winning counts of the current state and of the two answers.
+    prior_counts = np.zeros(len(c))
+    counts = np.zeros((len(candidates), 2, len(c)))
+    nb_samples = np.zeros(len(candidates), dtype=int)
+    values = np.full(len(candidates), np.nan)
+    nb_prior = 0
+    total = max(1, gamma // FIRST_PASS_FRACTION)
+    order = np.arange(len(candidates))
+    # The deadline is checked before every pass of the current state.
+    while timeit.default_timer() < deadline:
+        n = total - nb_prior
+        prior_counts += win_proba(v, c, vc, n, distrib, rng) * n
+        nb_prior = total
+        pr_win = prior_counts / total
+        for i in order:
+            if timeit.default_timer() >= deadline:
+                break
+            n = total - nb_samples[i]
+            for b, (proba, post) in enumerate(zip(
+                    (p[i], 1 - p[i]),
+                    branch_posteriors(vc, candidates[i], distrib))):
+                if proba > 0:
+                    counts[i, b] += win_proba(v, c, vc, n, post, rng) * n
+            nb_samples[i] = total
+            values[i] = round(weighted_gain(heuristic, pr_win,
+                                            counts[i] / total, p[i]), 2)
+        if total >= gamma or not np.all(nb_samples == total):
+            break
+        # The next pass refines the best candidates first.
+        total = min(2 * total, gamma)
+        order = np.argsort(-values, kind='stable')
+    log_event(logging.DEBUG, 'anytime_samples',
+              heuristic=heuristic, nb_samples=int(nb_samples.max(initial=0)))
+    return choose_evaluated(candidates, values, heuristic, rng)
+
+
+def choose_evaluated(candidates, values, heuristic, rng):
+    """Return the best evaluated candidate, ties being broken randomly."""
+    evaluated = ~np.isnan(values)
+    log_event(logging.DEBUG, 'anytime',
+              heuristic=heuristic,
+              nb_candidates=len(candidates),
+              nb_evaluated=int(evaluated.sum()))
+    if not evaluated.any():
+        # The most uncertain answer.
+        return(candidates[0], 0.)
+    max_chosen_query = np.max(values[evaluated])
+    best = np.flatnonzero(values == max_chosen_query)
+    return(candidates[rng.choice(best)], max_chosen_query)
+
+
+def anytime_query(heuristic, v, c, vc, gamma, distrib, queries, time_budget,
+                  rng=None):
+    """
+    Return the best query of a heuristic found within a time budget.
+
+    Parameters
+    ----------
+    heuristic : STRING
+        EVOI, IGB or ESB.
+    v : ARRAY
+        The set of voters.
+    c : ARRAY
+        The set of candidates.
+    vc : ARRAY
+        The set of permutations.
+    gamma : INT
+        The sample size for PrWin algo (IGB and ESB).
+    distrib : ARRAY
+        The current permutation distribution.
+    queries : LIST
+        The queries [vi, cj, ck] already known, with cj < ck.
+    time_budget : FLOAT
+        The time allowed to the selection (seconds).
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    chosen_query : LIST
+        The query [vi, cj, ck].
+    max_chosen_query : FLOAT
+        The value of the query for the heuristic.
+
+    """
+    deadline = timeit.default_timer() + time_budget
+    if heuristic == 'EVOI':
+        return anytime_evoi(v, c, vc, distrib, queries, deadline, rng)
+    return anytime_mc(heuristic, v, c, vc, gamma, distrib, queries,
+                      deadline, rng)
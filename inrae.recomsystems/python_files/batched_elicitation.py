@@ -0,0 +1,674 @@
+# -*- coding: utf-8 -*-
+"""Eliciting the preferences of many groups in lockstep.
+
+@author: Maeva.Caillat
+
+This module runs find_preferences on G independent groups at once, with a
+leading group dimension on the distributions (G x V x m!), the known
+comparisons (G x V x m x m) and the scores, so that the query selection
+(EVOI, IGB, ESB or EVOI+IGB) and the posterior updates of all the groups
+are array operations. Every round asks one query to every group still
+running; a group stops when it has a necessary winner or, if the expected
+loss is used, when the loss reaches the termination value.
+
+The precomputed tables of m items (the permutations vc, the Borda points
+of every item in every permutation and the masks of the permutations where
+cj > ck) are shared by all the groups.
+
+Run this module to evaluate a heuristic on random sushi groups, e.g.:
+    python batched_elicitation.py --heuristic EVOI --groups 1000 --users 5
+
+"""
+
+from functools import lru_cache
+from itertools import combinations, permutations
+from math import factorial
+import numpy as np
+from numpy import random as rd
+
+
+# pylint: disable=C0103
+MAX_CHUNK_ELEMENTS = 2 ** 23
+"""int: The size of the largest array of a chunk of groups in the samplers.
+
+The groups are processed by chunks so that the posterior distributions
+and the sampled profiles stay within a few hundred MB.
+"""
+
+
+@lru_cache(maxsize=None)
+def elicitation_tables(nb_item):
+    """
+    Return the structures shared by all the groups of nb_item items.
+
+    Parameters
+    ----------
+    nb_item : INT
+        The number of items m.
+
+    Returns
+    -------
+    tables : DICT
+        vc : the m! x m permutations, in the order of itertools,
+        score : the m! x m Borda points of every item in every permutation,
+        pairs : the m(m-1) ordered pairs (cj, ck),
+        comb : the m(m-1)/2 queries (cj, ck) with cj < ck,
+        prefers : the m(m-1) x m! masks of the permutations where cj > ck,
+        pair_score : the m! x m(m-1)m points of every item where cj > ck,
+        pair_index : the m x m indexes in pairs of (cj, ck),
+        forward, backward : the indexes in pairs of (cj, ck) and (ck, cj)
+        for every query of comb.
+        The arrays are read-only.
+
+    """
+    vc = np.array(list(permutations(range(nb_item))))
+    # The position of every item in every permutation.
+    position = np.argsort(vc, axis=1)
+    score = (nb_item - 1 - position).astype(float)
+    pairs = np.array(list(permutations(range(nb_item), 2)))
+    comb = np.array(list(combinations(range(nb_item), 2)))
+    prefers = position[:, pairs[:, 0]].T < position[:, pairs[:, 1]].T
+    pair_score = (prefers.T[:, :, None] * score[:, None, :]).reshape(
+        len(vc), -1)
+    # The index in pairs of (cj, ck), -1 on the diagonal.
+    pair_index = np.full((nb_item, nb_item), -1)
+    pair_index[pairs[:, 0], pairs[:, 1]] = np.arange(len(pairs))
+    forward = pair_index[comb[:, 0], comb[:, 1]]
+    backward = pair_index[comb[:, 1], comb[:, 0]]
+    tables = {'vc': vc,
+              'score': score,
+              'pairs': pairs,
+              'comb': comb,
+              'prefers': prefers,
+              'pair_score': pair_score,
+              'pair_index': pair_index,
+              'forward': forward,
+              'backward': backward}
+    for array in tables.values():
+        array.flags.writeable = False
+    return tables
+
+
+def sample_permutations(cdf, u):
+    """
+    Return the indexes of permutations drawn from many distributions.
+
+    All the rows are searched at once: row r of the cumulative
+    distributions is shifted by r, so they form one increasing array.
+
+    Parameters
+    ----------
+    cdf : ARRAY
+        The cumulative distributions, of shape (..., m!).
+    u : ARRAY
+        Uniform numbers in [0, 1), of shape (..., n).
+
+    Returns
+    -------
+    ARRAY
+        The indexes of the drawn permutations, of shape (..., n).
+
+    """
+    nb_permut = cdf.shape[-1]
+    rows = cdf.reshape(-1, nb_permut)
+    rows = rows / rows[:, -1:]
+    offsets = np.arange(len(rows))
+    shifted = u.reshape(len(rows), -1) + offsets[:, None]
+    index = np.searchsorted((rows + offsets[:, None]).ravel(),
+                            shifted.ravel(),
+                            side='right').reshape(shifted.shape)
+    index -= offsets[:, None] * nb_permut
+    return np.clip(index, 0, nb_permut - 1).reshape(u.shape)
+
+
+def expected_scores(distrib, tables):
+    """Return the expected Borda scores (G x m) of distributions G x V x m!."""
+    return np.sum(distrib @ tables['score'], axis=1)
+
+
+def answer_probas(distrib, tables):
+    """Return the probabilities (G x V x m(m-1)) of the answers cj > ck."""
+    return distrib @ tables['prefers'].T
+
+
+def posteriors(distrib, tables):
+    """
+    Return the distributions of the voters knowing every answer cj > ck.
+
+    Parameters
+    ----------
+    distrib : ARRAY
+        The distributions G x V x m!.
+    tables : DICT
+        The tables of elicitation_tables.
+
+    Returns
+    -------
+    ARRAY
+        The posterior distributions G x V x m(m-1) x m!. An answer
+        of probability 0 leaves the distribution unchanged,
+        as in posterior_distrib.
+
+    """
+    post = distrib[:, :, None, :] * tables['prefers']
+    total = post.sum(axis=-1, keepdims=True)
+    return np.where(total > 0,
+                    post / np.where(total > 0, total, 1),
+                    distrib[:, :, None, :])
+
+
+def win_probas(cdf, gamma, tables, rng, voter_cdf=None):
+    """
+    Return the winning probabilities estimated on sampled profiles.
+
+    Parameters
+    ----------
+    cdf : ARRAY
+        The cumulative distributions G x V x m! of the voters.
+    gamma : INT
+        The number of profiles sampled.
+    tables : DICT
+        The tables of elicitation_tables.
+    rng : GENERATOR
+        The random generator.
+    voter_cdf : ARRAY
+        If given, the posterior cumulative distributions G x V x Q x m!:
+        for every voter v and answer q, the profiles are drawn with the
+        posterior of v instead of the distribution of v.
+
+    Returns
+    -------
+    ARRAY
+        The winning probabilities G x m, or G x V x Q x m with voter_cdf.
+
+    """
+    score = tables['score']
+    nb_group, nb_user, _ = cdf.shape
+    if voter_cdf is None:
+        permut = sample_permutations(cdf, rng.random((nb_group,
+                                                      nb_user,
+                                                      gamma)))
+        totals = score[permut].sum(axis=1)
+    else:
+        nb_answer = voter_cdf.shape[2]
+        own = sample_permutations(voter_cdf, rng.random((nb_group,
+                                                         nb_user,
+                                                         nb_answer,
+                                                         gamma)))
+        # The profiles of the other voters, for every voter and answer.
+        others = sample_permutations(
+            cdf, rng.random((nb_group, nb_user, nb_user*nb_answer*gamma)))
+        others = np.moveaxis(others.reshape(nb_group, nb_user, nb_user,
+                                            nb_answer, gamma), 1, -1)
+        totals = score[others].sum(axis=-2)
+        # The asked voter draws from the posterior.
+        diagonal = np.moveaxis(others[:, np.arange(nb_user), :, :,
+                                      np.arange(nb_user)], 0, 1)
+        totals += score[own] - score[diagonal]
+    # The local winner is the first item with the highest Borda score.
+    winners = totals.argmax(axis=-1)
+    return np.mean(winners[..., None] == np.arange(score.shape[1]), axis=-2)
+
+
+def entropy(pr_win):
+    """Return the entropies (base 2) of winning probabilities ... x m."""
+    logs = np.log2(np.where(pr_win > 0, pr_win, 1))
+    return -np.sum(pr_win * logs, axis=-1)
+
+
+def chunk_size(nb_user, nb_item, gamma):
+    """Return the number of groups processed together by the samplers."""
+    per_group = (nb_user * nb_item * (nb_item-1)
+                 * max(factorial(nb_item), gamma * nb_user * nb_item))
+    return max(1, MAX_CHUNK_ELEMENTS // per_group)
+
+
+def weighted(values, distrib, tables):
+    """
+    Return the values of the queries weighted by the answer probabilities.
+
+    Parameters
+    ----------
+    values : ARRAY
+        The values G x V x m(m-1) of the answers cj > ck.
+    distrib : ARRAY
+        The distributions G x V x m!.
+    tables : DICT
+        The tables of elicitation_tables.
+
+    Returns
+    -------
+    ARRAY
+        The values G x V x m(m-1)/2 of the queries of tables['comb'].
+
+    """
+    p = answer_probas(distrib, tables)
+    forward = tables['forward']
+    backward = tables['backward']
+    return (values[..., forward] * p[..., forward]
+            + values[..., backward] * p[..., backward])
+
+
+def evoi_values(distrib, tables):
+    """
+    Return the EVOI of every query for every group (no Monte Carlo).
+
+    Parameters
+    ----------
+    distrib : ARRAY
+        The distributions G x V x m!.
+    tables : DICT
+        The tables of elicitation_tables.
+
+    Returns
+    -------
+    ARRAY
+        The EVOI G x V x m(m-1)/2, rounded as in expect_value_info_no_mc.
+
+    """
+    nb_group, nb_user, _ = distrib.shape
+    p = answer_probas(distrib, tables)
+    score_init = expected_scores(distrib, tables)
+    # The expected points of every voter, and knowing every answer.
+    points = distrib @ tables['score']
+    cond_points = (distrib @ tables['pair_score']).reshape(
+        nb_group, nb_user, p.shape[-1], -1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score_cond = (score_init[:, None, None]
+                      - points[:, :, None]
+                      + cond_points / p[..., None])
+    ev = np.where(p > 0, score_cond.max(axis=-1), 0)
+    evoi = weighted(ev, distrib, tables) - score_init.max(axis=-1)[:, None,
+                                                                   None]
+    return np.round(evoi, 4)
+
+
+def sampled_values(distrib, tables, gamma, rng, criterion):
+    """
+    Return the WIG or WEM of every query for every group.
+
+    Parameters
+    ----------
+    distrib : ARRAY
+        The distributions G x V x m!.
+    tables : DICT
+        The tables of elicitation_tables.
+    gamma : INT
+        The number of profiles sampled for every winning probability.
+    rng : GENERATOR
+        The random generator.
+    criterion : STRING
+        'IGB' for the information gain, 'ESB' for the expected maximum.
+
+    Returns
+    -------
+    ARRAY
+        The WIG or WEM G x V x m(m-1)/2, rounded to 2 decimals
+        as in weighted_info_gain and weighted_expect_max.
+
+    """
+    nb_group, nb_user, _ = distrib.shape
+    size = chunk_size(nb_user, tables['score'].shape[1], gamma)
+    values = []
+    for start in range(0, nb_group, size):
+        chunk = distrib[start:start+size]
+        cdf = np.cumsum(chunk, axis=-1)
+        pr_win = win_probas(cdf, gamma, tables, rng)
+        post_pr_win = win_probas(cdf, gamma, tables, rng,
+                                 np.cumsum(posteriors(chunk, tables),
+                                           axis=-1))
+        if criterion == 'IGB':
+            gain = entropy(pr_win)[:, None, None] - entropy(post_pr_win)
+        else:
+            gain = post_pr_win.max(axis=-1) - pr_win.max(axis=-1)[:, None,
+                                                                  None]
+        values.append(weighted(gain, chunk, tables))
+    return np.round(np.concatenate(values), 2)
+
+
+def select_group_queries(values, known, tables, rng):
+    """
+    Return the query with the highest value for every group.
+
+    Parameters
+    ----------
+    values : ARRAY
+        The values G x V x m(m-1)/2 of the queries.
+    known : ARRAY
+        The known comparisons G x V x m x m.
+    tables : DICT
+        The tables of elicitation_tables.
+    rng : GENERATOR
+        The random generator, breaking the ties.
+
+    Returns
+    -------
+    voter : ARRAY
+        The voter asked in every group.
+    query : ARRAY
+        The index of the query in tables['comb'] for every group.
+    value : ARRAY
+        The value of the chosen queries.
+
+    """
+    comb = tables['comb']
+    # The queries whose answer is already known cannot be chosen.
+    valid = ~(known[..., comb[:, 0], comb[:, 1]]
+              | known[..., comb[:, 1], comb[:, 0]])
+    values = np.where(valid, values, -np.inf)
+    best = values.max(axis=(1, 2))
+    # Randomly choose a query among the ones with the highest value.
+    keys = np.where(values == best[:, None, None],
+                    rng.random(values.shape), -1)
+    flat = keys.reshape(len(keys), -1).argmax(axis=1)
+    voter, query = np.unravel_index(flat, values.shape[1:])
+    return(voter, query, best)
+
+
+def choose_queries(heuristic, distrib, known, tables, gamma, rng):
+    """
+    Return the query chosen by a heuristic for every group.
+
+    Parameters
+    ----------
+    heuristic : STRING
+        EVOI, IGB, ESB or EVOI+IGB.
+    distrib : ARRAY
+        The distributions G x V x m!.
+    known : ARRAY
+        The known comparisons G x V x m x m.
+    tables : DICT
+        The tables of elicitation_tables.
+    gamma : INT
+        The sample size of IGB and ESB.
+    rng : GENERATOR
+        The random generator.
+
+    Returns
+    -------
+    The voters, queries and values of select_group_queries.
+
+    """
+    if heuristic == 'EVOI':
+        return select_group_queries(evoi_values(distrib, tables),
+                                    known, tables, rng)
+    if heuristic in ('IGB', 'ESB'):
+        return select_group_queries(sampled_values(distrib, tables, gamma,
+                                                   rng, heuristic),
+                                    known, tables, rng)
+    if heuristic == 'EVOI+IGB':
+        voter, query, value = select_group_queries(
+            evoi_values(distrib, tables), known, tables, rng)
+        # IGB for the groups where no query has a positive EVOI.
+        flat = np.flatnonzero(value == 0)
+        if len(flat) > 0:
+            (voter[flat],
+             query[flat],
+             value[flat]) = select_group_queries(
+                 sampled_values(distrib[flat], tables, gamma, rng, 'IGB'),
+                 known[flat], tables, rng)
+        return(voter, query, value)
+    raise ValueError('Invalid heuristic')
+
+
+def expected_losses(distrib, tables, nb_sample, rng):
+    """
+    Return the expected loss of every group, estimated with Monte Carlo.
+
+    Parameters
+    ----------
+    distrib : ARRAY
+        The distributions G x V x m!.
+    tables : DICT
+        The tables of elicitation_tables.
+    nb_sample : INT
+        The number of profiles sampled per group.
+    rng : GENERATOR
+        The random generator.
+
+    Returns
+    -------
+    ARRAY
+        The expected losses of the G groups.
+
+    """
+    nb_group, nb_user, _ = distrib.shape
+    # The candidate with the highest expected Borda score.
+    winner = expected_scores(distrib, tables).argmax(axis=-1)
+    size = max(1, MAX_CHUNK_ELEMENTS
+               // (nb_user * nb_sample * tables['score'].shape[1]))
+    losses = []
+    for start in range(0, nb_group, size):
+        chunk = distrib[start:start+size]
+        permut = sample_permutations(np.cumsum(chunk, axis=-1),
+                                     rng.random((len(chunk),
+                                                 nb_user,
+                                                 nb_sample)))
+        local_scores = tables['score'][permut].sum(axis=1)
+        local_winner = winner[start:start+size, None, None]
+        losses.append(np.mean(
+            local_scores.max(axis=-1)
+            - np.take_along_axis(local_scores, local_winner, axis=-1)[..., 0],
+            axis=-1))
+    return np.concatenate(losses)
+
+
+def necessary_winners(known):
+    """
+    Return the necessary winners of the groups given the known comparisons.
+
+    Parameters
+    ----------
+    known : ARRAY
+        The known comparisons G x V x m x m.
+
+    Returns
+    -------
+    ARRAY
+        G x m, True where an item is a necessary winner: its possible
+        minimum is at least the possible maximum of every other item.
+
+    """
+    nb_user, nb_item = known.shape[1], known.shape[-1]
+    # The possible minimums and maximums of the Borda scores.
+    p_min = known.sum(axis=(1, 3))
+    p_max = (nb_item - 1) * nb_user - known.sum(axis=(1, 2))
+    others = np.where(np.eye(nb_item, dtype=bool), -1, p_max[:, None, :])
+    return p_min >= others.max(axis=-1)
+
+
+def run_batched(rating,
+                distrib,
+                heuristic,
+                gamma=50,
+                termination_value=0,
+                israeli=True,
+                nb_loss_sample=1000,
+                rng=None):
+    """
+    Return the winners found by a heuristic for G groups in lockstep.
+
+    Parameters
+    ----------
+    rating : ARRAY
+        The rankings G x V x m of the users of every group.
+    distrib : ARRAY
+        The initial permutation distributions, G x V x m!
+        or V x m! if all the groups share it.
+    heuristic : STRING
+        EVOI, IGB, ESB or EVOI+IGB.
+    gamma : INT
+        The sample size of IGB and ESB.
+    termination_value : FLOAT
+        A group stops when its expected loss is not higher than this value.
+    israeli : BOOL
+        If True, the groups only stop with a necessary winner,
+        otherwise the expected loss is computed after every query.
+    nb_loss_sample : INT
+        The sample size of the expected loss.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    winners : ARRAY
+        The winner of every group.
+    nb_queries : ARRAY
+        The number of queries asked to every group.
+    necessary : ARRAY
+        True for the groups which stopped with a necessary winner.
+    losses : ARRAY
+        The expected losses G x (number of queries + 1), NaN after the end
+        of a group (empty with israeli).
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+    rating = np.asarray(rating)
+    nb_group, nb_user, nb_item = rating.shape
+    tables = elicitation_tables(nb_item)
+    distrib = np.array(np.broadcast_to(distrib, (nb_group,
+                                                 nb_user,
+                                                 factorial(nb_item))),
+                       dtype=float)
+    # known[g, v, a, b] is True if voter v of group g prefers a to b.
+    known = np.zeros((nb_group, nb_user, nb_item, nb_item), dtype=bool)
+    position = np.argsort(rating, axis=-1)
+    nb_queries = np.zeros(nb_group, dtype=int)
+    winners = np.zeros(nb_group, dtype=int)
+    necessary = np.zeros(nb_group, dtype=bool)
+    active = np.ones(nb_group, dtype=bool)
+    losses = np.full((nb_group, 0 if israeli else
+                      nb_user * nb_item * (nb_item-1) // 2 + 1), np.nan)
+    if not israeli:
+        losses[:, 0] = expected_losses(distrib, tables, nb_loss_sample, rng)
+
+    while np.any(active):
+        group = np.flatnonzero(active)
+        voter, query, _ = choose_queries(heuristic,
+                                         distrib[group],
+                                         known[group],
+                                         tables,
+                                         gamma,
+                                         rng)
+        cj, ck = tables['comb'][query].T
+        # The deterministic answers of the users.
+        answer = position[group, voter, cj] < position[group, voter, ck]
+        c_best = np.where(answer, cj, ck)
+        c_worst = np.where(answer, ck, cj)
+
+        # The posterior distributions of the asked voters.
+        rows = (distrib[group, voter]
+                * tables['prefers'][tables['pair_index'][c_best, c_worst]])
+        total = rows.sum(axis=-1, keepdims=True)
+        distrib[group, voter] = np.where(total > 0,
+                                         rows / np.where(total > 0, total, 1),
+                                         distrib[group, voter])
+
+        # Transitive closure: the items preferred to c_best (and c_best)
+        # are preferred to c_worst and the items it is preferred to.
+        order = known[group, voter]
+        index = np.arange(len(group))
+        above = order[index, :, c_best]
+        above[index, c_best] = True
+        below = order[index, c_worst, :]
+        below[index, c_worst] = True
+        known[group, voter] = order | (above[:, :, None] & below[:, None, :])
+        nb_queries[group] += 1
+
+        winner_mask = necessary_winners(known[group])
+        found = winner_mask.any(axis=-1)
+        winners[group[found]] = winner_mask[found].argmax(axis=-1)
+        necessary[group[found]] = True
+        stop = found
+        if not israeli:
+            loss = expected_losses(distrib[group], tables, nb_loss_sample, rng)
+            losses[group, nb_queries[group]] = loss
+            stop = found | (loss <= termination_value)
+            # Without a necessary winner, the best expected score wins.
+            ended = group[stop & ~found]
+            winners[ended] = expected_scores(distrib[ended],
+                                             tables).argmax(axis=-1)
+        active[group[stop]] = False
+    return(winners, nb_queries, necessary, losses)
+
+
+def random_groups(rankings, nb_group, nb_user, rng=None):
+    """
+    Return groups of distinct users drawn among rankings.
+
+    Parameters
+    ----------
+    rankings : ARRAY
+        The rankings of all the users.
+    nb_group : INT
+        The number of groups G.
+    nb_user : INT
+        The number of users per group V.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    ARRAY
+        The rankings G x V x m of the groups.
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+    users = np.argpartition(rng.random((nb_group, len(rankings))),
+                            nb_user, axis=1)[:, :nb_user]
+    return np.asarray(rankings)[users]
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    import timeit
+    from borda_voting_protocol import borda_partial
+    from data import DATA_DIR
+    from datasets import load_sushi_rankings
+    from ranking_projection import prior_distrib, project_rankings
+
+    parser = argparse.ArgumentParser(
+        description='Evaluate a heuristic on random sushi groups.')
+    parser.add_argument('--heuristic', default='EVOI')
+    parser.add_argument('--groups', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--items', type=int, default=6)
+    parser.add_argument('--gamma', type=int, default=50)
+    parser.add_argument('--loss', action='store_true',
+                        help='compute the expected loss after every query')
+    parser.add_argument('--termination', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    generator = rd.default_rng(args.seed)
+    sushi = project_rankings(
+        load_sushi_rankings(os.path.join(DATA_DIR, 'sushi3a.5000.10.order')),
+        range(args.items))
+    # The prior is learnt on all the users.
+    groups = random_groups(sushi, args.groups, args.users, generator)
+    starttime = timeit.default_timer()
+    (group_winners,
+     group_queries,
+     group_necessary,
+     _) = run_batched(groups,
+                      prior_distrib(sushi, args.users),
+                      args.heuristic,
+                      args.gamma,
+                      args.termination,
+                      not args.loss,
+                      rng=generator)
+    runtime = timeit.default_timer() - starttime
+    true_scores = borda_partial(groups)
+    regret = (true_scores.max(axis=-1)
+              - np.take_along_axis(true_scores, group_winners[:, None],
+                                   axis=-1)[:, 0])
+    nb_pairs = args.users * args.items * (args.items-1) / 2
+    print('%s groups of %s users, %s items, %s: %.1f s'
+          % (args.groups, args.users, args.items, args.heuristic, runtime))
+    print('queries: mean %.2f, communication cut %.1f %%'
+          % (group_queries.mean(), 100 * (1 - group_queries.mean() / nb_pairs)))
+    print('necessary winners: %.1f %%, mean regret %.3f'
+          % (100 * group_necessary.mean(), regret.mean()))
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of the elicitation hot paths.
+
+@author: Maeva.Caillat
+
+This module times the Borda scores, the posterior updates, the sampling
+functions, the heuristics and whole runs of find_preferences, for several
+numbers of items and users, on the bundled sushi and CROUS data.
+The results are saved as JSON so that two commits can be compared.
+
+Run this module to run the benchmarks, for instance:
+    python benchmarks.py bench.json --items 4 5 6 --users 5 10
+    python benchmarks.py new.json --compare old.json
+
+"""
+
+from itertools import permutations
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+import numpy as np
+from numpy import random as rd
+from borda_voting_protocol import borda, borda_permut
+from datasets import crous_rankings, sushi_rankings
+from expected_loss import expected_loss
+from evoi import optimal_evoi_query_no_mc
+from esb import optimal_wem_query
+from find_preferences import find_preferences
+from igb import optimal_wig_query
+from item_winning_proba import win_proba
+from other_useful_functions import index_query, posterior_distrib, proba_query
+from ranking_projection import prior_distrib
+
+
+# pylint: disable=C0103
+MACRO_BENCHMARKS = ('find_preferences_evoi',)
+"""tuple: The benchmarks measured only once, a full run being long enough."""
+
+
+def make_group(rankings, nb_user, nb_prior=100):
+    """
+    Return the inputs of the elicitation for a group.
+
+    The first rankings are the group, the last nb_prior ones
+    give the initial permutation distribution.
+
+    Parameters
+    ----------
+    rankings : ARRAY
+        The rankings of a dataset.
+    nb_user : INT
+        The number of users of the group.
+    nb_prior : INT
+        The number of rankings used for the initial distribution.
+
+    Returns
+    -------
+    group : DICT
+        v, c, vc, rating and distrib.
+
+    """
+    rating = rankings[:nb_user]
+    c = np.arange(rankings.shape[1])
+    v = np.arange(nb_user)
+    vc = np.array(list(permutations(c)))
+    prior = rankings[-nb_prior:]
+    distrib = prior_distrib(prior, nb_user)
+    return {'v': v, 'c': c, 'vc': vc, 'rating': rating, 'distrib': distrib}
+
+
+def benchmark_cases(group, gamma, nb_samples, seed):
+    """
+    Return the functions to time for a group.
+
+    Parameters
+    ----------
+    group : DICT
+        The inputs returned by make_group.
+    gamma : INT
+        The sample size of win_proba, IGB and ESB.
+    nb_samples : INT
+        The sample size of expected_loss.
+    seed : INT
+        The seed of the random generators.
+
+    Returns
+    -------
+    cases : DICT
+        The functions without arguments, by name.
+
+    """
+    v = group['v']
+    c = group['c']
+    vc = group['vc']
+    rating = group['rating']
+    distrib = group['distrib']
+    rng = rd.default_rng(seed)
+    return {
+        'borda': lambda: borda(rating),
+        'borda_permut': lambda: borda_permut(distrib, vc),
+        'index_query': lambda: index_query(vc, 0, 1),
+        'posterior_distrib': lambda: posterior_distrib(vc, 0, 1, distrib, 0),
+        'proba_query': lambda: proba_query(vc, 0, 1, distrib, 0),
+        'win_proba': lambda: win_proba(v, c, vc, gamma, distrib, rng),
+        'expected_loss': lambda: expected_loss(v, c, vc, nb_samples,
+                                               distrib, rng),
+        'optimal_evoi_query_no_mc': lambda: optimal_evoi_query_no_mc(
+            v, c, vc, distrib, [], rng),
+        'optimal_wig_query': lambda: optimal_wig_query(
+            v, c, vc, gamma, distrib, [], rng),
+        'optimal_wem_query': lambda: optimal_wem_query(
+            v, c, vc, gamma, distrib, [], rng),
+        'find_preferences_evoi': lambda: find_preferences(
+            v, c, vc, gamma, rating, distrib, 'EVOI', 0, 0.15, 0.05, True,
+            rng=rng),
+    }
+
+
+def time_case(function, repeat, min_time):
+    """
+    Return the timings of a function.
+
+    Parameters
+    ----------
+    function : FUNCTION
+        The function to time, without arguments.
+    repeat : INT
+        The number of measures.
+    min_time : FLOAT
+        The minimal duration of a measure (seconds), the function
+        is called as many times as needed to reach it.
+
+    Returns
+    -------
+    timing : DICT
+        The number of calls per measure and the min, median
+        and max time per call (seconds).
+
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while (min_time > 0 and number < 10 ** 6
+           and timer.timeit(number) < min_time):
+        number *= 10
+    times = np.array(timer.repeat(repeat, number)) / number
+    return {'number': number,
+            'min': float(times.min()),
+            'median': float(np.median(times)),
+            'max': float(times.max())}
+
+
+def run_benchmarks(items=(4, 5, 6),
+                   users=(5, 10),
+                   datasets=('sushi', 'crous'),
+                   names=None,
+                   gamma=50,
+                   nb_samples=100,
+                   repeat=5,
+                   min_time=0.2,
+                   seed=0):
+    """
+    Return the timings of the benchmarks for every dataset and group size.
+
+    Parameters
+    ----------
+    items : LIST
+        The numbers of items.
+    users : LIST
+        The numbers of users.
+    datasets : LIST
+        The datasets ('sushi' and/or 'crous', which has 5 items at most).
+    names : LIST
+        The names of the benchmarks to run (all of them by default).
+    gamma : INT
+        The sample size of win_proba, IGB and ESB.
+    nb_samples : INT
+        The sample size of expected_loss.
+    repeat : INT
+        The number of measures per benchmark.
+    min_time : FLOAT
+        The minimal duration of a measure (seconds).
+    seed : INT
+        The seed of the random generators.
+
+    Returns
+    -------
+    report : DICT
+        The environment (meta) and the list of results.
+
+    """
+    loaders = {'sushi': sushi_rankings, 'crous': crous_rankings}
+    results = []
+    for dataset in datasets:
+        for nb_item in items:
+            if dataset == 'crous' and nb_item > 5:
+                continue
+            rankings = loaders[dataset](nb_item)
+            for nb_user in users:
+                group = make_group(rankings, nb_user)
+                cases = benchmark_cases(group, gamma, nb_samples, seed)
+                for name, function in cases.items():
+                    if names is not None and name not in names:
+                        continue
+                    if name in MACRO_BENCHMARKS:
+                        timing = time_case(function, 1, 0)
+                    else:
+                        timing = time_case(function, repeat, min_time)
+                    timing.update(name=name,
+                                  dataset=dataset,
+                                  nb_item=nb_item,
+                                  nb_user=nb_user)
+                    results.append(timing)
+                    print('%-26s %-6s m=%s V=%-3s %.6f s' % (
+                        name, dataset, nb_item, nb_user, timing['min']))
+    meta = {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'commit': git_commit(),
+            'gamma': gamma,
+            'nb_samples': nb_samples,
+            'seed': seed}
+    return {'meta': meta, 'results': results}
+
+
+def git_commit():
+    """Return the current git commit, None outside a repository."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(old_report, new_report, threshold=0.1):
+    """
+    Return the benchmarks slower in new_report than in old_report.
+
+    Parameters
+    ----------
+    old_report : DICT
+        The reference report.
+    new_report : DICT
+        The report compared to the reference.
+    threshold : FLOAT
+        The relative slowdown above which a benchmark is a regression.
+
+    Returns
+    -------
+    regressions : LIST
+        (name, dataset, nb_item, nb_user, old time, new time) tuples.
+
+    """
+    def key(r):
+        return(r['name'], r['dataset'], r['nb_item'], r['nb_user'])
+
+    old_times = {key(r): r['min'] for r in old_report['results']}
+    regressions = []
+    for r in new_report['results']:
+        if key(r) in old_times and r['min'] > (1+threshold) * old_times[key(r)]:
+            regressions.append(key(r) + (old_times[key(r)], r['min']))
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Time the elicitation hot paths on the bundled data.')
+    parser.add_argument('output_path')
+    parser.add_argument('--items', type=int, nargs='+', default=[4, 5, 6])
+    parser.add_argument('--users', type=int, nargs='+', default=[5, 10])
+    parser.add_argument('--datasets', nargs='+', default=['sushi', 'crous'])
+    parser.add_argument('--names', nargs='+', default=None)
+    parser.add_argument('--gamma', type=int, default=50)
+    parser.add_argument('--samples', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2)
+    parser.add_argument('--compare', default=None,
+                        help='a previous report; exit with 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.items, args.users, args.datasets, args.names,
+                            args.gamma, args.samples, args.repeat,
+                            args.min_time)
+    with open(args.output_path, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            slower = compare_reports(json.load(f), report, args.threshold)
+        for (b_name, b_dataset, b_item, b_user, old, new) in slower:
+            print('REGRESSION %s %s m=%s V=%s: %.6f s -> %.6f s (x%.2f)'
+                  % (b_name, b_dataset, b_item, b_user, old, new, new / old))
+        sys.exit(1 if slower else 0)
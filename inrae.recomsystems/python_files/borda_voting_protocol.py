@@ -3,8 +3,8 @@
 
 @author: Maeva.Caillat
 
-This module contains 2 functions computing borda scores,
-from ratings or distributions.
+This module contains functions computing borda scores,
+from complete or partial ratings or from distributions.
 
 """
 
@@ -27,15 +27,15 @@ def borda(rating):
         The borda scores of the candidates.
 
     """
+    rating = np.asarray(rating).astype(int)
     # The maximal number of points equals to nb_candidates - 1.
-    max_points = len(rating[0]) - 1
-    count_points = np.zeros(len(rating[0]))
-
-    for i in range(len(rating)):
-        for j in range(len(rating[0])):
-            # The preferred item receives max_points,
-            # the second-preferred max_points-1...
-            count_points[int(rating[i, j])] += max_points - j
+    max_points = rating.shape[1] - 1
+    # The preferred item receives max_points,
+    # the second-preferred max_points-1...
+    points = np.tile(max_points - np.arange(rating.shape[1]), len(rating))
+    count_points = np.bincount(rating.ravel(),
+                               weights=points,
+                               minlength=rating.shape[1])
 
     stats = {str(k): count_points[k] for k in range(len(count_points))}
     return stats
@@ -59,22 +59,64 @@ def borda_permut(distrib, vc):
 
     """
     # The maximal number of points equals to nb_candidates - 1.
-    max_points = len(vc[0]) - 1
-    count_points = np.zeros(len(vc[0]))
-
-    for i in range(len(vc)):
-        for j in range(len(vc[0])):
-            # The preferred item receives max_points*P(permutation),
-            # the second-preferred (max_points-1)*P(permutation)...
-            count_points[
-                int(vc[i, j])
-                ] += (max_points-j) * sum(distrib[:, i])
+    max_points = vc.shape[1] - 1
+    # The preferred item receives max_points*P(permutation),
+    # the second-preferred (max_points-1)*P(permutation)...
+    points = np.outer(np.sum(distrib, axis=0),
+                      max_points - np.arange(vc.shape[1]))
+    count_points = np.bincount(vc.ravel(),
+                               weights=points.ravel(),
+                               minlength=vc.shape[1])
 
     stats = {str(r): count_points[r] for r in range(len(count_points))}
     return stats
 
 
-def borda_missing(rating):
+def borda_partial(rating, mask=None, penalty=2):
+    """
+    Return the Borda scores of partial rankings, for one or several groups.
+
+    A voter gives nb_candidates - 1 points to the preferred item,
+    nb_candidates - 2 to the second-preferred... and -penalty to every
+    item excluded from the ranking.
+
+    Parameters
+    ----------
+    rating : ARRAY
+        The rankings of the candidates by the users, of shape
+        (..., nb_user, nb_candidates), padded with -1 after the last
+        ranked item (see datasets.load_crous_rankings).
+        The leading dimensions index independent groups.
+    mask : ARRAY
+        True where an item is ranked (rating >= 0 by default).
+    penalty : FLOAT
+        The points removed for every voter excluding an item.
+
+    Returns
+    -------
+    count_points : ARRAY
+        The Borda scores of shape (..., nb_candidates).
+
+    """
+    rating = np.asarray(rating)
+    if mask is None:
+        mask = rating >= 0
+    nb_candidate = rating.shape[-1]
+    # The maximal number of points equals to nb_candidates - 1.
+    max_points = nb_candidate - 1
+    # The points of every voter for every item, with an extra column
+    # collecting the places left empty.
+    points = np.full(rating.shape[:-1] + (nb_candidate + 1,),
+                     -float(penalty))
+    np.put_along_axis(points,
+                      np.where(mask, rating, nb_candidate).astype(int),
+                      np.broadcast_to(max_points - np.arange(nb_candidate),
+                                      rating.shape).astype(float),
+                      axis=-1)
+    return points[..., :nb_candidate].sum(axis=-2)
+
+
+def borda_missing(rating, penalty=2):
     """
     Return the Borda scores of the candidates according to their rankings.
     Candidates can be excluded by voters (penalty).
@@ -82,7 +124,10 @@ def borda_missing(rating):
     Parameters
     ----------
     rating : ARRAY
-        The rankings of the candidates by the users.
+        The rankings of the candidates by the users,
+        padded with -1 after the last ranked item.
+    penalty : FLOAT
+        The points removed for every voter excluding an item.
 
     Returns
     -------
@@ -90,17 +135,6 @@ def borda_missing(rating):
         The borda scores of the candidates.
 
     """
-    # The maximal number of points equals to nb_candidates - 1.
-    max_points = len(rating[0]) - 1
-    count_points = np.zeros(len(rating[0]))
-    candidate = np.arange(5)
-    for i in range(len(rating)):
-        j = 0
-        while (j < 5) and isinstance(rating[i, j], int):
-            count_points[int(rating[i, j])] += max_points - j
-            j += 1
-        inters = [e for e in candidate if e not in rating[i]]
-        count_points[inters] -= 2
-
+    count_points = borda_partial(rating, penalty=penalty)
     stats = {str(k): count_points[k] for k in range(len(count_points))}
     return stats
@@ -6,6 +6,7 @@
 This module contains the variables needed to test the code.
 
 """
+import os
 
 
 # pylint: disable=C0103
@@ -15,6 +16,10 @@ nb_user = 5
 In the Israeli paper, nb_user is worth 5 to 25.
 """
 
+nb_user_list = [5, 7, 10, 12, 15]
+"""list: The numbers of users of the experiments run by main.py.
+"""
+
 nb_item = 6
 """int: The number of items.
 
@@ -52,6 +57,10 @@ heuristic = 'EVOI'
 It could be IGB, ESB, EVOI or EVOI+IGB.
 """
 
+heuristic_list = ['IGB', 'ESB', 'EVOI', 'EVOI+IGB']
+"""list: The heuristics of the experiment grid (see experiment_runner).
+"""
+
 nb_experiment = 1
 """string: The number of times each experiment is run.
 
@@ -81,6 +90,37 @@ israeli = False
 """bool: True to use the Israeli methods, False to use the expected loss too.
 """
 
+seed = 2020
+"""int: The seed from which the random streams of the experiments are drawn.
+"""
+
+log_level = 'INFO'
+"""string: The lowest level written in the log of the experiments.
+
+It could be DEBUG (every query, answer and loss), INFO or WARNING.
+"""
+
+lockstep = False
+"""bool: True to run the experiments of a group size together.
+
+They then advance in the batched engine (see batched_elicitation),
+which is much faster, but no trace is saved.
+"""
+
+memory_accounting = False
+"""bool: True to record the memory used by every experiment of the grid.
+
+The peak allocations are measured with tracemalloc, which slows the runs.
+"""
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir,
+                        'data')
+"""string: The data directory of the repository, wherever it is cloned.
+
+It is used by the benchmarks, which only run on the bundled data.
+"""
+
 """MY_PATH_SUSHI = ('/home/mmip/Documents/Python/prefelicitgroup/'
                  + 'inrae.recomsystems/inrae.recomsystems/data/'
                  + 'sushi3a.5000.10.order')"""
@@ -99,4 +139,10 @@ CROUS_PATH = ('/home/mmip/Documents/Python/prefelicitgroup/'
               + 'crous.130.5.order.xlsx')
 """string: The path on the computer where the crous database is stored.
 
+It is the former Excel version of the files of CROUS_DIR.
+"""
+
+CROUS_DIR = DATA_DIR
+"""string: The directory of the CROUS courses (one .order file per course).
+
 """
@@ -6,24 +6,193 @@ Created on Wed Jul  1 10:57:58 2020
 
 @author: Maeva.Caillat
 
-This module generates rankings for the sushi and the random datasets.
+This module generates rankings for the sushi, the random and the CROUS
+datasets. The sushi and CROUS files are parsed once into compact arrays,
+cached as .npy files next to them and memory-mapped by the next runs.
 """
-from itertools import permutations
-from math import factorial
+import json
+import os
 import pandas as pd
 import numpy as np
 from numpy import random as rd
-from initial_permutation_distribution import init_permut_proba_distrib
+from data import CROUS_DIR, DATA_DIR
+from ranking_projection import project_rankings, prior_distrib
+from ranking_stream import item_columns
+from synthetic_rankings import uniform_rankings
 
 
 # pylint: disable=C0103
+CROUS_FILES = ('starters.130.5.order',
+               'main.130.5.order',
+               'desserts.130.5.order')
+"""tuple: The files of the CROUS courses, in the order of nutrition_dataset."""
+
+SUSHI_PATH = os.path.join(DATA_DIR, 'sushi3a.5000.10.order')
+"""string: The path of the sushi rankings bundled with the repository."""
+
+
+def cached_array(file_path, parse):
+    """
+    Return the array parsed from a data file, cached next to it.
+
+    The array is saved as file_path.npy, with the size and the
+    modification time of the source in file_path.npy.json. The cache is
+    memory-mapped while it matches the source and rebuilt otherwise.
+
+    Parameters
+    ----------
+    file_path : STRING
+        The path of the data file.
+    parse : FUNCTION
+        The function returning the array of the file from its path.
+
+    Returns
+    -------
+    ARRAY
+        The parsed array (memory-mapped and read-only if cached).
+
+    """
+    cache_path = file_path + '.npy'
+    meta_path = cache_path + '.json'
+    status = os.stat(file_path)
+    source = {'size': status.st_size, 'mtime_ns': status.st_mtime_ns}
+    try:
+        with open(meta_path) as f:
+            if json.load(f) == source:
+                return np.load(cache_path, mmap_mode='r')
+    except (OSError, ValueError):
+        pass
+    array = parse(file_path)
+    try:
+        # The cache is written beside and renamed,
+        # so that another process never reads half of it.
+        with open(cache_path + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(cache_path + '.tmp', cache_path)
+        with open(meta_path, 'w') as f:
+            json.dump(source, f)
+    except OSError:
+        # The data directory is read-only, the file is parsed each time.
+        return array
+    return np.load(cache_path, mmap_mode='r')
+
+
+def load_sushi_rankings(file_path):
+    """
+    Return the 5000 rankings of 10 sushis, parsed once and cached.
+
+    Other files in the same layout, such as the ones written
+    by synthetic_rankings, are read the same way.
+
+    Parameters
+    ----------
+    file_path : STRING
+        The path of sushi3a.5000.10.order.
+
+    Returns
+    -------
+    rankings : ARRAY
+        The uint8 array of 5000 x 10 rankings (read-only).
+        First item in the line: preferred item.
+
+    """
+    def parse(path):
+        # The first two columns are the id and the length of the rankings,
+        # the number of items is read from the header.
+        return np.loadtxt(path,
+                          dtype=np.uint8,
+                          skiprows=1,
+                          usecols=item_columns(path, 'sushi'),
+                          ndmin=2)
+
+    return cached_array(file_path, parse)
+
+
+def load_crous_rankings(file_path):
+    """
+    Return the partial rankings of a CROUS course, parsed once and cached.
+
+    The lines of the .order files are the id of the voter and the items
+    from the preferred one, left blank after the last item ranked. The
+    number of items is the width of the first line.
+
+    Parameters
+    ----------
+    file_path : STRING
+        The path of starters.130.5.order, main.130.5.order
+        or desserts.130.5.order.
+
+    Returns
+    -------
+    rankings : ARRAY
+        The int8 array of 130 x 5 rankings (read-only), padded with -1.
+        First item in the line: preferred item.
+    mask : ARRAY
+        True where an item is ranked.
+
+    """
+    rankings = cached_array(file_path, lambda path: np.genfromtxt(
+        path,
+        delimiter='\t',
+        usecols=item_columns(path, 'order'),
+        filling_values=-1,
+        dtype=int,
+        ndmin=2).astype(np.int8))
+    return(rankings, rankings >= 0)
+
+
+def sushi_rankings(nb_item, file_path=SUSHI_PATH):
+    """
+    Return the sushi rankings restricted to the items 0 to nb_item-1.
+
+    Parameters
+    ----------
+    nb_item : INT
+        The number of items kept.
+    file_path : STRING
+        The path of sushi3a.5000.10.order (the bundled one by default).
+
+    Returns
+    -------
+    ARRAY
+        The 5000 rankings.
+
+    """
+    return project_rankings(load_sushi_rankings(file_path), range(nb_item))
+
+
+def crous_rankings(nb_item, file_path=None):
+    """
+    Return the complete CROUS rankings of starters, restricted to nb_item.
+
+    Parameters
+    ----------
+    nb_item : INT
+        The number of items kept (at most 5).
+    file_path : STRING
+        The path of starters.130.5.order (the bundled one by default).
+
+    Returns
+    -------
+    ARRAY
+        The rankings of the voters who ranked the 5 starters.
+
+    """
+    if file_path is None:
+        file_path = os.path.join(CROUS_DIR, CROUS_FILES[0])
+    rankings, mask = load_crous_rankings(file_path)
+    return project_rankings(rankings[mask.all(axis=1)], range(nb_item))
+
+
 def random_dataset_sushi(nb_user,
                          nb_item,
                          nb_matrix,
                          nb_user_init_distrib,
-                         file_path):
+                         file_path,
+                         rng=None,
+                         items=None):
     """
-    Return 5000 rankings on 6 sushis and an initial permutation distribution.
+    Return rankings on nb_item sushis and an initial permutation distribution.
 
     Parameters
     ----------
@@ -37,69 +206,54 @@ def random_dataset_sushi(nb_user,
     nb_user_init_distrib : INT
         The number of users needed for generating
         an initial permutation distribution for the sushi dataset.
+    file_path : STRING
+        The path of sushi3a.5000.10.order.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+    items : LIST
+        The nb_item sushis kept, relabelled 0 to nb_item-1
+        (sushis 0 to nb_item-1 by default).
 
     Returns
     -------
-    list_some_sushi_ranking : LIST
-        The list of 5000 rankings on 6 sushis.
+    df_rating : DATAFRAME
+        The rankings of nb_user users on nb_item sushis.
     distrib : ARRAY
         The initial permutation distribution for the sushi dataset.
 
     """
-    # We gather the 5000 rankings of 10 sushis.
-    list_sushi_ranking = (pd.read_csv(
-        file_path,
-        sep=' ',
-        header=None,
-        skiprows=1,
-        usecols=list(range(2, 12)))).values.tolist()
-
-    # We only keep sushis 0 to 5 to compare with the Israeli paper.
-    list_some_sushi_ranking = []
-    for i, _ in enumerate(list_sushi_ranking):
-        list_some_sushi_ranking.append(
-            list(
-                filter(
-                    lambda x: x not in [6, 7, 8, 9],
-                    list_sushi_ranking[i])))
+    if rng is None:
+        rng = rd.default_rng()
+    # We only keep sushis 0 to nb_item-1 (0 to 5 in the Israeli paper)
+    # unless other items are given.
+    if items is None:
+        items = range(nb_item)
+    some_sushi_ranking = project_rankings(load_sushi_rankings(file_path),
+                                          items)
 
     # Indexes of random lines for the first lines of random matrices
     # that serve to initiate a permutation distribution.
-    index_lines_rd_matrices = rd.choice(
-        len(list_some_sushi_ranking) - nb_user_init_distrib,
+    index_lines_rd_matrices = rng.choice(
+        len(some_sushi_ranking) - nb_user_init_distrib,
         nb_matrix)
 
     # We extract nb_matrix blocks of size nb_user_init_distrib
     # in the original ranking list.
-    last_ranking_list = []
-    for j in index_lines_rd_matrices:
-        for k in range(nb_user_init_distrib):
-            last_ranking_list.append(list_some_sushi_ranking[j+k])
-
-    # New id for the users extracted for initiating a distribution.
-    # The set of voters.
-    v_init_distrib = (np.array(
-        range(pd.DataFrame(last_ranking_list).shape[0]))).flatten()
-    # The set of possible permutations.
-    vc = np.array(list(permutations(np.arange(len(last_ranking_list[0])))))
+    last_ranking_list = some_sushi_ranking[
+        (index_lines_rd_matrices[:, None]
+         + np.arange(nb_user_init_distrib)).ravel()]
+
     # The initial distribution for the wanted number of voters.
-    distrib = np.tile(init_permut_proba_distrib(vc,
-                                                np.array(last_ranking_list),
-                                                v_init_distrib)[0],
-                      nb_user).reshape(nb_user, factorial(nb_item))
+    distrib = prior_distrib(last_ranking_list, nb_user)
 
     # Indexes of random lines for random matrices.
-    index_lines = rd.choice(
-        len(list_some_sushi_ranking)-nb_user, 1)
+    index_lines = rng.choice(
+        len(some_sushi_ranking)-nb_user, 1)
     # Array of ratings. Lines: users. Columns: rankings.
     # First item in the line: preferred item.
-    ranking_list = []
-    for j in index_lines:
-        # We consider blocks of size nb_matrix in the ranking list.
-        for u in range(nb_user):
-            ranking_list.append(list_some_sushi_ranking[j+u])
-
-    df_rating = pd.DataFrame(ranking_list)
+    # We consider a block of size nb_user in the ranking list.
+    df_rating = pd.DataFrame(
+        some_sushi_ranking[index_lines[0]:index_lines[0]+nb_user])
     return(df_rating, distrib)
 
 
@@ -107,9 +261,10 @@ def fixed_dataset_sushi(nb_user,
                         nb_item,
                         nb_matrix,
                         nb_user_init_distrib,
-                        file_path):
+                        file_path,
+                        items=None):
     """
-    Return 5000 rankings on 6 sushis and an initial permutation distribution.
+    Return rankings on nb_item sushis and an initial permutation distribution.
 
     Parameters
     ----------
@@ -123,57 +278,41 @@ def fixed_dataset_sushi(nb_user,
     nb_user_init_distrib : INT
         The number of users needed for generating
         an initial permutation distribution for the sushi dataset.
+    file_path : STRING
+        The path of sushi3a.5000.10.order.
+    items : LIST
+        The nb_item sushis kept, relabelled 0 to nb_item-1
+        (sushis 0 to nb_item-1 by default).
 
     Returns
     -------
-    list_some_sushi_ranking : LIST
-        The list of 5000 rankings on 6 sushis.
+    df_rating : DATAFRAME
+        The rankings of nb_user users on nb_item sushis.
     distrib : ARRAY
         The initial permutation distribution for the sushi dataset.
 
     """
-    # We gather the 5000 rankings of 10 sushis.
-    list_sushi_ranking = (pd.read_csv(
-        file_path,
-        sep=' ',
-        header=None,
-        skiprows=1,
-        usecols=list(range(2, 12)))).values.tolist()
-
-    # We only keep sushis 0 to 5 to compare with the Israeli paper.
-    list_some_sushi_ranking = []
-    for i, _ in enumerate(list_sushi_ranking):
-        list_some_sushi_ranking.append(
-            list(
-                filter(
-                    lambda x: x not in [6, 7, 8, 9],
-                    list_sushi_ranking[i])))
+    # We only keep sushis 0 to nb_item-1 (0 to 5 in the Israeli paper)
+    # unless other items are given.
+    if items is None:
+        items = range(nb_item)
+    some_sushi_ranking = project_rankings(load_sushi_rankings(file_path),
+                                          items)
 
     # We extract nb_matrix blocks of size nb_user_init_distrib
     # in the original ranking list.
-    last_ranking_list = list_some_sushi_ranking[:nb_matrix*nb_user_init_distrib]
-
-    # New id for the users extracted for initiating a distribution.
-    # The set of voters.
-    v_init_distrib = (np.array(
-        range(pd.DataFrame(last_ranking_list).shape[0]))).flatten()
-    # The set of possible permutations.
-    vc = np.array(list(permutations(np.arange(len(last_ranking_list[0])))))
+    last_ranking_list = some_sushi_ranking[:nb_matrix*nb_user_init_distrib]
+
     # The initial distribution for the wanted number of voters.
-    distrib = np.tile(init_permut_proba_distrib(vc,
-                                                np.array(last_ranking_list),
-                                                v_init_distrib)[0],
-                      nb_user).reshape(nb_user, factorial(nb_item))
+    distrib = prior_distrib(last_ranking_list, nb_user)
 
     # Array of ratings. Lines: users. Columns: rankings.
     # First item in the line: preferred item.
-    ranking_list = list_some_sushi_ranking[:nb_user]
-
-    df_rating = pd.DataFrame(ranking_list)
+    df_rating = pd.DataFrame(some_sushi_ranking[:nb_user])
     return(df_rating, distrib)
 
 
-def dataset_random(nb_user, nb_item):
+def dataset_random(nb_user, nb_item, rng=None):
     """
     Return nb_user random rankings on nb_item and init_distrib.
 
@@ -183,6 +322,8 @@ def dataset_random(nb_user, nb_item):
         Number of users.
     nb_item : INT
         Number of items.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
 
     Returns
     -------
@@ -192,69 +333,49 @@ def dataset_random(nb_user, nb_item):
         The initial permutation distribution.
 
     """
+    if rng is None:
+        rng = rd.default_rng()
     # Array of ratings. Lines: users. Columns: rankings.
     # First item in the line: preferred item.
-    df = rd.permutation(nb_item)
-    for _ in range(nb_user-1):
-        df = np.append(df, rd.permutation(nb_item))
-    df_rating = pd.DataFrame(df.reshape(nb_user, nb_item))
-    # Id of the users.
-    df_user_id = pd.DataFrame(np.array(range(df_rating.shape[0])))
-    # The set of voters.
-    v = np.array(df_user_id).flatten()
-    # The rankings of the candidates by the users.
-    rating = np.array(df_rating)
-    # The set of candidate items.
-    c = np.arange(len(rating[0]))
-    # The set of possible permutations .
-    vc = np.array(list(permutations(c)))
+    rating = uniform_rankings(nb_user, nb_item, rng)
+    df_rating = pd.DataFrame(rating)
     # The initial distribution.
-    init_distrib = init_permut_proba_distrib(vc, rating, v)
+    init_distrib = prior_distrib(rating, nb_user)
 
     return(df_rating, init_distrib)
 
 
-def nutrition_dataset(file_path):
+def nutrition_dataset(file_path=CROUS_DIR):
     """
     Return 130 rankings on 5 starters, 5 dishes, 5 desserts.
 
+    The rankings are partial: -1 fills the places after the last item
+    ranked by a voter (see load_crous_rankings for the masks).
+
     Parameters
     ----------
     file_path : STRING
-        The file path to the CROUS dataset.
+        The directory of the .order files of the CROUS dataset or,
+        for the former Excel version, the path of crous.130.5.order.xlsx.
 
     Returns
     -------
-    starter_ranking: DATAFRAME
-        The dataframe containing the 130 rankings over 5 starters.
-    main_ranking: DATAFRAME
-        The dataframe containing the 130 rankings over 5 main dishes.
-    dessert_ranking: DATAFRAME
-        The dataframe containing the 130 rankings over 5 desserts.
+    starter_ranking: ARRAY
+        The 130 rankings over 5 starters.
+    main_ranking: ARRAY
+        The 130 rankings over 5 main dishes.
+    dessert_ranking: ARRAY
+        The 130 rankings over 5 desserts.
     """
-    starter_ranking = pd.DataFrame((pd.read_excel(
-        file_path,
-        header=None,
-        skiprows=1,
-        sheet_name='starters',
-        keep_default_na=False,
-        usecols=list(range(1, 6)))).values.tolist())
+    if not file_path.endswith('.xlsx'):
+        return tuple(load_crous_rankings(os.path.join(file_path, name))[0]
+                     for name in CROUS_FILES)
 
-    main_ranking = pd.DataFrame((pd.read_excel(
+    # The Excel version has one sheet per course and a header line.
+    return tuple(pd.read_excel(
         file_path,
         header=None,
         skiprows=1,
-        sheet_name='main courses',
-        keep_default_na=False,
-        usecols=list(range(1, 6)))).values.tolist())
-
-    dessert_ranking = pd.DataFrame((pd.read_excel(
-        file_path,
-        header=None,
-        skiprows=1,
-        sheet_name='desserts',
-        keep_default_na=False,
-        usecols=list(range(1, 6)))).values.tolist())
-
-    return(np.array(starter_ranking), np.array(main_ranking),
-           np.array(dessert_ranking))
+        sheet_name=sheet,
+        usecols=list(range(1, 6))).fillna(-1).values.astype(np.int8)
+                 for sheet in ('starters', 'main courses', 'desserts'))
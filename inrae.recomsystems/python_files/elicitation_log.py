@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Logging the elicitation.
+
+@author: Maeva.Caillat
+
+This module contains the logger shared by all the modules and a buffered
+JSON lines sink, so that nothing is written to sys.stdout.
+
+"""
+
+import json
+import logging
+from contextlib import contextmanager
+import numpy as np
+
+
+# pylint: disable=C0103
+LOGGER = logging.getLogger('recomsystems')
+"""Logger: The logger of the elicitation.
+
+Nothing is emitted until a handler is attached, for instance with json_log.
+"""
+LOGGER.addHandler(logging.NullHandler())
+
+
+def log_event(level, event, **fields):
+    """
+    Log an event with structured fields if the level is enabled.
+
+    Parameters
+    ----------
+    level : INT
+        The logging level (logging.DEBUG, logging.INFO...).
+    event : STRING
+        The name of the event.
+    **fields : DICT
+        The values attached to the event (numbers, lists or arrays).
+
+    Returns
+    -------
+    None.
+
+    """
+    # Nothing is formatted when the level is disabled.
+    if LOGGER.isEnabledFor(level):
+        LOGGER.log(level, event, extra={'fields': fields})
+
+
+def to_builtin(value):
+    """
+    Return value converted to JSON serializable types.
+
+    Parameters
+    ----------
+    value : OBJECT
+        A number, an array, a list or a dict of them.
+
+    Returns
+    -------
+    OBJECT
+        The same value with numpy types replaced by python types.
+
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {str(k): to_builtin(e) for k, e in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_builtin(e) for e in value]
+    return value
+
+
+class JsonLinesHandler(logging.Handler):
+    """
+    Buffered handler writing one JSON object per record.
+
+    Records are serialized when they are emitted, since the arrays
+    they refer to (p_min, p_max, distrib...) are updated in place,
+    and written to the file every capacity records.
+
+    Parameters
+    ----------
+    file_path : STRING
+        The path of the JSON lines file.
+    capacity : INT
+        The number of records kept in memory before writing them.
+    mode : STRING
+        The mode used to open the file ('w' or 'a').
+
+    """
+
+    def __init__(self, file_path, capacity=1024, mode='w'):
+        super().__init__()
+        self.capacity = capacity
+        self.buffer = []
+        self.stream = open(file_path, mode)
+
+    def emit(self, record):
+        """Serialize the record and write the buffer if it is full."""
+        entry = {'time': record.created,
+                 'level': record.levelname,
+                 'event': record.getMessage()}
+        entry.update(to_builtin(getattr(record, 'fields', {})))
+        self.buffer.append(json.dumps(entry))
+        if len(self.buffer) >= self.capacity:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records to the file."""
+        self.acquire()
+        try:
+            if self.buffer:
+                self.stream.write('\n'.join(self.buffer) + '\n')
+                self.buffer = []
+            self.stream.flush()
+        finally:
+            self.release()
+
+    def close(self):
+        """Write the remaining records and close the file."""
+        self.acquire()
+        try:
+            try:
+                self.flush()
+            finally:
+                self.stream.close()
+        finally:
+            self.release()
+            super().close()
+
+
+@contextmanager
+def json_log(file_path, level=logging.INFO, capacity=1024):
+    """
+    Send the records of the elicitation to a JSON lines file.
+
+    Parameters
+    ----------
+    file_path : STRING
+        The path of the JSON lines file.
+    level : INT or STRING
+        The lowest level written (DEBUG gives the details of every query).
+    capacity : INT
+        The number of records kept in memory before writing them.
+
+    Yields
+    ------
+    handler : JsonLinesHandler
+        The handler attached to the logger.
+
+    """
+    handler = JsonLinesHandler(file_path, capacity)
+    previous_level = LOGGER.level
+    LOGGER.setLevel(level)
+    LOGGER.addHandler(handler)
+    try:
+        yield handler
+    finally:
+        LOGGER.removeHandler(handler)
+        LOGGER.setLevel(previous_level)
+        handler.close()
@@ -0,0 +1,706 @@
+# -*- coding: utf-8 -*-
+"""Interactive elicitation sessions.
+
+@author: Maeva.Caillat
+
+This module contains the elicitation of find_preferences as a session
+object, which asks its queries one by one (next_query) and is told the
+answers (submit_answer), so that the answers can come from real users as
+well as from the simulator (rating_answers).
+
+A session can also keep one outstanding query per voter (next_queries):
+the voters answer at the same time, and the voters who answered are given
+new queries selected from the latest state. The selections run in a
+thread, so the answers keep arriving during them, and they are applied
+right before the next selection (see run_session_concurrent).
+
+While a query is displayed, a session can select in the background the
+next query for both possible answers (speculate), and serve the one
+matching the answer as soon as it arrives (see run_session_speculative).
+The copies selecting in the background draw from a copy of the stream of
+the session, which goes on from the copy whose query is served, so a seed
+gives the same queries with or without speculation.
+
+The state of a session is compact: the permutation distribution, the known
+comparisons as a V x m x m boolean matrix (known[vi, cj, ck] is True if vi
+prefers cj to ck) and the possible minima and maxima of the Borda scores.
+An answer updates the row of the voter in place and adds the comparisons
+deduced by transitivity. The permutations and the masks of the permutations
+where cj > ck are shared by all the sessions of m items.
+
+"""
+
+import asyncio
+import copy
+import logging
+import time
+import timeit
+import numpy as np
+from numpy import random as rd
+from batched_elicitation import elicitation_tables
+from borda_voting_protocol import borda_permut
+from elicitation_log import log_event
+from expected_loss import expected_loss
+from find_preferences import select_queries, select_query
+from metrics import SELECTION_SECONDS, SESSION_QUERIES, SESSIONS
+from other_useful_functions import deterministic_answers_to_query
+
+
+# pylint: disable=C0103
+class ElicitationSession:
+    """
+    Elicitation of the Borda winner of a group, one query at a time.
+
+    Parameters
+    ----------
+    nb_item : INT
+        The number of candidates.
+    distrib : ARRAY
+        The initial permutation distribution (copied).
+    heuristic : STRING
+        The heuristic used to select the queries.
+    gamma : INT
+        The sample size for PrWin algo.
+    termination_value : FLOAT
+        The session stops when the expected loss reaches this value.
+    israeli : BOOL
+        If True, stop on a necessary winner only,
+        else, use the expected loss too.
+    nb_loss_sample : INT
+        The sample size for the expected loss (Monte Carlo).
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+    time_budget : FLOAT
+        If given, every query is selected anytime within this time
+        (seconds), see anytime_selection.
+    halving : BOOL
+        If True, IGB and ESB allocate their samples by successive halving
+        (see successive_halving).
+
+    """
+
+    def __init__(self,
+                 nb_item,
+                 distrib,
+                 heuristic,
+                 gamma=50,
+                 termination_value=0,
+                 israeli=True,
+                 nb_loss_sample=1000,
+                 rng=None,
+                 time_budget=None,
+                 halving=False):
+        if rng is None:
+            rng = rd.default_rng()
+        self.heuristic = heuristic
+        self.time_budget = time_budget
+        self.halving = halving
+        self.gamma = gamma
+        self.termination_value = termination_value
+        self.israeli = israeli
+        self.nb_loss_sample = nb_loss_sample
+        self.rng = rng
+        self.tables = elicitation_tables(nb_item)
+        self.distrib = np.array(distrib, dtype=float)
+        nb_user = len(self.distrib)
+        self.v = np.arange(nb_user)
+        self.c = np.arange(nb_item)
+        self.known = np.zeros((nb_user, nb_item, nb_item), dtype=bool)
+        self.p_min = np.zeros(nb_item, dtype=int)
+        self.p_max = np.full(nb_item, (nb_item - 1) * nb_user)
+        self.nb_queries = 0
+        # The number of scoring rounds of the heuristic.
+        self.nb_selections = 0
+        # The outstanding query of every busy voter.
+        self.outstanding = {}
+        # The pending query and the selections running for its two answers.
+        self.speculation = None
+        # The selection running for the answer given to the pending query.
+        self.speculated = None
+        # True for the copies of a session used by the speculation.
+        self.speculative = False
+        self.finished = False
+        self.winner = None
+        self.losses = []
+        if not israeli:
+            self.losses.append(self.expected_loss())
+
+    def expected_loss(self):
+        """Return the expected loss of the current distribution."""
+        return expected_loss(self.v,
+                             self.c,
+                             self.tables['vc'],
+                             self.nb_loss_sample,
+                             self.distrib,
+                             self.rng)
+
+    @property
+    def pending(self):
+        """The first outstanding query, None if no query is outstanding."""
+        return next(iter(self.outstanding.values()), None)
+
+    def queries(self, busy=()):
+        """
+        Return the queries [vi, cj, ck], cj < ck, excluded from the selection.
+
+        Parameters
+        ----------
+        busy : LIST
+            Voters all of whose queries are excluded too.
+
+        Returns
+        -------
+        LIST
+            The known queries, and every query of the busy voters.
+
+        """
+        compared = np.triu(self.known | self.known.transpose(0, 2, 1), 1)
+        compared[list(busy)] = np.triu(np.ones_like(compared[0]), 1)
+        return np.argwhere(compared).tolist()
+
+    def idle_voters(self):
+        """Return the voters without outstanding query nor known ranking."""
+        nb_pair = len(self.c) * (len(self.c) - 1)
+        complete = self.known.sum(axis=(1, 2)) * 2 == nb_pair
+        return [int(vi) for vi in self.v
+                if vi not in self.outstanding and not complete[vi]]
+
+    def necessary_winners(self):
+        """Return the items whose possible minimum beats all the maxima."""
+        return [j for j in self.c
+                if self.p_min[j] >= max(np.delete(self.p_max, j))]
+
+    def select(self):
+        """Select and make outstanding a query to an idle voter."""
+        selection_time = timeit.default_timer()
+        self.nb_selections += 1
+        # The selection has its own stream, seeded from the one of the
+        # session, as in the workers of session_server.
+        rng = rd.default_rng(self.rng.integers(2 ** 63))
+        query, value_query = select_query(self.heuristic,
+                                          self.v,
+                                          self.c,
+                                          self.tables['vc'],
+                                          self.gamma,
+                                          self.distrib,
+                                          self.queries(list(self.outstanding)),
+                                          rng,
+                                          self.time_budget,
+                                          self.halving)
+        # The selections of the forks are recorded by the session adopting
+        # them, as the time it waits for them.
+        if not self.speculative:
+            SELECTION_SECONDS.observe(timeit.default_timer() - selection_time,
+                                      heuristic=self.heuristic)
+        log_event(logging.DEBUG, 'query', voter=query[0], cj=query[1],
+                  ck=query[2], value=value_query)
+        # The known queries and the busy voters are excluded from the
+        # selection, selecting one of them again would loop forever.
+        if not self.propose_query(query):
+            raise ValueError('Invalid query selected: %s' % (query,))
+        return self.outstanding[int(query[0])]
+
+    def next_query(self):
+        """
+        Return the next query to ask.
+
+        The query stays pending, and is returned again, until its answer
+        is submitted.
+
+        Returns
+        -------
+        TUPLE
+            The query (vi, cj, ck): does vi prefer cj to ck?
+            None if the session is finished.
+
+        """
+        if self.finished:
+            return None
+        if self.outstanding:
+            return self.pending
+        if self.speculated is not None:
+            wait_time = timeit.default_timer()
+            speculated = self.speculated.result()
+            self.speculated = None
+            if self.adopt(speculated):
+                SELECTION_SECONDS.observe(timeit.default_timer() - wait_time,
+                                          heuristic=self.heuristic)
+                return self.pending
+        return self.select()
+
+    def next_queries(self, k=None):
+        """
+        Return new queries for the idle voters.
+
+        Every voter has at most one outstanding query, so the voters can
+        answer at the same time. The queries are selected in one scoring
+        round from the latest state, the busy voters being left out.
+
+        Parameters
+        ----------
+        k : INT
+            The maximal number of new queries (one per idle voter
+            by default).
+
+        Returns
+        -------
+        LIST
+            The new queries (vi, cj, ck), at most one per idle voter.
+
+        """
+        nb_idle = len(self.idle_voters())
+        if self.finished or nb_idle == 0:
+            return []
+        k = nb_idle if k is None else min(k, nb_idle)
+        # The queries are selected as by the workers of session_server:
+        # a single one as by select, k of them from a seeded stream.
+        if k == 1:
+            return [self.select()]
+        selection_time = timeit.default_timer()
+        self.nb_selections += 1
+        chosen_queries, values = select_queries(
+            self.heuristic,
+            self.v,
+            self.c,
+            self.tables['vc'],
+            self.gamma,
+            self.distrib,
+            self.queries(list(self.outstanding)),
+            k,
+            rd.default_rng(self.rng.integers(2 ** 63)))
+        SELECTION_SECONDS.observe(timeit.default_timer() - selection_time,
+                                  heuristic=self.heuristic)
+        log_event(logging.DEBUG, 'queries', queries=chosen_queries,
+                  values=values)
+        return [self.outstanding[q[0]] for q in chosen_queries
+                if self.propose_query(q)]
+
+    def propose_query(self, query):
+        """
+        Make a query selected elsewhere (e.g. in a worker) outstanding.
+
+        Parameters
+        ----------
+        query : LIST
+            The query [vi, cj, ck].
+
+        Returns
+        -------
+        BOOL
+            False if the answer to the query is already known,
+            or if the voter already has an outstanding query.
+
+        """
+        vi, cj, ck = (int(x) for x in query)
+        if self.known[vi, cj, ck] or self.known[vi, ck, cj] \
+                or vi in self.outstanding:
+            log_event(logging.DEBUG, 'repeated_query', voter=vi, cj=cj, ck=ck)
+            return False
+        self.outstanding[vi] = (vi, cj, ck)
+        return True
+
+    def submit_answer(self, answer, voter=None):
+        """
+        Update the session with the answer to an outstanding query.
+
+        Only the row of the voter is updated, so the answers can arrive
+        in any order.
+
+        Parameters
+        ----------
+        answer : INT
+            1 if vi prefers cj to ck, 0 otherwise.
+        voter : INT
+            The voter answering (the voter of the pending query by default).
+
+        Returns
+        -------
+        BOOL
+            True if the session is finished.
+
+        """
+        query = (self.pending if voter is None
+                 else self.outstanding.get(int(voter)))
+        if query is None:
+            raise ValueError('No pending query')
+        vi, cj, ck = query
+        del self.outstanding[vi]
+        self.nb_queries += 1
+        if self.speculation is not None:
+            speculated_query, futures = self.speculation
+            self.speculation = None
+            if speculated_query == query:
+                self.speculated = futures.pop(int(answer))
+            # The selections for the other answer are not needed.
+            for future in futures.values():
+                future.cancel()
+        if int(answer) == 1:
+            self.add_preference(vi, cj, ck)
+        else:
+            self.add_preference(vi, ck, cj)
+        self.check_termination()
+        if self.finished:
+            # The other outstanding queries are not needed any more.
+            self.outstanding.clear()
+            self.cancel_speculation()
+        return self.finished
+
+    def add_preference(self, vi, c_best, c_worst):
+        """
+        Add c_best > c_worst for vi, and its consequences by transitivity.
+
+        Parameters
+        ----------
+        vi : INT
+            Voter i.
+        c_best : INT
+            The preferred candidate.
+        c_worst : INT
+            The other candidate.
+
+        Returns
+        -------
+        None.
+
+        """
+        log_event(logging.DEBUG, 'answer',
+                  voter=vi, c_best=c_best, c_worst=c_worst)
+        # The posterior distribution of vi knowing c_best > c_worst.
+        row = self.distrib[vi]
+        mask = self.tables['prefers'][self.tables['pair_index'][c_best,
+                                                                c_worst]]
+        s = row @ mask
+        if s != 0:
+            row *= mask
+            row /= s
+        # Every item above c_best (or c_best) beats every item below c_worst.
+        known = self.known[vi]
+        above = known[:, c_best].copy()
+        above[c_best] = True
+        below = known[c_worst].copy()
+        below[c_worst] = True
+        new = np.outer(above, below) & ~known
+        known |= new
+        self.p_min += new.sum(axis=1)
+        self.p_max -= new.sum(axis=0)
+
+    def check_termination(self):
+        """Stop the session on a necessary winner or a low expected loss."""
+        nw_list = self.necessary_winners()
+        stop_loss = True
+        if not self.israeli:
+            self.losses.append(self.expected_loss())
+            stop_loss = self.losses[-1] > self.termination_value
+        log_event(logging.DEBUG, 'bounds', nb_queries=self.nb_queries,
+                  p_max=self.p_max, p_min=self.p_min)
+        if nw_list:
+            self.winner = int(nw_list[0])
+        elif not stop_loss:
+            # The item with the best expected score.
+            self.winner = int(np.argmax(list(
+                borda_permut(self.distrib, self.tables['vc']).values())))
+        else:
+            return
+        self.finished = True
+        if self.speculative:
+            return
+        SESSION_QUERIES.observe(self.nb_queries, heuristic=self.heuristic)
+        SESSIONS.inc(heuristic=self.heuristic,
+                     outcome='necessary_winner' if nw_list
+                     else 'loss_threshold')
+
+    def fork(self):
+        """Return a copy of the session, with its own state and stream.
+
+        The stream of the copy is a copy of the stream of the session,
+        which is not drawn from.
+        """
+        clone = copy.copy(self)
+        clone.distrib = self.distrib.copy()
+        clone.known = self.known.copy()
+        clone.p_min = self.p_min.copy()
+        clone.p_max = self.p_max.copy()
+        clone.losses = list(self.losses)
+        clone.outstanding = dict(self.outstanding)
+        clone.rng = copy.deepcopy(self.rng)
+        clone.speculation = None
+        clone.speculated = None
+        clone.speculative = True
+        return clone
+
+    def speculate(self, executor):
+        """
+        Start selecting the next query for both answers to the pending one.
+
+        Parameters
+        ----------
+        executor : EXECUTOR
+            The thread or process pool running the two selections.
+
+        Returns
+        -------
+        LIST
+            The futures of the two selections (none if the session cannot
+            speculate).
+
+        """
+        if self.finished or len(self.outstanding) != 1:
+            return []
+        self.cancel_speculation()
+        self.speculation = (self.pending,
+                            {answer: executor.submit(speculative_query,
+                                                     self.fork(),
+                                                     answer)
+                             for answer in (0, 1)})
+        return list(self.speculation[1].values())
+
+    def adopt(self, speculated):
+        """
+        Make outstanding the query selected by a fork for the answer given.
+
+        The stream of the session goes on from the one of the fork, as if
+        the session had selected the query itself.
+
+        Parameters
+        ----------
+        speculated : TUPLE
+            The result of speculative_query.
+
+        Returns
+        -------
+        BOOL
+            False if the query cannot be asked.
+
+        """
+        query, state = speculated
+        if query is None or not self.propose_query(query):
+            return False
+        self.rng.bit_generator.state = state
+        return True
+
+    def cancel_speculation(self):
+        """Cancel the selections running for the pending query."""
+        if self.speculation is not None:
+            for future in self.speculation[1].values():
+                future.cancel()
+            self.speculation = None
+        if self.speculated is not None:
+            self.speculated.cancel()
+            self.speculated = None
+
+    def __getstate__(self):
+        # The tables are rebuilt by the worker processes.
+        state = dict(self.__dict__)
+        del state['tables']
+        state['speculation'] = None
+        state['speculated'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.tables = elicitation_tables(len(self.c))
+
+    def nbytes(self):
+        """Return the memory held by the state of the session (bytes)."""
+        return (self.distrib.nbytes + self.known.nbytes
+                + self.p_min.nbytes + self.p_max.nbytes
+                + 8 * len(self.losses))
+
+
+def speculative_query(session, answer):
+    """
+    Return the query following an answer to the pending query of a fork.
+
+    Parameters
+    ----------
+    session : ElicitationSession
+        A fork of the session (see ElicitationSession.fork).
+    answer : INT
+        The answer supposed.
+
+    Returns
+    -------
+    query : TUPLE
+        The next query (vi, cj, ck), None if the answer ends the session.
+    state : DICT
+        The state of the stream of the fork after the selection.
+
+    """
+    session.submit_answer(answer)
+    if session.finished:
+        return(None, session.rng.bit_generator.state)
+    return(session.select(), session.rng.bit_generator.state)
+
+
+def rating_answers(rating):
+    """
+    Return an answer source replying from the rankings of the users.
+
+    Parameters
+    ----------
+    rating : ARRAY
+        The rankings of the candidates by the users.
+
+    Returns
+    -------
+    FUNCTION
+        answer(vi, cj, ck): 1 if vi prefers cj to ck, 0 otherwise.
+
+    """
+    rating = np.array(rating)
+
+    def answer(vi, cj, ck):
+        return deterministic_answers_to_query(vi, cj, ck, rating)
+    return answer
+
+
+def run_session(session, answer_source, batch_size=1):
+    """
+    Ask the queries of a session to an answer source until it finishes.
+
+    With batch_size > 1, every round asks the batch_size best queries
+    (at most one per voter) and applies their answers together.
+
+    Parameters
+    ----------
+    session : ElicitationSession
+        The session.
+    answer_source : FUNCTION
+        answer(vi, cj, ck): 1 if vi prefers cj to ck, 0 otherwise,
+        for instance rating_answers(rating) or a prompt to a real user.
+    batch_size : INT
+        The number of queries asked per round.
+
+    Returns
+    -------
+    winner : INT
+        The winner found by the session.
+    nb_queries : INT
+        Number of queries.
+
+    """
+    if batch_size > 1:
+        batch = session.next_queries(batch_size)
+        while batch:
+            for query in batch:
+                if not session.finished:
+                    session.submit_answer(answer_source(*query), query[0])
+            batch = session.next_queries(batch_size)
+        return(session.winner, session.nb_queries)
+    query = session.next_query()
+    while query is not None:
+        session.submit_answer(answer_source(*query))
+        query = session.next_query()
+    return(session.winner, session.nb_queries)
+
+
+async def run_session_concurrent(session, answer_source, think_time=0,
+                                 rng=None, executor=None):
+    """
+    Ask queries to all the idle voters at once until the session finishes.
+
+    The session is only updated and scored in the executor, one step at a
+    time, so the event loop goes on receiving the answers meanwhile.
+
+    Parameters
+    ----------
+    session : ElicitationSession
+        The session.
+    answer_source : FUNCTION
+        answer(vi, cj, ck): 1 if vi prefers cj to ck, 0 otherwise.
+    think_time : FLOAT
+        The mean time taken by a voter to answer (seconds),
+        the times being drawn from an exponential distribution.
+    rng : GENERATOR
+        The random generator of the answer times (a new unseeded one
+        by default).
+    executor : EXECUTOR
+        The thread pool of the updates and selections (the default
+        executor of the event loop by default).
+
+    Returns
+    -------
+    winner : INT
+        The winner found by the session.
+    nb_queries : INT
+        Number of queries.
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+
+    async def ask(query):
+        if think_time:
+            await asyncio.sleep(rng.exponential(think_time))
+        return(query, answer_source(*query))
+
+    def step(answers):
+        # The answers received during the previous step, then the selection.
+        for query, answer in answers:
+            if not session.finished:
+                session.submit_answer(answer, query[0])
+        return session.next_queries()
+
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    answers = []
+    selection = loop.run_in_executor(executor, step, [])
+    while selection is not None or tasks:
+        running = tasks if selection is None else tasks | {selection}
+        done, _ = await asyncio.wait(running,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task is selection:
+                tasks |= {asyncio.ensure_future(ask(q))
+                          for q in selection.result()}
+                selection = None
+            else:
+                tasks.remove(task)
+                answers.append(task.result())
+        if selection is None:
+            if session.finished:
+                break
+            if answers:
+                selection = loop.run_in_executor(executor, step, answers)
+                answers = []
+    for task in tasks:
+        task.cancel()
+    return(session.winner, session.nb_queries)
+
+
+def run_session_speculative(session, answer_source, executor, think_time=0):
+    """
+    Ask the queries of a session, selecting the next one during the answers.
+
+    Parameters
+    ----------
+    session : ElicitationSession
+        The session.
+    answer_source : FUNCTION
+        answer(vi, cj, ck): 1 if vi prefers cj to ck, 0 otherwise.
+    executor : EXECUTOR
+        The thread or process pool of the speculation.
+    think_time : FLOAT
+        The time taken by a user to answer (seconds).
+
+    Returns
+    -------
+    winner : INT
+        The winner found by the session.
+    nb_queries : INT
+        Number of queries.
+    latencies : LIST
+        The time between every answer and the next query (seconds).
+
+    """
+    latencies = []
+    query = session.next_query()
+    while query is not None:
+        session.speculate(executor)
+        time.sleep(think_time)
+        answer = answer_source(*query)
+        start_time = timeit.default_timer()
+        session.submit_answer(answer)
+        query = session.next_query()
+        latencies.append(timeit.default_timer() - start_time)
+    return(session.winner, session.nb_queries, latencies)
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""Recording and replaying elicitation sessions.
+
+@author: Maeva.Caillat
+
+This module contains:
+    - a recorder saving a session of find_preferences as a compact binary
+      trace (queries, answers, heuristic values, implied queries, timings),
+    - a replay tool re-applying the answers of a trace to compute metrics
+      without running the heuristics again.
+
+"""
+
+import json
+import os
+from itertools import permutations
+import numpy as np
+from numpy import random as rd
+from borda_voting_protocol import borda, borda_permut
+from expected_loss import expected_loss
+from other_useful_functions import transitivity_complete
+
+
+# pylint: disable=C0103
+ROUND_DTYPE = np.dtype([('voter', np.uint16),
+                        ('cj', np.uint8),
+                        ('ck', np.uint8),
+                        ('answer', np.uint8),
+                        ('value', np.float32),
+                        ('selection_time', np.float32),
+                        ('update_time', np.float32)])
+"""dtype: One round of the elicitation.
+
+answer is 1 if cj>ck, 0 if ck>cj and REPEATED if the query
+had already been asked (nothing is updated).
+"""
+
+IMPLIED_DTYPE = np.dtype([('round', np.uint16),
+                          ('voter', np.uint16),
+                          ('cj', np.uint8),
+                          ('ck', np.uint8)])
+"""dtype: A query deduced by transitivity at a given round."""
+
+REPEATED = 2
+"""int: The answer recorded for a query already asked."""
+
+
+class ElicitationTrace:
+    """
+    Recorder of a session of find_preferences.
+
+    Parameters
+    ----------
+    heuristic : STRING
+        The heuristic used to select the queries.
+    rating : ARRAY
+        The rankings of the candidates by the users.
+    distrib : ARRAY
+        The initial permutation distribution.
+    **meta : DICT
+        Other parameters of the session (gamma, termination_value...).
+
+    """
+
+    def __init__(self, heuristic, rating, distrib, **meta):
+        self.meta = dict(meta, heuristic=heuristic)
+        self.rating = np.array(rating, dtype=np.uint8)
+        self.init_distrib = np.array(distrib, dtype=np.float64)
+        self.rounds = []
+        self.implied = []
+
+    def add_round(self,
+                  query,
+                  answer,
+                  value,
+                  selection_time,
+                  update_time,
+                  implied_queries=()):
+        """
+        Record a round of the elicitation.
+
+        Parameters
+        ----------
+        query : LIST
+            The query [vi, cj, ck] selected by the heuristic.
+        answer : INT
+            1 if cj>ck, 0 otherwise, REPEATED if already asked.
+        value : FLOAT
+            The value of the query for the heuristic.
+        selection_time : FLOAT
+            The time spent selecting the query (seconds).
+        update_time : FLOAT
+            The time spent updating the state with the answer (seconds).
+        implied_queries : LIST
+            The queries [vi, cj, ck] deduced by transitivity.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.rounds.append((query[0], query[1], query[2], answer,
+                            value, selection_time, update_time))
+        for q in implied_queries:
+            self.implied.append((len(self.rounds) - 1, q[0], q[1], q[2]))
+
+    def save(self, file_path):
+        """
+        Write the trace as a compressed npz file.
+
+        Parameters
+        ----------
+        file_path : STRING
+            The path of the trace.
+
+        Returns
+        -------
+        None.
+
+        """
+        np.savez_compressed(
+            file_path,
+            meta=np.array(json.dumps(self.meta)),
+            rating=self.rating,
+            init_distrib=self.init_distrib,
+            rounds=np.array(self.rounds, dtype=ROUND_DTYPE),
+            implied=np.array(self.implied, dtype=IMPLIED_DTYPE))
+
+
+def load_trace(file_path):
+    """
+    Return the content of a trace.
+
+    Parameters
+    ----------
+    file_path : STRING
+        The path of the trace.
+
+    Returns
+    -------
+    trace : DICT
+        meta, rating, init_distrib, rounds and implied.
+
+    """
+    with np.load(file_path) as f:
+        trace = {key: f[key] for key in f.files}
+    trace['meta'] = json.loads(str(trace['meta']))
+    return trace
+
+
+def metric_expected_scores(state):
+    """Return the expected Borda scores of the candidates."""
+    return np.array(list(borda_permut(state['distrib'],
+                                      state['vc']).values()))
+
+
+def metric_winner(state):
+    """Return the candidate with the highest expected Borda score."""
+    return np.argmax(metric_expected_scores(state))
+
+
+def metric_necessary_winner(state):
+    """Return the necessary winner, -1 if there is none yet."""
+    p_min = state['p_min']
+    p_max = state['p_max']
+    for j in range(len(p_min)):
+        if p_min[j] >= max(np.delete(p_max, j)):
+            return j
+    return -1
+
+
+def metric_regret(state):
+    """Return the real Borda score lost by choosing the current winner."""
+    scores = np.array(list(borda(state['rating']).values()))
+    return max(scores) - scores[metric_winner(state)]
+
+
+def metric_expected_loss(state, n=1000):
+    """Return the expected loss estimated with n samples."""
+    return expected_loss(state['v'], state['c'], state['vc'], n,
+                         state['distrib'], state['rng'])
+
+
+REPLAY_METRICS = {'expected_scores': metric_expected_scores,
+                  'winner': metric_winner,
+                  'necessary_winner': metric_necessary_winner,
+                  'regret': metric_regret,
+                  'expected_loss': metric_expected_loss}
+"""dict: The metrics available by name in replay_trace.
+
+A metric is a function of the state, a dict containing v, c, vc, rating,
+distrib, p_min, p_max, queries and rng (the random generator).
+"""
+
+
+def replay_trace(trace, metrics=('winner', 'regret'), rng=None):
+    """
+    Return the metrics after every answer of a trace.
+
+    Parameters
+    ----------
+    trace : DICT or STRING
+        A trace returned by load_trace, or its path.
+    metrics : LIST
+        Names in REPLAY_METRICS or functions of the state.
+    rng : GENERATOR
+        The random generator of the metrics (a new unseeded one by default).
+
+    Returns
+    -------
+    results : DICT
+        For each metric, the array of its values before the first
+        answer and after every answer.
+
+    """
+    if isinstance(trace, str):
+        trace = load_trace(trace)
+    rating = trace['rating'].astype(int)
+    v = np.arange(len(rating))
+    c = np.arange(len(rating[0]))
+    vc = np.array(list(permutations(c)))
+    state = {'v': v,
+             'c': c,
+             'vc': vc,
+             'rating': rating,
+             'distrib': np.copy(trace['init_distrib']),
+             'p_max': np.ones(len(c)) * ((len(c)-1) * len(v)),
+             'p_min': np.zeros(len(c)),
+             'queries': [],
+             'rng': rd.default_rng() if rng is None else rng}
+    list_alternative_worst = [[[] for _ in range(len(c))]
+                              for _ in range(len(v))]
+    functions = {m if isinstance(m, str) else m.__name__:
+                 REPLAY_METRICS[m] if isinstance(m, str) else m
+                 for m in metrics}
+    results = {name: [f(state)] for name, f in functions.items()}
+
+    for r in trace['rounds']:
+        if r['answer'] == REPEATED:
+            continue
+        vi = int(r['voter'])
+        cj = int(r['cj'])
+        ck = int(r['ck'])
+        state['queries'].append([vi, cj, ck])
+        (state['p_min'],
+         state['p_max'],
+         state['distrib'],
+         state['queries'],
+         list_alternative_worst) = transitivity_complete(
+             r['answer'],
+             vi,
+             cj,
+             ck,
+             state['p_min'],
+             state['p_max'],
+             vc,
+             state['distrib'],
+             state['queries'],
+             list_alternative_worst)
+        for name, f in functions.items():
+            results[name].append(f(state))
+
+    return {name: np.array(values) for name, values in results.items()}
+
+
+def replay_directory(dir_path, metrics=('winner', 'regret'), seed=None):
+    """
+    Return the metrics of all the traces of a directory.
+
+    Parameters
+    ----------
+    dir_path : STRING
+        The directory containing the traces (.npz files).
+    metrics : LIST
+        Names in REPLAY_METRICS or functions of the state.
+    seed : INT
+        The seed of the random streams of the metrics.
+
+    Returns
+    -------
+    results : DICT
+        For each trace file name, the result of replay_trace.
+
+    """
+    names = [name for name in sorted(os.listdir(dir_path))
+             if name.endswith('.npz')]
+    # One independent random stream per trace.
+    seed_sequences = rd.SeedSequence(seed).spawn(len(names))
+    return {name: replay_trace(os.path.join(dir_path, name),
+                               metrics,
+                               rd.default_rng(seed_sequences[t]))
+            for t, name in enumerate(names)}
+
+
+def mean_curve(curves, length=None):
+    """
+    Return the mean of curves of different lengths.
+
+    The curves are padded with their last value, since the state
+    does not change anymore once the elicitation has stopped.
+
+    Parameters
+    ----------
+    curves : LIST
+        The arrays of values of a metric, one per trace.
+    length : INT
+        The length of the mean curve (the longest curve by default).
+
+    Returns
+    -------
+    ARRAY
+        The mean curve.
+
+    """
+    if length is None:
+        length = max(len(curve) for curve in curves)
+    padded = np.zeros((len(curves), length))
+    for i, curve in enumerate(curves):
+        padded[i, :len(curve)] = curve[:length]
+        padded[i, len(curve):] = curve[-1]
+    return padded.mean(axis=0)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Replay the traces of a directory and print the mean '
+                    'curve of a metric for every heuristic and group size.')
+    parser.add_argument('dir_path')
+    parser.add_argument('--metric', default='regret',
+                        choices=sorted(REPLAY_METRICS))
+    args = parser.parse_args()
+
+    all_results = replay_directory(args.dir_path, [args.metric])
+    # The traces are named heuristic_nbuser_experiment.npz.
+    groups = {}
+    for trace_name, trace_results in all_results.items():
+        groups.setdefault(trace_name.rsplit('_', 1)[0], []).append(
+            trace_results[args.metric])
+    for group, group_curves in sorted(groups.items()):
+        print(group, mean_curve(group_curves))
@@ -8,15 +8,21 @@ This module implements the ESB heuristic.
 """
 
 from itertools import permutations, combinations
+import logging
 import re
 import numpy as np
 from numpy import random as rd
 from item_winning_proba import win_proba
-from other_useful_functions import posterior_distrib, proba_query
+from anytime_selection import anytime_query
+from successive_halving import halving_query
+from other_useful_functions import (best_queries,
+                                    posterior_distrib,
+                                    proba_query)
+from elicitation_log import log_event
 
 
 # pylint: disable=C0103
-def expected_max(v, c, vc, gamma, init_distrib):
+def expected_max(v, c, vc, gamma, init_distrib, rng=None):
     """
     Return the expected maximum of qi,cj>ck.
 
@@ -32,6 +38,8 @@ def expected_max(v, c, vc, gamma, init_distrib):
         The sample size.
     init_distrib : ARRAY
         The initial permutation distribution.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
 
     Returns
     -------
@@ -39,12 +47,14 @@ def expected_max(v, c, vc, gamma, init_distrib):
         EM(vi,cj>ck)
 
     """
+    if rng is None:
+        rng = rd.default_rng()
     # The list of cj > ck.
     comp_cand = np.array(list(permutations(c, 2)))
     # The expected maximums of the queries.
     em_array = np.zeros((len(v), len(comp_cand)))
     # Winning proba of the current state
-    pr_win = win_proba(v, c, vc, gamma, init_distrib)
+    pr_win = win_proba(v, c, vc, gamma, init_distrib, rng)
 
     # Query the i-th voter.
     for i, _ in enumerate(v):
@@ -57,7 +67,7 @@ def expected_max(v, c, vc, gamma, init_distrib):
                                              init_distrib,
                                              v[i])
             # The winning proba array knowing  qi,cj>ck.
-            post_pr_win = win_proba(v, c, vc, gamma, post_distrib)
+            post_pr_win = win_proba(v, c, vc, gamma, post_distrib, rng)
             # The posterior entropy function.
             em_array[i][q] = max(post_pr_win)
 
@@ -70,7 +80,7 @@ def expected_max(v, c, vc, gamma, init_distrib):
     return em_dict
 
 
-def weighted_expect_max(v, c, vc, gamma, init_distrib, queries):
+def weighted_expect_max(v, c, vc, gamma, init_distrib, queries, rng=None):
     """
     Return the weighted expected maximum of qi,cj,ck.
 
@@ -86,6 +96,8 @@ def weighted_expect_max(v, c, vc, gamma, init_distrib, queries):
         The sample size.
     init_distrib : ARRAY
         The initial permutation distribution.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
 
     Returns
     -------
@@ -93,8 +105,10 @@ def weighted_expect_max(v, c, vc, gamma, init_distrib, queries):
         WEM(vi,cj,ck)
 
     """
+    if rng is None:
+        rng = rd.default_rng()
     # The information gains of the queries.
-    em_dict = expected_max(v, c, vc, gamma, init_distrib)
+    em_dict = expected_max(v, c, vc, gamma, init_distrib, rng)
     # Unordered permutations.
     comb = np.array(list(combinations(c, 2)))
     # The weighted information gains of the queries.
@@ -121,7 +135,8 @@ def weighted_expect_max(v, c, vc, gamma, init_distrib, queries):
     return wem_dict
 
 
-def optimal_wem_query(v, c, vc, gamma, init_distrib, queries):
+def optimal_wem_query(v, c, vc, gamma, init_distrib, queries, rng=None,
+                      time_budget=None, halving=False):
     """
     Return the query with the highest WEM.
 
@@ -137,6 +152,14 @@ def optimal_wem_query(v, c, vc, gamma, init_distrib, queries):
         The sample size.
     init_distrib : ARRAY
         The initial permutation distribution.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+    time_budget : FLOAT
+        If given, the query is selected anytime within this time (seconds),
+        see anytime_selection.
+    halving : BOOL
+        If True, the samples are allocated to the queries by successive
+        halving (see successive_halving), unless a time budget is given.
 
     Returns
     -------
@@ -146,12 +169,60 @@ def optimal_wem_query(v, c, vc, gamma, init_distrib, queries):
         The WEM of the chosen query.
 
     """
-    wem_dict = weighted_expect_max(v, c, vc, gamma, init_distrib, queries)
+    if rng is None:
+        rng = rd.default_rng()
+    if time_budget is not None:
+        return anytime_query('ESB', v, c, vc, gamma, init_distrib, queries,
+                             time_budget, rng)
+    if halving:
+        return halving_query('ESB', v, c, vc, gamma, init_distrib, queries, rng)
+    wem_dict = weighted_expect_max(v, c, vc, gamma, init_distrib, queries,
+                                   rng)
     # Choose the query with the highest EVOI.
     max_chosen_query = max(wem_dict.values())
-    print('WEM of the query asked: ', max_chosen_query)
+    log_event(logging.DEBUG, 'wem', value=max_chosen_query)
     # Randomly choose a query among the ones with the highest WIG
-    chosen_query = rd.choice([k for k, v in wem_dict.items()
-                              if v == max_chosen_query])
+    chosen_query = rng.choice([k for k, v in wem_dict.items()
+                               if v == max_chosen_query])
     return([int(s) for s in re.findall(r'\b\d+\b', chosen_query)],
            max_chosen_query)
+
+
+def optimal_wem_queries(v, c, vc, gamma, init_distrib, queries, k, rng=None):
+    """
+    Return the k queries with the highest WEM, at most one per voter.
+
+    Parameters
+    ----------
+    v : ARRAY
+        The set of voters.
+    c : ARRAY
+        The set of candidates.
+    vc : ARRAY
+        The set of permutations.
+    gamma : INT
+        The sample size.
+    init_distrib : ARRAY
+        The initial permutation distribution.
+    queries : LIST
+        The queries already known.
+    k : INT
+        The number of queries wanted.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    chosen_queries : LIST
+        The chosen queries [vi, cj, ck], by decreasing WEM.
+    values : LIST
+        The WEMs of the chosen queries.
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+    wem_dict = weighted_expect_max(v, c, vc, gamma, init_distrib, queries,
+                                   rng)
+    chosen_queries, values = best_queries(wem_dict, k, rng)
+    log_event(logging.DEBUG, 'wem', value=values[0], nb_queries=len(values))
+    return(chosen_queries, values)
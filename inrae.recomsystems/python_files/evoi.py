@@ -7,11 +7,16 @@ This module implements the EVOI heuristic.
 
 """
 from itertools import permutations, combinations
+import logging
 import re
 import numpy as np
 from numpy import random as rd
-from other_useful_functions import posterior_distrib, proba_query
+from anytime_selection import anytime_query
+from other_useful_functions import (best_queries,
+                                    posterior_distrib,
+                                    proba_query)
 from borda_voting_protocol import borda_permut
+from elicitation_log import log_event
 
 
 # pylint: disable=C0103
@@ -123,7 +128,8 @@ def expect_value_info_no_mc(v, c, vc, init_distrib, queries):
     return evoi_dict
 
 
-def optimal_evoi_query_no_mc(v, c, vc, init_distrib, queries):
+def optimal_evoi_query_no_mc(v, c, vc, init_distrib, queries, rng=None,
+                             time_budget=None):
     """
     Return the query with the highest EVOI (no Monte Carlo).
 
@@ -137,6 +143,11 @@ def optimal_evoi_query_no_mc(v, c, vc, init_distrib, queries):
         The set of permutations.
     init_distrib : ARRAY
         The initial permutation distribution.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+    time_budget : FLOAT
+        If given, the query is selected anytime within this time (seconds),
+        see anytime_selection.
 
     Returns
     -------
@@ -146,13 +157,55 @@ def optimal_evoi_query_no_mc(v, c, vc, init_distrib, queries):
         The EVOI of the chosen query.
 
     """
+    if rng is None:
+        rng = rd.default_rng()
+    if time_budget is not None:
+        return anytime_query('EVOI', v, c, vc, 0, init_distrib, queries,
+                             time_budget, rng)
     evoi_dict = expect_value_info_no_mc(v, c, vc, init_distrib, queries)
     # Choose the query with the highest EVOI.
     max_chosen_query = max(evoi_dict.values())
-    print("EVOI of the current query: ", max_chosen_query)
+    log_event(logging.DEBUG, 'evoi', value=max_chosen_query)
     chosen_query_list = [k for k, v in evoi_dict.items()
                          if v == max_chosen_query]
     # Randomly choose a query among the ones with the highest EVOI.
     chosen_query = [int(s) for s in re.findall(r'\b\d+\b',
-                                               rd.choice(chosen_query_list))]
+                                               rng.choice(chosen_query_list))]
     return(chosen_query, max_chosen_query)
+
+
+def optimal_evoi_queries_no_mc(v, c, vc, init_distrib, queries, k, rng=None):
+    """
+    Return the k queries with the highest EVOI, at most one per voter.
+
+    Parameters
+    ----------
+    v : ARRAY
+        The set of voters.
+    c : ARRAY
+        The set of candidates.
+    vc : ARRAY
+        The set of permutations.
+    init_distrib : ARRAY
+        The initial permutation distribution.
+    queries : LIST
+        The queries already known.
+    k : INT
+        The number of queries wanted.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    chosen_queries : LIST
+        The chosen queries [vi, cj, ck], by decreasing EVOI.
+    values : LIST
+        The EVOIs of the chosen queries.
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+    evoi_dict = expect_value_info_no_mc(v, c, vc, init_distrib, queries)
+    chosen_queries, values = best_queries(evoi_dict, k, rng)
+    log_event(logging.DEBUG, 'evoi', value=values[0], nb_queries=len(values))
+    return(chosen_queries, values)
@@ -10,10 +10,11 @@ This module contains a function computing the expected loss.
 import numpy as np
 from numpy import random as rd
 from borda_voting_protocol import borda, borda_permut
+from metrics import MC_SAMPLES
 
 
 # pylint: disable=C0103
-def expected_loss(v, c, vc, n, distrib):
+def expected_loss(v, c, vc, n, distrib, rng=None):
     """
     Return the expected loss estimated with Monte Carlo.
 
@@ -29,6 +30,8 @@ def expected_loss(v, c, vc, n, distrib):
         The sample size for the expected loss (Monte Carlo).
     distrib : ARRAY
         The current permutation distribution.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
 
     Returns
     -------
@@ -36,6 +39,8 @@ def expected_loss(v, c, vc, n, distrib):
         The expected loss estimated with Monte Carlo.
 
     """
+    if rng is None:
+        rng = rd.default_rng()
     # Initialize the expected Borda scores.
     eu_array = np.array(list(borda_permut(distrib, vc).values()))
     # The candidate with the highest expected Borda score.
@@ -47,7 +52,7 @@ def expected_loss(v, c, vc, n, distrib):
         # For voter i, sample a permutation from vci.
         for i in range(len(v)):
             # Choose a permutation using the probabilities associated.
-            rd_permut.append(vc[rd.choice(len(vc), 1, p=distrib[i])])
+            rd_permut.append(vc[rng.choice(len(vc), 1, p=distrib[i])])
         all_rd_permut = np.array(rd_permut).flatten().reshape((len(v), len(c)))
         # Find the local scores using the Borda voting protocol.
         local_scores = np.array(list(borda(all_rd_permut).values()))
@@ -57,4 +62,5 @@ def expected_loss(v, c, vc, n, distrib):
         expect_loss += local_loss
     # Divide the accumulated Borda scores by the sample size.
     expect_loss /= n
+    MC_SAMPLES.inc(n, function='expected_loss')
     return expect_loss
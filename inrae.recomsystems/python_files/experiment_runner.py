@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""Running a grid of experiments in parallel.
+
+@author: Maeva.Caillat
+
+This module expands a grid (heuristics x numbers of users x replicas)
+into independent tasks, runs them on a process pool and merges their
+results into the criteria returned by heuristic_evaluation.
+With a job store (see job_store), finished cells are saved as soon as
+they are done and a restarted sweep only runs the remaining ones, while
+the cells running in another sweep are left to it.
+If memory_accounting is set in data.py, the memory used by every task is
+recorded and the maximum of every cell is reported, to size the workers.
+
+Run this module to run the grid defined in data.py.
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import logging
+import os
+import traceback
+import zlib
+import numpy as np
+from numpy import random as rd
+import data
+from heuristic_evaluation import (build_dataset,
+                                  run_experiment,
+                                  summarize_experiments)
+from elicitation_log import LOGGER, JsonLinesHandler, log_event
+from job_store import (LEASE,
+                       open_store,
+                       add_cells,
+                       reset_cells,
+                       claim_cell,
+                       complete_cell,
+                       config_hash,
+                       fail_cell,
+                       load_results,
+                       load_memory,
+                       worker_name)
+from memory_accounting import MemoryAccount, merge_summaries
+
+
+# pylint: disable=C0103
+def grid_from_data():
+    """
+    Return the grid of experiments defined in data.py.
+
+    Returns
+    -------
+    grid : DICT
+        The lists of heuristics and numbers of users, the number
+        of replicas and the parameters shared by all the experiments.
+
+    """
+    return {'heuristic_list': data.heuristic_list,
+            'nb_user_list': data.nb_user_list,
+            'nb_experiment': data.nb_experiment,
+            'nb_item': data.nb_item,
+            'gamma': data.gamma,
+            'termination_value': data.termination_value,
+            'epsilon': data.epsilon,
+            'delta': data.delta,
+            'database': data.database,
+            'nb_matrix': data.nb_matrix,
+            'nb_user_init_distrib': data.nb_user_init_distrib,
+            'israeli': data.israeli,
+            'memory_accounting': data.memory_accounting,
+            'seed': data.seed}
+
+
+def expand_grid(grid):
+    """
+    Return the independent tasks of a grid.
+
+    A task only contains plain values, so that it can be saved in a job
+    store. Its random streams are derived from them by task_seeds.
+
+    Parameters
+    ----------
+    grid : DICT
+        The grid of experiments (see grid_from_data).
+
+    Returns
+    -------
+    tasks : LIST
+        One dict per (heuristic, number of users, replica).
+
+    """
+    tasks = []
+    for heuristic in grid['heuristic_list']:
+        for nb_user in grid['nb_user_list']:
+            for replica in range(grid['nb_experiment']):
+                task = dict(grid,
+                            heuristic=heuristic,
+                            nb_user=nb_user,
+                            replica=replica)
+                del task['heuristic_list']
+                del task['nb_user_list']
+                tasks.append(task)
+    # The longest tasks are started first to balance the workers.
+    tasks.sort(key=lambda t: t['nb_user'], reverse=True)
+    return tasks
+
+
+def task_seeds(task):
+    """
+    Return the seed sequences of the dataset and of the experiment of a task.
+
+    They are derived from the seed of the grid and from
+    (heuristic, number of users, replica), so the result of a task
+    does not depend on the worker or on the order of execution.
+    The dataset seed only depends on the number of users, so all the
+    heuristics and replicas are evaluated on the same dataset.
+
+    Parameters
+    ----------
+    task : DICT
+        A task returned by expand_grid.
+
+    Returns
+    -------
+    data_seed : SEEDSEQUENCE
+        The seed sequence of the dataset.
+    seed : SEEDSEQUENCE
+        The seed sequence of the experiment.
+
+    """
+    data_seed = np.random.SeedSequence(task['seed'],
+                                       spawn_key=(0, task['nb_user']))
+    seed = np.random.SeedSequence(
+        task['seed'],
+        spawn_key=(1,
+                   zlib.crc32(task['heuristic'].encode()),
+                   task['nb_user'],
+                   task['replica']))
+    return(data_seed, seed)
+
+
+def run_task(task, trace_dir=None):
+    """
+    Return the result of one task of the grid.
+
+    Parameters
+    ----------
+    task : DICT
+        A task returned by expand_grid.
+    trace_dir : STRING
+        If given, the directory where the trace of the task is saved.
+
+    Returns
+    -------
+    key : TUPLE
+        (heuristic, nb_user, replica).
+    result : TUPLE
+        The result of run_experiment.
+    memory : DICT
+        The summary of the memory used by the task,
+        None if memory_accounting is not set.
+
+    """
+    data_seed, seed = task_seeds(task)
+    df_rating, distrib = build_dataset(task['nb_user'],
+                                       task['nb_item'],
+                                       task['database'],
+                                       task['nb_matrix'],
+                                       task['nb_user_init_distrib'],
+                                       rd.default_rng(data_seed))
+    trace_path = None
+    if trace_dir is not None:
+        trace_path = os.path.join(trace_dir, '%s_%s_%s.npz'
+                                  % (task['heuristic'],
+                                     task['nb_user'],
+                                     task['replica']))
+    memory = None
+    if task.get('memory_accounting'):
+        memory = MemoryAccount()
+    result = run_experiment(df_rating,
+                            distrib,
+                            task['gamma'],
+                            task['heuristic'],
+                            task['termination_value'],
+                            task['epsilon'],
+                            task['delta'],
+                            task['israeli'],
+                            trace_path,
+                            rd.default_rng(seed),
+                            memory)
+    if memory is not None:
+        memory = memory.summary()
+    return((task['heuristic'], task['nb_user'], task['replica']),
+           result,
+           memory)
+
+
+def init_worker():
+    """Detach the log files inherited from the parent process."""
+    for handler in list(LOGGER.handlers):
+        if isinstance(handler, JsonLinesHandler):
+            LOGGER.removeHandler(handler)
+
+
+def merge_results(grid, results):
+    """
+    Return the criteria of heuristic_evaluation for every cell of the grid.
+
+    Parameters
+    ----------
+    grid : DICT
+        The grid of experiments.
+    results : DICT
+        The results of run_task, by (heuristic, nb_user, replica),
+        or by cell key of the job store.
+
+    Returns
+    -------
+    stats : DICT
+        The criteria of heuristic_evaluation, by (heuristic, nb_user).
+
+    """
+    stats = {}
+    for (heuristic, nb_user), cell in grid_cells(grid, results).items():
+        stats[(heuristic, nb_user)] = summarize_experiments(
+            cell, nb_user, grid['nb_item'])
+    return stats
+
+
+def merge_memory(grid, memories):
+    """
+    Return the maximal memory used by the tasks of every cell of the grid.
+
+    Parameters
+    ----------
+    grid : DICT
+        The grid of experiments.
+    memories : DICT
+        The memory summaries of run_task, by (heuristic, nb_user, replica),
+        or by cell key of the job store.
+
+    Returns
+    -------
+    memory_stats : DICT
+        The maximal bytes held by every structure and peak allocation
+        of every phase, by (heuristic, nb_user).
+
+    """
+    return {cell_key: merge_summaries(cell)
+            for cell_key, cell in grid_cells(grid, memories).items()}
+
+
+def grid_cells(grid, values):
+    """
+    Return the values of the tasks of the grid, grouped by cell.
+
+    Parameters
+    ----------
+    grid : DICT
+        The grid of experiments.
+    values : DICT
+        The values of the tasks, by (heuristic, nb_user, replica),
+        or by cell key of the job store.
+
+    Returns
+    -------
+    cells : DICT
+        The lists of values of the replicas, by (heuristic, nb_user).
+
+    """
+    # The keys of the store also hold the dataset, the seed and the hash of
+    # the settings.
+    config = config_hash(grid)
+    values = {(k[0], k[1], k[3]) if len(k) == 6 else k: r
+              for k, r in values.items()
+              if len(k) == 3 or (k[2] == grid['database']
+                                 and k[4] == grid['seed']
+                                 and k[5] == config)}
+    cells = {}
+    for heuristic in grid['heuristic_list']:
+        for nb_user in grid['nb_user_list']:
+            cell = [values[(heuristic, nb_user, replica)]
+                    for replica in range(grid['nb_experiment'])
+                    if (heuristic, nb_user, replica) in values]
+            if cell:
+                cells[(heuristic, nb_user)] = cell
+    return cells
+
+
+def work_from_store(store_path, trace_dir=None):
+    """
+    Run the pending cells of a job store until there are none left.
+
+    Several workers, in this process pool or elsewhere,
+    can pull cells from the same store. A failing cell is marked as failed
+    and the worker goes on with the next one.
+
+    Parameters
+    ----------
+    store_path : STRING
+        The path of the job store.
+    trace_dir : STRING
+        If given, the directory where the trace of every task is saved.
+
+    Returns
+    -------
+    nb_done : INT
+        The number of cells run by this worker.
+
+    """
+    conn = open_store(store_path)
+    worker = worker_name()
+    nb_done = 0
+    try:
+        task = claim_cell(conn, worker)
+        while task is not None:
+            try:
+                _, result, memory = run_task(task, trace_dir)
+            except Exception:
+                fail_cell(conn, task, traceback.format_exc(), worker)
+                log_event(logging.ERROR, 'task_failed',
+                          heuristic=task['heuristic'],
+                          nb_user=task['nb_user'],
+                          replica=task['replica'])
+            else:
+                if complete_cell(conn, task, result, memory, worker):
+                    nb_done += 1
+            task = claim_cell(conn, worker)
+    finally:
+        conn.close()
+    return nb_done
+
+
+def run_grid(grid, max_workers=None, trace_dir=None, store_path=None,
+             lease=LEASE, retry_failed=False):
+    """
+    Return the criteria of every cell of a grid, computed in parallel.
+
+    Parameters
+    ----------
+    grid : DICT
+        The grid of experiments (see grid_from_data).
+    max_workers : INT
+        The number of processes (the number of cores by default).
+    trace_dir : STRING
+        If given, the directory where the trace of every task is saved.
+    store_path : STRING
+        If given, the job store where the cells are saved when done.
+        Cells already done in the store are not run again.
+    lease : FLOAT
+        The time (seconds) after which a cell left running in the store
+        is run again (see job_store.reset_cells).
+    retry_failed : BOOL
+        If True, the cells which failed in the store are run again.
+
+    Returns
+    -------
+    stats : DICT
+        The criteria of heuristic_evaluation, by (heuristic, nb_user).
+    memory_stats : DICT
+        The maximal memory used by the tasks, by (heuristic, nb_user)
+        (empty if memory_accounting is not set).
+
+    """
+    if store_path is not None:
+        conn = open_store(store_path)
+        add_cells(conn, expand_grid(grid))
+        # The cells whose lease has expired were interrupted by a crash.
+        reset_cells(conn, lease, retry_failed)
+        conn.close()
+        nb_workers = max_workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=nb_workers,
+                                 initializer=init_worker) as executor:
+            futures = [executor.submit(work_from_store, store_path, trace_dir)
+                       for _ in range(nb_workers)]
+            for future in as_completed(futures):
+                future.result()
+        conn = open_store(store_path)
+        results = load_results(conn)
+        memories = load_memory(conn)
+        conn.close()
+        return(merge_results(grid, results), merge_memory(grid, memories))
+
+    results = {}
+    memories = {}
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=init_worker) as executor:
+        futures = [executor.submit(run_task, task, trace_dir)
+                   for task in expand_grid(grid)]
+        for future in as_completed(futures):
+            key, result, memory = future.result()
+            log_event(logging.INFO, 'task_result',
+                      heuristic=key[0],
+                      nb_user=key[1],
+                      replica=key[2],
+                      percent_queried=result[0],
+                      runtime_per_query=result[1],
+                      nb_queries=result[2])
+            results[key] = result
+            if memory is not None:
+                memories[key] = memory
+    return(merge_results(grid, results), merge_memory(grid, memories))
+
+
+if __name__ == '__main__':
+    import argparse
+    from data import log_level
+    from elicitation_log import json_log
+    from heuristic_evaluation import print_results
+
+    parser = argparse.ArgumentParser(
+        description='Run the grid of experiments defined in data.py.')
+    parser.add_argument('results_path')
+    parser.add_argument('--log', default=None)
+    parser.add_argument('--traces', default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--store', default=None)
+    parser.add_argument('--lease', type=float, default=LEASE,
+                        help='seconds after which a running cell is rerun')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='run again the cells which failed in the store')
+    parser.add_argument('--memory', default=None,
+                        help='record the memory used and save it as JSON')
+    args = parser.parse_args()
+
+    experiment_grid = grid_from_data()
+    if args.memory is not None:
+        experiment_grid['memory_accounting'] = True
+    if args.traces is not None:
+        os.makedirs(args.traces, exist_ok=True)
+    with json_log(args.log or os.devnull, log_level):
+        grid_stats, grid_memory = run_grid(experiment_grid, args.workers,
+                                           args.traces, args.store,
+                                           args.lease, args.retry_failed)
+    with open(args.results_path, 'w') as f:
+        for (h_name, nb_voters), cell_stats in grid_stats.items():
+            print_results(cell_stats, h_name, nb_voters,
+                          experiment_grid['nb_item'], f)
+    if args.memory is not None:
+        import json
+        with open(args.memory, 'w') as f:
+            json.dump([dict(cell_memory, heuristic=h_name, nb_user=nb_voters)
+                       for (h_name, nb_voters), cell_memory
+                       in grid_memory.items()], f, indent=1)
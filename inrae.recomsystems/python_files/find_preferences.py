@@ -5,19 +5,168 @@
 
 """
 
+import logging
 import timeit
 import sys
 import numpy as np
+from numpy import random as rd
 from other_useful_functions import (deterministic_answers_to_query,
                                     transitivity_complete)
 from borda_voting_protocol import borda, borda_permut
 from expected_loss import expected_loss
-from igb import optimal_wig_query
-from esb import optimal_wem_query
-from evoi import optimal_evoi_query_no_mc
+from igb import optimal_wig_query, optimal_wig_queries
+from esb import optimal_wem_query, optimal_wem_queries
+from evoi import optimal_evoi_query_no_mc, optimal_evoi_queries_no_mc
+from elicitation_log import log_event
+from elicitation_trace import ElicitationTrace, REPEATED
+from metrics import SELECTION_SECONDS, SESSION_QUERIES, SESSIONS
 
 
 # pylint: disable=C0103
+def select_query(heuristic, v, c, vc, gamma, distrib, queries, rng=None,
+                 time_budget=None, halving=False):
+    """
+    Return the next query qi,j,k chosen by a heuristic.
+
+    Parameters
+    ----------
+    heuristic : STRING
+        The heuristic used to find a winner.
+    v : ARRAY
+        The set of voters.
+    c : ARRAY
+        The set of candidates.
+    vc : ARRAY
+        The set of permutations.
+    gamma : INT
+        The sample size for PrWin algo.
+    distrib : ARRAY
+        The current permutation distribution.
+    queries : LIST
+        The queries [vi, cj, ck] already known, with cj < ck.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+    time_budget : FLOAT
+        If given, the query is selected anytime within this time (seconds).
+    halving : BOOL
+        If True, IGB and ESB allocate their samples by successive halving.
+
+    Returns
+    -------
+    query : LIST
+        The query [vi, cj, ck].
+    value_query : FLOAT
+        The value of the query for the heuristic.
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+    # Highest Expected Score Heuristic for Borda Voting
+    if heuristic == 'ESB':
+        return optimal_wem_query(v, c, vc, gamma, distrib, queries, rng,
+                                 time_budget, halving)
+    # Information Gain Heuristic for Borda Voting
+    if heuristic == 'IGB':
+        return optimal_wig_query(v, c, vc, gamma, distrib, queries, rng,
+                                 time_budget, halving)
+    # Expected Value of Information Heuristic for Borda Voting
+    if heuristic == 'EVOI':
+        return optimal_evoi_query_no_mc(v, c, vc, distrib, queries, rng,
+                                        time_budget)
+    # EVOI heuristic, then IGB heuristic if EVOI=0
+    if heuristic == 'EVOI+IGB':
+        starttime = timeit.default_timer()
+        query, value_query = optimal_evoi_query_no_mc(v,
+                                                      c,
+                                                      vc,
+                                                      distrib,
+                                                      queries,
+                                                      rng,
+                                                      time_budget)
+        if value_query == 0:
+            if time_budget is not None:
+                # IGB has the rest of the budget.
+                time_budget = max(0., time_budget
+                                  - (timeit.default_timer() - starttime))
+            query, value_query = optimal_wig_query(v,
+                                                   c,
+                                                   vc,
+                                                   gamma,
+                                                   distrib,
+                                                   queries,
+                                                   rng,
+                                                   time_budget,
+                                                   halving)
+        return(query, value_query)
+    sys.exit('Error in the name of the heuristic!')
+
+
+def select_queries(heuristic, v, c, vc, gamma, distrib, queries, k, rng=None):
+    """
+    Return the k best queries of a heuristic, at most one per voter.
+
+    The queries are scored once, so asking k voters at the same time
+    costs one scoring round instead of k.
+
+    Parameters
+    ----------
+    heuristic : STRING
+        The heuristic used to find a winner.
+    v : ARRAY
+        The set of voters.
+    c : ARRAY
+        The set of candidates.
+    vc : ARRAY
+        The set of permutations.
+    gamma : INT
+        The sample size for PrWin algo.
+    distrib : ARRAY
+        The current permutation distribution.
+    queries : LIST
+        The queries [vi, cj, ck] already known, with cj < ck.
+    k : INT
+        The number of queries wanted.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    chosen_queries : LIST
+        The queries [vi, cj, ck], by decreasing value.
+    values : LIST
+        The values of the queries for the heuristic.
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+    if heuristic == 'ESB':
+        return optimal_wem_queries(v, c, vc, gamma, distrib, queries, k, rng)
+    if heuristic == 'IGB':
+        return optimal_wig_queries(v, c, vc, gamma, distrib, queries, k, rng)
+    if heuristic == 'EVOI':
+        return optimal_evoi_queries_no_mc(v, c, vc, distrib, queries, k, rng)
+    # EVOI heuristic, then IGB heuristic if EVOI=0
+    if heuristic == 'EVOI+IGB':
+        chosen_queries, values = optimal_evoi_queries_no_mc(v,
+                                                            c,
+                                                            vc,
+                                                            distrib,
+                                                            queries,
+                                                            k,
+                                                            rng)
+        if values[0] == 0:
+            chosen_queries, values = optimal_wig_queries(v,
+                                                         c,
+                                                         vc,
+                                                         gamma,
+                                                         distrib,
+                                                         queries,
+                                                         k,
+                                                         rng)
+        return(chosen_queries, values)
+    sys.exit('Error in the name of the heuristic!')
+
+
 def find_preferences(v,
                      c,
                      vc,
@@ -28,7 +177,12 @@ def find_preferences(v,
                      termination_value,
                      epsilon,
                      delta,
-                     israeli):
+                     israeli,
+                     trace_path=None,
+                     rng=None,
+                     nb_loss_sample=1000,
+                     memory=None,
+                     halving=False):
     """
     Return a winning candidate thanks a given heuristic.
 
@@ -63,6 +217,17 @@ def find_preferences(v,
         an initial permutation distribution for the sushi dataset.
     israeli : BOOL
         If True, apply the Israeli methods else, use the expected loss too.
+    trace_path : STRING
+        If given, the session is saved as a binary trace at this path.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+    nb_loss_sample : INT
+        The sample size for the expected loss (Monte Carlo).
+    memory : MemoryAccount
+        If given, the memory held by the structures and the peak allocation
+        of every phase are recorded in it after every round.
+    halving : BOOL
+        If True, IGB and ESB allocate their samples by successive halving.
 
     Returns
     -------
@@ -80,6 +245,10 @@ def find_preferences(v,
         Number of queries.
 
     """
+    if rng is None:
+        rng = rd.default_rng()
+    if memory is not None:
+        memory.start()
     # Initialize time.
     starttime = timeit.default_timer()
 
@@ -95,9 +264,18 @@ def find_preferences(v,
     # The list of queries asked.
     queries = []
 
+    # The record of the session.
+    if trace_path is not None:
+        trace = ElicitationTrace(heuristic,
+                                 rating,
+                                 distrib,
+                                 gamma=gamma,
+                                 termination_value=termination_value,
+                                 israeli=israeli)
+
     # The real Borda scores.
     eu_array = np.array(list(borda(rating).values()))
-    print("The real expected Borda scores are: ", eu_array)
+    log_event(logging.DEBUG, 'true_scores', scores=eu_array)
 
     # Stopping criterion booleans.
     stop_loss = True
@@ -109,12 +287,12 @@ def find_preferences(v,
         # The worst case loss.
         # x = (len(c) - 1) * len(v) - max(eu_array)
         # Minimum number of samples needed.
-        n = 1000
+        n = nb_loss_sample
         # n = int(round((x ** 2) / ((epsilon ** 2) * delta))) + 1
-        print('Number of samples needed:', n)
         # The expected loss.
-        expect_loss = expected_loss(v, c, vc, n, distrib)
-        print("The initial expected loss is: ", expect_loss)
+        expect_loss = expected_loss(v, c, vc, n, distrib, rng)
+        log_event(logging.DEBUG, 'initial_loss',
+                  nb_samples=n, expected_loss=expect_loss)
 
         # The expected losses vs. time.
         expect_losses = [expect_loss]
@@ -124,63 +302,39 @@ def find_preferences(v,
     list_alternative_worst = [[[] for _ in range(len(c))]
                               for _ in range(len(v))]
     time = [timeit.default_timer()]
-    print("\n")
     while stopping_criterion:
+        if memory is not None:
+            memory.start_phase()
+        selection_time = timeit.default_timer()
         # Find the next query qi,j,k thanks to an heuristic.
-
-        # Highest Expected Score Heuristic for Borda Voting
-        if heuristic == 'ESB':
-            query, value_query = optimal_wem_query(v,
-                                                   c,
-                                                   vc,
-                                                   gamma,
-                                                   distrib,
-                                                   queries)
-        # Information Gain Heuristic for Borda Voting
-        elif heuristic == 'IGB':
-            query, value_query = optimal_wig_query(v,
-                                                   c,
-                                                   vc,
-                                                   gamma,
-                                                   distrib,
-                                                   queries)
-        # Expected Value of Information Heuristic for Borda Voting
-        elif heuristic == 'EVOI':
-            query, value_query = optimal_evoi_query_no_mc(v,
-                                                          c,
-                                                          vc,
-                                                          distrib,
-                                                          queries)
-        # EVOI heuristic, then IGB heuristic if EVOI=0
-        elif heuristic == 'EVOI+IGB':
-            query, value_query = optimal_evoi_query_no_mc(v,
-                                                          c,
-                                                          vc,
-                                                          distrib,
-                                                          queries)
-            if value_query == 0:
-                query, value_query = optimal_wig_query(v,
-                                                       c,
-                                                       vc,
-                                                       gamma,
-                                                       distrib,
-                                                       queries)
-        else:
-            sys.exit('Error in the name of the heuristic!')
+        query, value_query = select_query(heuristic,
+                                          v,
+                                          c,
+                                          vc,
+                                          gamma,
+                                          distrib,
+                                          queries,
+                                          rng,
+                                          halving=halving)
 
         vi = query[0]
         cj = query[1]
         ck = query[2]
         query = [vi, cj, ck]
-        print("The question selected is: \'User v"
-              + str(vi) + ", do you prefer c"
-              + str(cj) + " or c"
-              + str(ck) + "? \'")
+        update_time = timeit.default_timer()
+        selection_time = update_time - selection_time
+        SELECTION_SECONDS.observe(selection_time, heuristic=heuristic)
+        if memory is not None:
+            memory.end_phase('selection')
+            memory.start_phase()
+        log_event(logging.DEBUG, 'query',
+                  voter=vi, cj=cj, ck=ck, value=value_query)
 
         # If query not already asked.
         if query not in queries:
             # Add the query to list of queries.
             queries.append(query)
+            nb_known = len(queries)
             nb_queries += 1
             # We ask user vi to answer cj>ck.
             answer = deterministic_answers_to_query(vi, cj, ck, rating)
@@ -199,39 +353,60 @@ def find_preferences(v,
                                                              distrib,
                                                              queries,
                                                              list_alternative_worst)
-            print("Pmax = ", p_max)
-            print("Pmin = ", p_min)
 
             # Update the possible winner array.
             nw_list = [j for j in range(len(c))
                        if p_min[j] >= max(np.delete(p_max, j))]
             # False if no approximate winner, True otherwise.
             stop_nw = (not nw_list)
-            print("Number of different questions asked: ", nb_queries)
+            if memory is not None:
+                memory.end_phase('update')
+            log_event(logging.DEBUG, 'bounds',
+                      nb_queries=nb_queries, p_max=p_max, p_min=p_min)
 
             if not israeli:
+                if memory is not None:
+                    memory.start_phase()
                 # The current expected Borda scores.
                 eu_array = np.array(list(borda_permut(distrib, vc).values()))
                 # The worst case loss.
                 # x = (len(c) - 1) * len(v) - max(eu_array)
                 # Minimum number of samples needed.
-                n = 1000
+                n = nb_loss_sample
                 # n = int(round((x ** 2) / ((epsilon ** 2) * delta)))+1
-                print('Number of samples needed:', n)
                 # The expected loss.
-                expect_loss = expected_loss(v, c, vc, n, distrib)
+                expect_loss = expected_loss(v, c, vc, n, distrib, rng)
                 expect_losses.append(expect_loss)
-                print("Current EU: ", eu_array)
-                print("Current expected loss: ", expect_loss)
+                log_event(logging.DEBUG, 'loss',
+                          nb_samples=n, scores=eu_array,
+                          expected_loss=expect_loss)
                 stop_loss = np.any(expect_loss > termination_value)
+                if memory is not None:
+                    memory.end_phase('loss')
 
             stopping_criterion = (stop_loss and stop_nw)
             time.append(timeit.default_timer())
-            print("\n")
+            if trace_path is not None:
+                trace.add_round(query,
+                                answer,
+                                value_query,
+                                selection_time,
+                                time[-1] - update_time,
+                                queries[nb_known:])
 
         else:
-            print("Question already asked before.")
-            print("\n")
+            if memory is not None:
+                memory.end_phase('update')
+            log_event(logging.DEBUG, 'repeated_query',
+                      voter=vi, cj=cj, ck=ck)
+            if trace_path is not None:
+                trace.add_round(query, REPEATED, value_query,
+                                selection_time, 0)
+        if memory is not None:
+            memory.end_round(distrib=distrib,
+                             vc=vc,
+                             queries=queries,
+                             list_alternative_worst=list_alternative_worst)
     # if a possible winner is found, return it.
     if not stop_nw:
         nw = nw_list[0]
@@ -240,9 +415,16 @@ def find_preferences(v,
         nw = np.argmax(eu_array)
 
     runtime = timeit.default_timer() - starttime
+    SESSION_QUERIES.observe(nb_queries, heuristic=heuristic)
+    SESSIONS.inc(heuristic=heuristic,
+                 outcome='loss_threshold' if stop_nw else 'necessary_winner')
     # The cut in the communication cost.
     communication_cut = 100 * (1 - (2*nb_queries/(len(c)*len(v)*(len(c)-1))))
     time_array = np.array(time)-starttime
+    if trace_path is not None:
+        trace.save(trace_path)
+    if memory is not None:
+        memory.stop()
 
     if israeli:
         return(nw,
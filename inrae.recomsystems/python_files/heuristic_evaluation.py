@@ -6,22 +6,18 @@
 """
 
 from itertools import permutations
-import sys
+import logging
+import os
+import timeit
 import numpy as np
+from numpy import random as rd
 import pandas as pd
+from batched_elicitation import run_batched
 from datasets import dataset_random, fixed_dataset_sushi, random_dataset_sushi
 from find_preferences import find_preferences
 from data import MY_PATH_SUSHI
+from elicitation_log import log_event
 
-"""MY_PATH_TEMP_OUTPUTS = ('/home/mmip/Documents/Python/prefelicitgroup/'
-                        + 'inrae.recomsystems/inrae.recomsystems/outputs/'
-                        + 'temp_results.txt')"""
-"""MY_PATH_TEMP_OUTPUTS = ('/Users/sonialementec/Documents/INRAE/Git/'
-                        + 'inrae.recomsystems/inrae.recomsystems/outputs/'
-                        + 'temp_results.txt')"""
-MY_PATH_TEMP_OUTPUTS = ('C:/Users/maeva/Documents/Cours_ei4/INRAE/prefelicitgroup/'
-                        + 'inrae.recomsystems/inrae.recomsystems/outputs/'
-                        + 'temp_results.txt')
 
 # pylint: disable=C0103
 def heuristic_evaluation(nb_user,
@@ -35,7 +31,10 @@ def heuristic_evaluation(nb_user,
                          database,
                          nb_matrix,
                          nb_user_init_distrib,
-                         israeli):
+                         israeli,
+                         trace_dir=None,
+                         seed=None,
+                         lockstep=False):
     """
     Return the performance criteria of heuritics.
 
@@ -68,6 +67,13 @@ def heuristic_evaluation(nb_user,
     israeli : BOOL
         If israeli=True, apply the Israeli methods
         else, use the expected loss too.
+    trace_dir : STRING
+        If given, the directory where the trace of every experiment is saved.
+    seed : INT
+        The seed of the random streams (unpredictable by default).
+    lockstep : BOOL
+        If True, the experiments advance together in the batched engine
+        (see run_lockstep) and no trace is saved.
 
     Returns
     -------
@@ -85,102 +91,361 @@ def heuristic_evaluation(nb_user,
         The variance of the runtime per query.
     np.array(nb_query_vars) : ARRAY
         The variance of the number of queries.
+    loss_array : ARRAY
+        The mean expected loss after every query.
 
     """
-    # Save a reference to the original standard output
-    original_stdout = sys.stdout
-
-    with open(MY_PATH_TEMP_OUTPUTS, 'w') as f:
-        # Change the standard output to the file we created.
-        sys.stdout = f
-
-        percent_queried_means = []
-        runtime_per_query_means = []
-        nb_query_means = []
-        percent_queried_vars = []
-        runtime_per_query_vars = []
-        nb_query_vars = []
-        loss_array = np.zeros(int(nb_user*nb_item*(nb_item-1)/2))
-
-        if database == 'fixed_sushi':
-            df_rating, distrib = fixed_dataset_sushi(nb_user,
-                                                     nb_item,
-                                                     nb_matrix,
-                                                     nb_user_init_distrib,
-                                                     MY_PATH_SUSHI)
-        elif database == 'random_sushi':
-            df_rating, distrib = random_dataset_sushi(nb_user,
-                                                      nb_item,
-                                                      nb_matrix,
-                                                      nb_user_init_distrib,
-                                                      MY_PATH_SUSHI)
-        elif database == 'random':
-            df_rating, distrib = dataset_random(nb_user, nb_item)
-        else:
-            raise ValueError("Invalid database")
-        percent_queried_interm = []
-        runtime_per_query_interm = []
-        nb_query_interm = []
-
-        for k in range(nb_experiment):
-            print('Experiment', k)
-            # Id of the users
-            df_user_id = pd.DataFrame(np.array(range(df_rating.shape[0])))
-            # The set of votdataers
-            v = np.array(df_user_id).flatten()
-            # The rankings of the candidates by the users
-            rating = np.array(df_rating)
-            # The set of candidate items
-            c = np.arange(len(rating[0]))
-            # The set of possible permutations
-            vc = np.array(list(permutations(c)))
-            (nw,
-             runtime,
-             percent_queried,
-             loss,
-             time_array,
-             nb_queries) = find_preferences(v,
-                                            c,
-                                            vc,
-                                            gamma,
-                                            rating,
-                                            distrib,
-                                            heuristic,
-                                            termination_value,
-                                            epsilon,
-                                            delta,
-                                            israeli)
-            print('A first necessary winner for %s and %s users is candidate'
-                  % (heuristic, nb_user), nw)
-            print('Runtime = % seconds' % runtime)
-            print('%s cuts the communication up to %s percent'
-                  % (heuristic, percent_queried))
-            print("\n")
-            percent_queried_interm.append(percent_queried)
-            runtime_per_query_interm.append(runtime/nb_queries)
-            nb_query_interm.append(nb_queries)
-            loss_array[:len(loss)] += loss
-
-        percent_queried_means.append(np.mean(percent_queried_interm))
-        runtime_per_query_means.append(np.mean(runtime_per_query_interm))
-        nb_query_means.append(np.mean(nb_query_interm))
-
-        percent_queried_vars.append(np.var(percent_queried_interm))
-        runtime_per_query_vars.append(np.var(runtime_per_query_interm))
-        nb_query_vars.append(np.var(nb_query_interm))
-        loss_array /= nb_experiment
-
-        dataset = np.array([
-            nb_user * nb_item
-                ])
-    # Reset the standard output to its original value
-    sys.stdout = original_stdout
+    # One independent random stream for the dataset and for every experiment.
+    seed_sequences = rd.SeedSequence(seed).spawn(nb_experiment + 1)
+    df_rating, distrib = build_dataset(nb_user,
+                                       nb_item,
+                                       database,
+                                       nb_matrix,
+                                       nb_user_init_distrib,
+                                       rd.default_rng(seed_sequences[0]))
+    if lockstep:
+        results = run_lockstep(df_rating,
+                               distrib,
+                               gamma,
+                               heuristic,
+                               termination_value,
+                               israeli,
+                               nb_experiment,
+                               rd.default_rng(seed_sequences[1]))
+        return summarize_experiments(results, nb_user, nb_item)
+
+    results = []
+    for k in range(nb_experiment):
+        log_event(logging.INFO, 'experiment', number=k)
+        # The binary trace of the experiment.
+        trace_path = None
+        if trace_dir is not None:
+            trace_path = os.path.join(trace_dir, '%s_%s_%s.npz'
+                                      % (heuristic, nb_user, k))
+        results.append(run_experiment(df_rating,
+                                      distrib,
+                                      gamma,
+                                      heuristic,
+                                      termination_value,
+                                      epsilon,
+                                      delta,
+                                      israeli,
+                                      trace_path,
+                                      rd.default_rng(seed_sequences[k+1])))
+
+    return summarize_experiments(results, nb_user, nb_item)
+
+
+def build_dataset(nb_user,
+                  nb_item,
+                  database,
+                  nb_matrix,
+                  nb_user_init_distrib,
+                  rng=None):
+    """
+    Return the ratings and the initial distribution of a dataset.
+
+    Parameters
+    ----------
+    nb_user : INT
+        Number of users.
+    nb_item : INT
+        Numbers of items.
+    database : STRING
+        Dataset used (random, fixed_sushi or random_sushi).
+    nb_matrix : INT
+        Number of matrices needed for generating
+        an initial permutation distribution for the sushi dataset.
+    nb_user_init_distrib : INT
+        Number of users needed for generating
+        an initial permutation distribution for the sushi dataset.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    df_rating : DATAFRAME
+        The rankings of the candidates by the users.
+    distrib : ARRAY
+        The initial permutation distribution.
+
+    """
+    if database == 'fixed_sushi':
+        df_rating, distrib = fixed_dataset_sushi(nb_user,
+                                                 nb_item,
+                                                 nb_matrix,
+                                                 nb_user_init_distrib,
+                                                 MY_PATH_SUSHI)
+    elif database == 'random_sushi':
+        df_rating, distrib = random_dataset_sushi(nb_user,
+                                                  nb_item,
+                                                  nb_matrix,
+                                                  nb_user_init_distrib,
+                                                  MY_PATH_SUSHI,
+                                                  rng)
+    elif database == 'random':
+        df_rating, distrib = dataset_random(nb_user, nb_item, rng)
+    else:
+        raise ValueError("Invalid database")
+    return(df_rating, distrib)
+
+
+def run_experiment(df_rating,
+                   distrib,
+                   gamma,
+                   heuristic,
+                   termination_value,
+                   epsilon,
+                   delta,
+                   israeli,
+                   trace_path=None,
+                   rng=None,
+                   memory=None):
+    """
+    Return the performance criteria of one experiment.
+
+    Parameters
+    ----------
+    df_rating : DATAFRAME
+        The rankings of the candidates by the users.
+    distrib : ARRAY
+        The initial permutation distribution.
+    gamma : INT
+        Sample size for PrWin.
+    heuristic : STRING
+        Name of the heuristic.
+    termination_value : FLOAT
+        Termination value for the expected loss.
+    epsilon : FLOAT
+        Desired threeshold for EU loss.
+    delta : FLOAT
+        Confidence parameter.
+    israeli : BOOL
+        If israeli=True, apply the Israeli methods
+        else, use the expected loss too.
+    trace_path : STRING
+        If given, the path where the trace of the experiment is saved.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+    memory : MemoryAccount
+        If given, the memory used by the experiment is recorded in it.
+
+    Returns
+    -------
+    percent_queried : FLOAT
+        The percentage of dataset queried.
+    runtime_per_query : FLOAT
+        The runtime per query.
+    nb_queries : INT
+        The number of queries.
+    loss : ARRAY
+        The expected loss after every query.
+
+    """
+    # Id of the users
+    df_user_id = pd.DataFrame(np.array(range(df_rating.shape[0])))
+    # The set of voters
+    v = np.array(df_user_id).flatten()
+    # The rankings of the candidates by the users
+    rating = np.array(df_rating)
+    # The set of candidate items
+    c = np.arange(len(rating[0]))
+    # The set of possible permutations
+    vc = np.array(list(permutations(c)))
+    (nw,
+     runtime,
+     percent_queried,
+     loss,
+     _,
+     nb_queries) = find_preferences(v,
+                                    c,
+                                    vc,
+                                    gamma,
+                                    rating,
+                                    distrib,
+                                    heuristic,
+                                    termination_value,
+                                    epsilon,
+                                    delta,
+                                    israeli,
+                                    trace_path,
+                                    rng,
+                                    memory=memory)
+    log_event(logging.INFO, 'experiment_result',
+              heuristic=heuristic,
+              nb_user=len(v),
+              winner=nw,
+              runtime=runtime,
+              communication_cut=percent_queried,
+              nb_queries=nb_queries)
+    return(percent_queried, runtime/nb_queries, nb_queries, loss)
+
+
+def run_lockstep(df_rating,
+                 distrib,
+                 gamma,
+                 heuristic,
+                 termination_value,
+                 israeli,
+                 nb_experiment,
+                 rng=None):
+    """
+    Return the performance criteria of experiments run in lockstep.
+
+    The experiments are the groups of the batched engine: they share the
+    permutations, the tables and the sampling kernels, and every one stops
+    on its own. They draw from a single random stream, so their results
+    differ from the ones of run_experiment for the same seed.
+
+    Parameters
+    ----------
+    df_rating : DATAFRAME
+        The rankings of the candidates by the users.
+    distrib : ARRAY
+        The initial permutation distribution.
+    gamma : INT
+        Sample size for PrWin.
+    heuristic : STRING
+        Name of the heuristic.
+    termination_value : FLOAT
+        Termination value for the expected loss.
+    israeli : BOOL
+        If israeli=True, apply the Israeli methods
+        else, use the expected loss too.
+    nb_experiment : INT
+        Number of experiments.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    results : LIST
+        The criteria of run_experiment for every experiment, the runtime
+        per query being the mean over all the experiments.
+
+    """
+    rating = np.array(df_rating)
+    nb_user, nb_item = rating.shape
+    starttime = timeit.default_timer()
+    (winners,
+     nb_queries,
+     _,
+     losses) = run_batched(np.broadcast_to(rating, (nb_experiment,
+                                                    nb_user,
+                                                    nb_item)),
+                           distrib,
+                           heuristic,
+                           gamma,
+                           termination_value,
+                           israeli,
+                           rng=rng)
+    runtime_per_query = (timeit.default_timer() - starttime) / sum(nb_queries)
+    results = []
+    for k in range(nb_experiment):
+        # The cut in the communication cost.
+        percent_queried = 100 * (1 - (2*nb_queries[k]
+                                      / (nb_item*nb_user*(nb_item-1))))
+        loss = np.array([]) if israeli else losses[k, :nb_queries[k]+1]
+        log_event(logging.INFO, 'experiment_result',
+                  heuristic=heuristic,
+                  nb_user=nb_user,
+                  winner=winners[k],
+                  communication_cut=percent_queried,
+                  nb_queries=nb_queries[k])
+        results.append((percent_queried, runtime_per_query, nb_queries[k],
+                        loss))
+    return results
+
+
+def summarize_experiments(results, nb_user, nb_item):
+    """
+    Return the means and variances of the criteria of several experiments.
+
+    Parameters
+    ----------
+    results : LIST
+        The results of run_experiment.
+    nb_user : INT
+        Number of users.
+    nb_item : INT
+        Numbers of items.
+
+    Returns
+    -------
+    The same criteria as heuristic_evaluation.
+
+    """
+    percent_queried_interm = [r[0] for r in results]
+    runtime_per_query_interm = [r[1] for r in results]
+    nb_query_interm = [r[2] for r in results]
+    loss_array = np.zeros(int(nb_user*nb_item*(nb_item-1)/2))
+    for r in results:
+        loss_array[:len(r[3])] += r[3]
+    loss_array /= len(results)
+
+    dataset = np.array([
+        nb_user * nb_item
+        ])
 
     return(dataset,
-           np.array(percent_queried_means),
-           np.array(runtime_per_query_means),
-           np.array(nb_query_means),
-           np.array(percent_queried_vars),
-           np.array(runtime_per_query_vars),
-           np.array(nb_query_vars),
+           np.array([np.mean(percent_queried_interm)]),
+           np.array([np.mean(runtime_per_query_interm)]),
+           np.array([np.mean(nb_query_interm)]),
+           np.array([np.var(percent_queried_interm)]),
+           np.array([np.var(runtime_per_query_interm)]),
+           np.array([np.var(nb_query_interm)]),
            loss_array)
+
+
+def print_results(stats, heuristic, nb_user, nb_item, file):
+    """
+    Write the criteria returned by heuristic_evaluation in a text file.
+
+    Parameters
+    ----------
+    stats : TUPLE
+        The criteria returned by heuristic_evaluation.
+    heuristic : STRING
+        Name of the heuristic.
+    nb_user : INT
+        Number of users.
+    nb_item : INT
+        Numbers of items.
+    file : FILE
+        The opened text file.
+
+    Returns
+    -------
+    None.
+
+    """
+    (_,
+     percent_queried_array,
+     runtime_per_query_array,
+     nb_query_array,
+     _,
+     _,
+     nb_query_vars,
+     loss_array) = stats
+    log_event(logging.INFO, 'results',
+              heuristic=heuristic,
+              nb_user=nb_user,
+              nb_item=nb_item,
+              percent_queried=percent_queried_array,
+              runtime_per_query=runtime_per_query_array,
+              nb_queries=nb_query_array,
+              nb_queries_var=nb_query_vars,
+              loss=loss_array)
+    print('The heuristic: ', heuristic, file=file)
+    print('The number of users: ', nb_user, file=file)
+    print('The number of items: ', nb_item, file=file)
+    print('The percentages of dataset queried: ',
+          percent_queried_array, file=file)
+    print('The runtimes per query (seconds): ',
+          runtime_per_query_array, file=file)
+    print('The numbers of queries asked: ',
+          nb_query_array, file=file)
+    print('The variance of the number of queries asked: ',
+          nb_query_vars, file=file)
+    print('The expected losses: ', loss_array, file=file)
+    print("\n", file=file)
@@ -6,16 +6,22 @@
 """
 
 from itertools import permutations, combinations
+import logging
 import re
 import scipy.stats as st
 import numpy as np
 from numpy import random as rd
 from item_winning_proba import win_proba
-from other_useful_functions import posterior_distrib, proba_query
+from anytime_selection import anytime_query
+from successive_halving import halving_query
+from other_useful_functions import (best_queries,
+                                    posterior_distrib,
+                                    proba_query)
+from elicitation_log import log_event
 
 
 # pylint: disable=C0103
-def info_gain(v, c, vc, gamma, distrib):
+def info_gain(v, c, vc, gamma, distrib, rng=None):
     """
     Return the information gains of all the qi,cj>ck.
 
@@ -31,6 +37,8 @@ def info_gain(v, c, vc, gamma, distrib):
         The sample size.
     distrib : ARRAY
         The current permutation distribution.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
 
     Returns
     -------
@@ -38,12 +46,14 @@ def info_gain(v, c, vc, gamma, distrib):
         IG(vi, cj>ck)
 
     """
+    if rng is None:
+        rng = rd.default_rng()
     # The list of cj > ck.
     comp_cand = np.array(list(permutations(c, 2)))
     # The information gains of the queries.
     ig_array = np.zeros((len(v), len(comp_cand)))
     # The winning probability array regarding the current distribution.
-    pr_win = win_proba(v, c, vc, gamma, distrib)
+    pr_win = win_proba(v, c, vc, gamma, distrib, rng)
     # The entropy function.
     entropy = st.entropy(pk=pr_win, base=2)
 
@@ -58,7 +68,7 @@ def info_gain(v, c, vc, gamma, distrib):
                                              distrib,
                                              v[i])
             # The winning proba array knowing qi,cj>ck.
-            post_pr_win = win_proba(v, c, vc, gamma, post_distrib)
+            post_pr_win = win_proba(v, c, vc, gamma, post_distrib, rng)
             # The posterior entropy function.
             ig_array[i][q] = st.entropy(pk=post_pr_win, base=2)
 
@@ -71,7 +81,7 @@ def info_gain(v, c, vc, gamma, distrib):
     return ig_dict
 
 
-def weighted_info_gain(v, c, vc, gamma, distrib, queries):
+def weighted_info_gain(v, c, vc, gamma, distrib, queries, rng=None):
     """
     Return the weighted information gains of the queries qi,cj,ck.
 
@@ -87,6 +97,8 @@ def weighted_info_gain(v, c, vc, gamma, distrib, queries):
         The sample size.
     distrib : ARRAY
         The current permutation distribution.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
 
     Returns
     -------
@@ -94,8 +106,10 @@ def weighted_info_gain(v, c, vc, gamma, distrib, queries):
         WIG(vi,cj,ck)
 
     """
+    if rng is None:
+        rng = rd.default_rng()
     # The information gains of the queries.
-    ig_dict = info_gain(v, c, vc, gamma, distrib)
+    ig_dict = info_gain(v, c, vc, gamma, distrib, rng)
     # Unordered permutations.
     comb = np.array(list(combinations(c, 2)))
     # The weighted information gains of the queries.
@@ -123,7 +137,8 @@ def weighted_info_gain(v, c, vc, gamma, distrib, queries):
     return wig_dict
 
 
-def optimal_wig_query(v, c, vc, gamma, distrib, queries):
+def optimal_wig_query(v, c, vc, gamma, distrib, queries, rng=None,
+                      time_budget=None, halving=False):
     """
     Return the query with the highest WIG.
 
@@ -139,7 +154,14 @@ def optimal_wig_query(v, c, vc, gamma, distrib, queries):
         The sample size.
     distrib : ARRAY
         The current permutation distribution.
-
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+    time_budget : FLOAT
+        If given, the query is selected anytime within this time (seconds),
+        see anytime_selection.
+    halving : BOOL
+        If True, the samples are allocated to the queries by successive
+        halving (see successive_halving), unless a time budget is given.
 
     Returns
     -------
@@ -149,13 +171,59 @@ def optimal_wig_query(v, c, vc, gamma, distrib, queries):
         The ingo gain of the chosen query.
 
     """
-    wig_dict = weighted_info_gain(v, c, vc, gamma, distrib, queries)
+    if rng is None:
+        rng = rd.default_rng()
+    if time_budget is not None:
+        return anytime_query('IGB', v, c, vc, gamma, distrib, queries,
+                             time_budget, rng)
+    if halving:
+        return halving_query('IGB', v, c, vc, gamma, distrib, queries, rng)
+    wig_dict = weighted_info_gain(v, c, vc, gamma, distrib, queries, rng)
     # Choose the query with the highest WIG.
     max_chosen_query = max(wig_dict.values())
-    print('WIG of the query asked: ', max_chosen_query)
+    log_event(logging.DEBUG, 'wig', value=max_chosen_query)
     chosen_query_list = [k for k, v in wig_dict.items()
                          if v == max_chosen_query]
     # Randomly choose a query among the ones with the highest WIG.
-    chosen_query = rd.choice(chosen_query_list)
+    chosen_query = rng.choice(chosen_query_list)
     return([int(s) for s in re.findall(r'\b\d+\b', chosen_query)],
            max_chosen_query)
+
+
+def optimal_wig_queries(v, c, vc, gamma, distrib, queries, k, rng=None):
+    """
+    Return the k queries with the highest WIG, at most one per voter.
+
+    Parameters
+    ----------
+    v : ARRAY
+        The set of voters.
+    c : ARRAY
+        The set of candidates.
+    vc : ARRAY
+        The set of permutations.
+    gamma : INT
+        The sample size.
+    distrib : ARRAY
+        The current permutation distribution.
+    queries : LIST
+        The queries already known.
+    k : INT
+        The number of queries wanted.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    chosen_queries : LIST
+        The chosen queries [vi, cj, ck], by decreasing WIG.
+    values : LIST
+        The WIGs of the chosen queries.
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+    wig_dict = weighted_info_gain(v, c, vc, gamma, distrib, queries, rng)
+    chosen_queries, values = best_queries(wig_dict, k, rng)
+    log_event(logging.DEBUG, 'wig', value=values[0], nb_queries=len(values))
+    return(chosen_queries, values)
@@ -9,10 +9,11 @@ import operator
 import numpy as np
 from numpy import random as rd
 from borda_voting_protocol import borda
+from metrics import MC_SAMPLES
 
 
 # pylint: disable=C0103
-def win_proba(v, c, vc, gamma, distrib):
+def win_proba(v, c, vc, gamma, distrib, rng=None):
     """
     Return the estimated winning probabilities of the candidates.
 
@@ -28,6 +29,8 @@ def win_proba(v, c, vc, gamma, distrib):
         The sample size.
     distrib : ARRAY
         The current rankings probability distributions.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
 
     Returns an array.
     -------
@@ -35,6 +38,8 @@ def win_proba(v, c, vc, gamma, distrib):
         The winning proba array.
 
     """
+    if rng is None:
+        rng = rd.default_rng()
     # Initialize.
     pr_win = np.zeros(len(c))
     # Loop on the sample size.
@@ -43,7 +48,7 @@ def win_proba(v, c, vc, gamma, distrib):
         # Loop on the number of voters.
         for i in range(len(v)):
             # Draw a permutation for voter i regarding distrib[i].
-            rd_permut.append(vc[rd.choice(len(vc), 1, p=distrib[i])])
+            rd_permut.append(vc[rng.choice(len(vc), 1, p=distrib[i])])
         all_rd_permut = np.array(rd_permut).flatten().reshape((len(v), len(c)))
 
         # Compute the items expected Borda scores regarding the drawn rankings.
@@ -56,5 +61,6 @@ def win_proba(v, c, vc, gamma, distrib):
 
     # Divide the number of times the items won by the number of iterations.
     pr_win /= gamma
+    MC_SAMPLES.inc(gamma, function='win_proba')
     # Return the winning probabilities array.
     return pr_win
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""A resumable store of experiment cells.
+
+@author: Maeva.Caillat
+
+This module keeps the cells of an experiment grid in a SQLite database.
+Every (heuristic, nb_user, database, replica, seed, config) cell is
+pending, running, done or failed, and done cells keep their results, so a
+restarted sweep skips them. config is a hash of the settings shared by the
+cells (CONFIG_FIELDS), so the results of different settings are never
+mixed. Several worker processes, of one or several sweeps, can pull cells
+at the same time: a running cell belongs to the worker which claimed it
+and is only reclaimed when its lease has expired.
+
+"""
+
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import time
+import numpy as np
+
+
+# pylint: disable=C0103
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+LEASE = 24 * 3600
+"""float: The time (seconds) after which a running cell is reclaimed.
+
+It must be longer than the longest cell, a worker still running a cell
+whose lease has expired may see it run again by another one.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cells (
+    heuristic TEXT NOT NULL,
+    nb_user INTEGER NOT NULL,
+    database TEXT NOT NULL,
+    replica INTEGER NOT NULL,
+    seed INTEGER NOT NULL,
+    config TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    task TEXT NOT NULL,
+    result TEXT,
+    memory TEXT,
+    worker TEXT,
+    started REAL,
+    finished REAL,
+    PRIMARY KEY (heuristic, nb_user, database, replica, seed, config)
+)
+"""
+"""string: The table of the cells.
+
+task, result and memory are JSON texts, memory holding the summary of
+memory_accounting.MemoryAccount if it was recorded.
+worker is the worker running the cell, started and finished are Unix times.
+"""
+
+KEY_COLUMNS = ('heuristic', 'nb_user', 'database', 'replica', 'seed',
+               'config')
+
+CONFIG_FIELDS = ('nb_item', 'gamma', 'termination_value', 'epsilon', 'delta',
+                 'nb_matrix', 'nb_user_init_distrib', 'israeli')
+"""tuple: The settings of a task which change its result, besides its key."""
+
+WHERE_KEY = ' AND '.join('%s = ?' % k for k in KEY_COLUMNS)
+"""string: The condition selecting the cell of a key."""
+
+
+def open_store(file_path):
+    """
+    Return a connection to a job store, created if needed.
+
+    Parameters
+    ----------
+    file_path : STRING
+        The path of the SQLite database.
+
+    Returns
+    -------
+    conn : CONNECTION
+        The connection, in autocommit mode.
+
+    """
+    conn = sqlite3.connect(file_path, timeout=60, isolation_level=None)
+    # Readers do not block the worker writing a result.
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(SCHEMA)
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(cells)')]
+    if 'config' not in columns:
+        conn.close()
+        raise ValueError('Invalid job store: %s has no config column'
+                         % file_path)
+    return conn
+
+
+def config_hash(settings):
+    """
+    Return the hash of the settings of a task or of a grid.
+
+    Parameters
+    ----------
+    settings : DICT
+        A task returned by experiment_runner.expand_grid, or a grid.
+
+    Returns
+    -------
+    STRING
+        The hexadecimal hash of the values of CONFIG_FIELDS.
+
+    """
+    text = json.dumps([settings[k] for k in CONFIG_FIELDS])
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def cell_key(task):
+    """Return the primary key of the cell of a task."""
+    return tuple(task[k] for k in KEY_COLUMNS[:-1]) + (config_hash(task),)
+
+
+def worker_name():
+    """Return the name of the current worker (host:pid)."""
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+def add_cells(conn, tasks):
+    """
+    Add the cells of tasks, keeping the ones already in the store.
+
+    Parameters
+    ----------
+    conn : CONNECTION
+        The connection to the store.
+    tasks : LIST
+        The tasks returned by experiment_runner.expand_grid.
+
+    Returns
+    -------
+    None.
+
+    """
+    conn.executemany(
+        'INSERT OR IGNORE INTO cells '
+        '(heuristic, nb_user, database, replica, seed, config, task) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [cell_key(task) + (json.dumps(task),) for task in tasks])
+
+
+def reset_cells(conn, lease=LEASE, retry_failed=False):
+    """
+    Put back to pending the cells left running by a crashed worker.
+
+    The cells claimed by live workers are kept: only the running cells
+    whose lease has expired are reset.
+
+    Parameters
+    ----------
+    conn : CONNECTION
+        The connection to the store.
+    lease : FLOAT
+        The time (seconds) after which a running cell is reset.
+    retry_failed : BOOL
+        If True, the failed cells are reset too.
+
+    Returns
+    -------
+    INT
+        The number of cells reset.
+
+    """
+    nb_reset = conn.execute(
+        'UPDATE cells SET status = ?, worker = NULL, started = NULL '
+        'WHERE status = ? AND started < ?',
+        (PENDING, RUNNING, now() - lease)).rowcount
+    if retry_failed:
+        nb_reset += conn.execute(
+            'UPDATE cells SET status = ?, worker = NULL, started = NULL, '
+            'result = NULL, finished = NULL WHERE status = ?',
+            (PENDING, FAILED)).rowcount
+    return nb_reset
+
+
+def claim_cell(conn, worker=None):
+    """
+    Return the task of a pending cell and mark it as running.
+
+    The largest groups are claimed first to balance the workers.
+
+    Parameters
+    ----------
+    conn : CONNECTION
+        The connection to the store.
+    worker : STRING
+        The name of the worker (worker_name() by default).
+
+    Returns
+    -------
+    task : DICT
+        The task of the cell, None if no cell is pending.
+
+    """
+    if worker is None:
+        worker = worker_name()
+    # The write lock is taken before reading, so two workers
+    # cannot claim the same cell.
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute(
+            'SELECT rowid, task FROM cells WHERE status = ? '
+            'ORDER BY nb_user DESC, rowid LIMIT 1', (PENDING,)).fetchone()
+        if row is not None:
+            conn.execute(
+                'UPDATE cells SET status = ?, worker = ?, started = ? '
+                'WHERE rowid = ?', (RUNNING, worker, now(), row[0]))
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    if row is None:
+        return None
+    return json.loads(row[1])
+
+
+def complete_cell(conn, task, result, memory=None, worker=None):
+    """
+    Save the result of a task and mark its cell as done.
+
+    The result is dropped if the cell was reclaimed by another worker
+    in the meantime.
+
+    Parameters
+    ----------
+    conn : CONNECTION
+        The connection to the store.
+    task : DICT
+        The task of the cell.
+    result : TUPLE
+        The result of heuristic_evaluation.run_experiment.
+    memory : DICT
+        The memory used by the task, if it was recorded.
+    worker : STRING
+        The worker which claimed the cell (worker_name() by default).
+
+    Returns
+    -------
+    BOOL
+        True if the result was saved.
+
+    """
+    if worker is None:
+        worker = worker_name()
+    return conn.execute(
+        'UPDATE cells SET status = ?, result = ?, memory = ?, finished = ? '
+        'WHERE %s AND (worker = ? OR status = ?)' % WHERE_KEY,
+        (DONE, json.dumps(encode_result(result)), json.dumps(memory), now())
+        + cell_key(task) + (worker, PENDING)).rowcount > 0
+
+
+def fail_cell(conn, task, error, worker=None):
+    """
+    Mark the cell of a task as failed, keeping the error message.
+
+    The cell is left as it is if it was reclaimed by another worker.
+
+    Parameters
+    ----------
+    conn : CONNECTION
+        The connection to the store.
+    task : DICT
+        The task of the cell.
+    error : STRING
+        The error message.
+    worker : STRING
+        The worker which claimed the cell (worker_name() by default).
+
+    Returns
+    -------
+    BOOL
+        True if the cell was marked as failed.
+
+    """
+    if worker is None:
+        worker = worker_name()
+    return conn.execute(
+        'UPDATE cells SET status = ?, result = ?, finished = ? '
+        'WHERE %s AND worker = ? AND status = ?' % WHERE_KEY,
+        (FAILED, json.dumps(error), now())
+        + cell_key(task) + (worker, RUNNING)).rowcount > 0
+
+
+def load_results(conn):
+    """
+    Return the results of the done cells.
+
+    Parameters
+    ----------
+    conn : CONNECTION
+        The connection to the store.
+
+    Returns
+    -------
+    results : DICT
+        The results of run_experiment, by cell key.
+
+    """
+    return {tuple(row[:6]): decode_result(json.loads(row[6]))
+            for row in conn.execute(
+                'SELECT %s, result FROM cells WHERE status = ?'
+                % ', '.join(KEY_COLUMNS), (DONE,))}
+
+
+def load_memory(conn):
+    """
+    Return the memory used by the done cells where it was recorded.
+
+    Parameters
+    ----------
+    conn : CONNECTION
+        The connection to the store.
+
+    Returns
+    -------
+    memory : DICT
+        The summaries of memory_accounting.MemoryAccount, by cell key.
+
+    """
+    return {tuple(row[:6]): json.loads(row[6])
+            for row in conn.execute(
+                'SELECT %s, memory FROM cells WHERE status = ? '
+                "AND memory IS NOT NULL AND memory != 'null'"
+                % ', '.join(KEY_COLUMNS), (DONE,))}
+
+
+def count_cells(conn):
+    """Return the number of cells for every status."""
+    return dict(conn.execute(
+        'SELECT status, COUNT(*) FROM cells GROUP BY status'))
+
+
+def encode_result(result):
+    """Return the result of run_experiment as JSON serializable types."""
+    percent_queried, runtime_per_query, nb_queries, loss = result
+    return [float(percent_queried),
+            float(runtime_per_query),
+            int(nb_queries),
+            np.asarray(loss, dtype=float).tolist()]
+
+
+def decode_result(result):
+    """Return the result of run_experiment saved by encode_result."""
+    return(result[0], result[1], result[2], np.array(result[3]))
+
+
+def now():
+    """Return the current Unix time."""
+    return time.time()
@@ -6,10 +6,10 @@
 Run this module to run the whole code.
 
 """
-import sys
+import os
 
 
-from data import (nb_user,
+from data import (nb_user_list,
                   nb_item,
                   gamma,
                   termination_value,
@@ -20,8 +20,13 @@ from data import (nb_user,
                   database,
                   nb_matrix,
                   nb_user_init_distrib,
-                  israeli)
-from heuristic_evaluation import heuristic_evaluation
+                  israeli,
+                  log_level,
+                  lockstep,
+                  seed)
+from heuristic_evaluation import heuristic_evaluation, print_results
+from elicitation_log import json_log
+from metrics import write_metrics
 
 
 # pylint: disable=C0103
@@ -35,48 +40,56 @@ MY_PATH_OUTPUTS = ('C:/Users/maeva/Documents/Cours_ei4/INRAE/prefelicitgroup/'
                    + 'inrae.recomsystems/inrae.recomsystems/outputs/'
                    + 'results.txt')
 
-nb_user_list = [5, 7, 10, 12, 15]
+"""MY_PATH_LOG = ('/home/mmip/Documents/Python/prefelicitgroup/'
+               + 'inrae.recomsystems/inrae.recomsystems/outputs/'
+               + 'temp_results.jsonl')"""
+"""MY_PATH_LOG = ('/Users/sonialementec/Documents/INRAE/Git/'
+               + 'inrae.recomsystems/inrae.recomsystems/outputs/'
+               + 'temp_results.jsonl')"""
+MY_PATH_LOG = ('C:/Users/maeva/Documents/Cours_ei4/INRAE/prefelicitgroup/'
+               + 'inrae.recomsystems/inrae.recomsystems/outputs/'
+               + 'temp_results.jsonl')
 
-# Save a reference to the original standard output
-original_stdout = sys.stdout
+"""MY_PATH_TRACES = ('/home/mmip/Documents/Python/prefelicitgroup/'
+                  + 'inrae.recomsystems/inrae.recomsystems/outputs/traces')"""
+"""MY_PATH_TRACES = ('/Users/sonialementec/Documents/INRAE/Git/'
+                  + 'inrae.recomsystems/inrae.recomsystems/outputs/traces')"""
+MY_PATH_TRACES = ('C:/Users/maeva/Documents/Cours_ei4/INRAE/prefelicitgroup/'
+                  + 'inrae.recomsystems/inrae.recomsystems/outputs/traces')
 
-with open(MY_PATH_OUTPUTS, 'w') as f:
-    # Change the standard output to the file we created.
-    sys.stdout = f
+"""MY_PATH_METRICS = ('/home/mmip/Documents/Python/prefelicitgroup/'
+                   + 'inrae.recomsystems/inrae.recomsystems/outputs/'
+                   + 'metrics.prom')"""
+"""MY_PATH_METRICS = ('/Users/sonialementec/Documents/INRAE/Git/'
+                   + 'inrae.recomsystems/inrae.recomsystems/outputs/'
+                   + 'metrics.prom')"""
+MY_PATH_METRICS = ('C:/Users/maeva/Documents/Cours_ei4/INRAE/prefelicitgroup/'
+                   + 'inrae.recomsystems/inrae.recomsystems/outputs/'
+                   + 'metrics.prom')
+
+# Every experiment is saved as a binary trace (see elicitation_trace).
+os.makedirs(MY_PATH_TRACES, exist_ok=True)
 
+# The details of the experiments go to a JSON lines file,
+# the summary of every group size to the results file.
+with json_log(MY_PATH_LOG, log_level), open(MY_PATH_OUTPUTS, 'w') as f:
     for i in nb_user_list:
-        (dataset,
-         percent_queried_array,
-         runtime_per_query_array,
-         nb_query_array,
-         percent_queried_vars,
-         runtime_per_query_vars,
-         nb_query_vars,
-         loss_array) = heuristic_evaluation(
-             i,
-             nb_item,
-             gamma,
-             heuristic,
-             termination_value,
-             epsilon,
-             delta,
-             nb_experiment,
-             database,
-             nb_matrix,
-             nb_user_init_distrib,
-             israeli)
-        print('The heuristic: ', heuristic)
-        print('The number of users: ', i)
-        print('The number of items: ', nb_item)
-        print('The percentages of dataset queried: ',
-              percent_queried_array)
-        print('The runtimes per query (seconds): ',
-              runtime_per_query_array)
-        print('The numbers of queries asked: ',
-              nb_query_array)
-        print('The variance of the number of queries asked: ',
-              nb_query_vars)
-        print('The expected losses: ', loss_array)
-        print("\n")
-    # Reset the standard output to its original value
-    sys.stdout = original_stdout
+        # The random streams of every group size derive from (seed, i).
+        stats = heuristic_evaluation(i,
+                                     nb_item,
+                                     gamma,
+                                     heuristic,
+                                     termination_value,
+                                     epsilon,
+                                     delta,
+                                     nb_experiment,
+                                     database,
+                                     nb_matrix,
+                                     nb_user_init_distrib,
+                                     israeli,
+                                     MY_PATH_TRACES,
+                                     [seed, i],
+                                     lockstep)
+        print_results(stats, heuristic, i, nb_item, f)
+        # The counters and histograms so far (see metrics).
+        write_metrics(MY_PATH_METRICS)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Memory accounting of the elicitation.
+
+@author: Maeva.Caillat
+
+This module measures, at every round of find_preferences:
+    - the bytes held by the main structures (the V x m! distribution,
+      the m! x m permutations array vc, the list of queries and the lists
+      of inferior candidates),
+    - the peak allocation of every phase of the round (query selection,
+      update with the answer, expected loss), with tracemalloc. The
+      posterior copies of the distribution made by the heuristics are
+      temporary, they are counted in the peak of the selection.
+
+"""
+
+import sys
+import tracemalloc
+import numpy as np
+
+
+# pylint: disable=C0103
+PHASES = ('selection', 'update', 'loss')
+"""tuple: The phases of a round of find_preferences."""
+
+
+def structure_bytes(structure):
+    """
+    Return the number of bytes held by an array or nested lists.
+
+    Parameters
+    ----------
+    structure : ARRAY or LIST
+        The structure measured.
+
+    Returns
+    -------
+    INT
+        Its size in bytes, including the objects it contains.
+
+    """
+    if isinstance(structure, np.ndarray):
+        return structure.nbytes
+    if isinstance(structure, (list, tuple)):
+        return (sys.getsizeof(structure)
+                + sum(structure_bytes(e) for e in structure))
+    return sys.getsizeof(structure)
+
+
+class MemoryAccount:
+    """
+    Memory used by an elicitation, round after round.
+
+    Parameters
+    ----------
+    trace_allocations : BOOL
+        If True, the peak allocation of every phase is measured with
+        tracemalloc (started if needed), which slows the elicitation down.
+        Otherwise only the sizes of the structures are recorded.
+
+    """
+
+    def __init__(self, trace_allocations=True):
+        self.trace_allocations = trace_allocations
+        self.rounds = []
+        self.current = {}
+        self.started_tracing = False
+        self.phase_start = 0
+
+    def start(self):
+        """Start tracemalloc if the allocations are traced."""
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def stop(self):
+        """Stop tracemalloc if it was started by this account."""
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def start_phase(self):
+        """Start measuring the peak allocation of a phase of the round."""
+        if self.trace_allocations and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self.phase_start = tracemalloc.get_traced_memory()[0]
+
+    def end_phase(self, name):
+        """
+        Record the peak allocation of a phase of the current round.
+
+        The peak is counted from the memory allocated when the phase starts.
+
+        Parameters
+        ----------
+        name : STRING
+            The name of the phase (see PHASES).
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.trace_allocations and tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1] - self.phase_start
+            self.current['peak_' + name] = max(
+                peak, self.current.get('peak_' + name, 0))
+
+    def end_round(self, **structures):
+        """
+        Record the sizes of the structures at the end of a round.
+
+        Parameters
+        ----------
+        **structures : DICT
+            The structures to measure, by name.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.current.update({name: structure_bytes(s)
+                             for name, s in structures.items()})
+        self.rounds.append(self.current)
+        self.current = {}
+
+    def summary(self):
+        """
+        Return the maximum of every measure over the rounds.
+
+        Returns
+        -------
+        summary : DICT
+            The maximal bytes held by every structure and the maximal peak
+            of every phase (keys peak_selection, peak_update, peak_loss).
+
+        """
+        summary = {}
+        for r in self.rounds:
+            for name, nb_bytes in r.items():
+                summary[name] = max(nb_bytes, summary.get(name, 0))
+        return summary
+
+
+def merge_summaries(summaries):
+    """
+    Return the maximum of every measure over several summaries.
+
+    Parameters
+    ----------
+    summaries : LIST
+        The results of MemoryAccount.summary, for instance
+        one per experiment of a cell.
+
+    Returns
+    -------
+    DICT
+        The maximal value of every measure.
+
+    """
+    merged = {}
+    for summary in summaries:
+        for name, nb_bytes in summary.items():
+            merged[name] = max(nb_bytes, merged.get(name, 0))
+    return merged
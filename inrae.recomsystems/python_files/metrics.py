@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""Monitoring metrics of the elicitation.
+
+@author: Maeva.Caillat
+
+This module contains the counters and histograms maintained by the core
+modules (find_preferences, win_proba, expected_loss, posterior_distrib)
+and their export in the Prometheus text format, to a file or to an HTTP
+endpoint. The metrics are kept per process: the workers of a process pool
+each have their own.
+
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import os
+import threading
+
+
+# pylint: disable=C0103
+REGISTRY = []
+"""list: The metrics exported, in the order of their creation."""
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+"""string: The content type of the Prometheus text format."""
+
+
+class Metric:
+    """
+    Base class of the metrics, holding one value per set of labels.
+
+    Parameters
+    ----------
+    name : STRING
+        The name of the metric.
+    documentation : STRING
+        The help text of the metric.
+    labelnames : TUPLE
+        The names of the labels (none by default).
+
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        """Return the label values of labels, in the order of labelnames."""
+        if set(labels) != set(self.labelnames):
+            raise ValueError('Expected the labels %s' % (self.labelnames,))
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def label_text(self, key, extra=()):
+        """Return the labels of a sample in the Prometheus syntax."""
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (n, escape(v)) for n, v in pairs)
+
+    def reset(self):
+        """Forget all the values."""
+        with self.lock:
+            self.values.clear()
+
+    def samples(self):
+        """Return the lines of the samples of the metric."""
+        raise NotImplementedError
+
+    def exposition(self):
+        """Return the metric in the Prometheus text format."""
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+        with self.lock:
+            lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """A value which only increases, such as a number of samples drawn."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """
+        Increase the counter.
+
+        Parameters
+        ----------
+        amount : FLOAT
+            The increment (1 by default).
+        **labels : DICT
+            The values of the labels.
+
+        Returns
+        -------
+        None.
+
+        """
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Return the value of the counter for labels."""
+        return self.values.get(self.key(labels), 0)
+
+    def samples(self):
+        return ['%s%s %s' % (self.name, self.label_text(key), format_value(x))
+                for key, x in sorted(self.values.items())]
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values, counted in cumulative buckets.
+
+    Parameters
+    ----------
+    name : STRING
+        The name of the metric.
+    documentation : STRING
+        The help text of the metric.
+    buckets : TUPLE
+        The increasing upper bounds of the buckets (+Inf is added).
+    labelnames : TUPLE
+        The names of the labels (none by default).
+
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """
+        Count an observed value.
+
+        Parameters
+        ----------
+        value : FLOAT
+            The value observed (a latency, a number of queries...).
+        **labels : DICT
+            The values of the labels.
+
+        Returns
+        -------
+        None.
+
+        """
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                # The counts of the buckets, the sum and the count.
+                self.values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+            counts = self.values[key]
+            counts[0][bisect.bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def count(self, **labels):
+        """Return the number of observed values for labels."""
+        counts = self.values.get(self.key(labels))
+        return 0 if counts is None else counts[2]
+
+    def samples(self):
+        lines = []
+        for key, (counts, total, number) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %s' % (
+                    self.name,
+                    self.label_text(key, [('le', format_value(bound))]),
+                    cumulative))
+            lines.append('%s_sum%s %s' % (self.name, self.label_text(key),
+                                          format_value(total)))
+            lines.append('%s_count%s %s' % (self.name, self.label_text(key),
+                                            number))
+        return lines
+
+
+def escape(value):
+    """Return a label value escaped for the Prometheus text format."""
+    return (value.replace('\\', r'\\')
+            .replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def format_value(value):
+    """Return a number in the Prometheus text format."""
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def to_prometheus():
+    """
+    Return all the metrics in the Prometheus text format.
+
+    Returns
+    -------
+    STRING
+        The exposition of the metrics of REGISTRY.
+
+    """
+    return '\n'.join(m.exposition() for m in REGISTRY) + '\n'
+
+
+def write_metrics(file_path):
+    """
+    Write all the metrics in a file, in the Prometheus text format.
+
+    The file is replaced atomically, so that it can be read
+    at any time, for instance by the textfile collector of node_exporter.
+
+    Parameters
+    ----------
+    file_path : STRING
+        The path of the file (.prom).
+
+    Returns
+    -------
+    None.
+
+    """
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(to_prometheus())
+    os.replace(temp_path, file_path)
+
+
+def reset_metrics():
+    """Forget the values of all the metrics."""
+    for m in REGISTRY:
+        m.reset()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Answer every GET request with the metrics."""
+
+    def do_GET(self):
+        """Send the metrics in the Prometheus text format."""
+        body = to_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        """Do not print the requests."""
+
+
+def serve_metrics(port, address=''):
+    """
+    Serve the metrics over HTTP from a background thread.
+
+    Parameters
+    ----------
+    port : INT
+        The port of the endpoint (0 for any free port).
+    address : STRING
+        The address listened (all the interfaces by default).
+
+    Returns
+    -------
+    server : THREADINGHTTPSERVER
+        The running server, stopped by server.shutdown().
+
+    """
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+SELECTION_SECONDS = Histogram(
+    'elicitation_query_selection_seconds',
+    'Time spent selecting a query.',
+    (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60),
+    ('heuristic',))
+"""Histogram: The latency of the query selection, by heuristic."""
+
+MC_SAMPLES = Counter(
+    'elicitation_mc_samples_total',
+    'Preference profiles drawn by Monte Carlo.',
+    ('function',))
+"""Counter: The profiles drawn by win_proba and expected_loss."""
+
+POSTERIOR_COMPUTATIONS = Counter(
+    'elicitation_posterior_computations_total',
+    'Posterior distributions computed.')
+"""Counter: The calls of posterior_distrib."""
+
+SESSION_QUERIES = Histogram(
+    'elicitation_session_queries',
+    'Queries asked per elicitation session.',
+    (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+    ('heuristic',))
+"""Histogram: The number of queries asked by every session, by heuristic."""
+
+SESSIONS = Counter(
+    'elicitation_sessions_total',
+    'Finished elicitation sessions.',
+    ('heuristic', 'outcome'))
+"""Counter: The finished sessions, by heuristic and outcome.
+
+The outcome is necessary_winner if a necessary winner was found,
+loss_threshold otherwise (the expected loss reached the termination value).
+"""
@@ -7,11 +7,17 @@ This module contains some useful functons to:
     - calculate a posterior distribution knowing a preference,
     - calculate the proba of a preference,
     - determinate the answer of a query,
-    - apply transitivity at every query.
+    - apply transitivity at every query,
+    - choose the best queries of a heuristic, at most one per voter.
 
 """
 
+import logging
+import re
 import numpy as np
+from numpy import random as rd
+from elicitation_log import log_event
+from metrics import POSTERIOR_COMPUTATIONS
 
 
 # pylint: disable=C0103
@@ -34,28 +40,9 @@ def index_query(vc, cj, ck):
         The list of indexes in the permut array for cj > ck.
 
     """
-    index_cj_ck = []
-    index_ck_cj = []
-    for e, _ in enumerate(vc):
-        if vc[e][0] == cj:
-            index_cj_ck.append(e)
-        elif vc[e][0] == ck:
-            index_ck_cj.append(e)
-        else:
-            jcj = 0
-            jck = 0
-            j = 1
-            while (jcj == 0 or
-                   jck == 0):
-                if vc[e][j] == cj:
-                    jcj = j
-                elif vc[e][j] == ck:
-                    jck = j
-                j += 1
-            if jcj < jck:
-                index_cj_ck.append(e)
-            else:
-                index_ck_cj.append(e)
+    # The position of every candidate in every permutation.
+    position = np.argsort(vc, axis=1)
+    index_cj_ck = np.flatnonzero(position[:, cj] < position[:, ck]).tolist()
     return index_cj_ck
 
 
@@ -82,17 +69,17 @@ def posterior_distrib(vc, cj, ck, init_distrib, vi):
         The posterior distrib knowing qi, cj>ck.
 
     """
+    POSTERIOR_COMPUTATIONS.inc()
     distrib = np.copy(init_distrib)
     index_cj_ck = index_query(vc, cj, ck)
 
     s = sum(distrib[vi][index_cj_ck])
     if s != 0:
         p = 1/s
-        for r in range(len(distrib[vi])):
-            if r in index_cj_ck:
-                distrib[vi][r] *= p
-            else:
-                distrib[vi][r] = 0
+        # The permutations where ck > cj become impossible.
+        posterior = np.zeros(len(distrib[vi]))
+        posterior[index_cj_ck] = distrib[vi][index_cj_ck] * p
+        distrib[vi] = posterior
     return distrib
 
 
@@ -217,9 +204,8 @@ def transitivity_complete(answer,
         c_best = ck
         c_worst = cj
 
-    print("User v" + str(vi)
-          + " prefers c" + str(c_best)
-          + " to c" + str(c_worst) + ".")
+    log_event(logging.DEBUG, 'answer',
+              voter=vi, c_best=c_best, c_worst=c_worst)
 
     # Update the rankings distribution regarding this answer.
     distrib = posterior_distrib(vc, c_best, c_worst, distrib, vi)
@@ -255,3 +241,47 @@ def transitivity_complete(answer,
            distrib,
            queries,
            list_alternative_worst)
+
+
+def best_queries(value_dict, k, rng=None):
+    """
+    Return the k queries with the highest values, at most one per voter.
+
+    The queries of different voters are answered independently, so they
+    can be asked at the same time. Ties are broken randomly.
+
+    Parameters
+    ----------
+    value_dict : DICT
+        The values of the queries of a heuristic, e.g. {'WIG(vi,cj,ck)': x}.
+    k : INT
+        The number of queries wanted.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    chosen_queries : LIST
+        The chosen queries [vi, cj, ck], by decreasing value.
+    values : LIST
+        The values of the chosen queries.
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+    keys = list(value_dict)
+    order = rng.permutation(len(keys))
+    order = order[np.argsort([-value_dict[keys[i]] for i in order],
+                             kind='stable')]
+    chosen_queries = []
+    values = []
+    voters = set()
+    for i in order:
+        query = [int(s) for s in re.findall(r'\b\d+\b', keys[i])]
+        if query[0] not in voters:
+            voters.add(query[0])
+            chosen_queries.append(query)
+            values.append(value_dict[keys[i]])
+            if len(chosen_queries) == k:
+                break
+    return(chosen_queries, values)
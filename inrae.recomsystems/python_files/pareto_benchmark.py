@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Quality vs. cost benchmark of the heuristics.
+
+@author: Maeva.Caillat
+
+This module runs find_preferences with the expected loss for every
+combination of heuristic, gamma (the sample size of IGB and ESB) and
+sample size of the expected loss, on several sushi groups. For every
+setting it records the number of queries until termination, the regret
+of the returned winner against the real Borda winner and the CPU time,
+then keeps the settings on the Pareto front of these three criteria.
+
+Run this module to run the benchmark, for instance:
+    python pareto_benchmark.py pareto.json --heuristics IGB EVOI
+        --gammas 25 50 100 --samples 100 300 1000
+
+"""
+
+from itertools import product
+import json
+import time
+import numpy as np
+from numpy import random as rd
+from benchmarks import make_group
+from borda_voting_protocol import borda
+from datasets import sushi_rankings
+from find_preferences import find_preferences
+
+
+# pylint: disable=C0103
+OBJECTIVES = ('cpu_time', 'nb_queries', 'regret')
+"""tuple: The criteria minimized by the Pareto front."""
+
+
+def run_setting(groups, heuristic, gamma, nb_loss_sample, seed):
+    """
+    Return the mean criteria of a setting over several groups.
+
+    Parameters
+    ----------
+    groups : LIST
+        The inputs returned by benchmarks.make_group.
+    heuristic : STRING
+        The name of the heuristic.
+    gamma : INT
+        The sample size of IGB and ESB.
+    nb_loss_sample : INT
+        The sample size of the expected loss.
+    seed : SEEDSEQUENCE
+        The seed of the random streams of the groups.
+
+    Returns
+    -------
+    setting : DICT
+        The setting, the mean CPU time (seconds), number of queries
+        and regret, and the share of groups whose real winner was found.
+
+    """
+    cpu_times = []
+    nb_queries = []
+    regrets = []
+    for group, group_seed in zip(groups, seed.spawn(len(groups))):
+        # The real Borda scores of the group.
+        scores = np.array(list(borda(group['rating']).values()))
+        starttime = time.process_time()
+        (nw, _, _, _, _, nb_query) = find_preferences(
+            group['v'],
+            group['c'],
+            group['vc'],
+            gamma,
+            group['rating'],
+            group['distrib'],
+            heuristic,
+            0,
+            0.15,
+            0.05,
+            False,
+            rng=rd.default_rng(group_seed),
+            nb_loss_sample=nb_loss_sample)
+        cpu_times.append(time.process_time() - starttime)
+        nb_queries.append(nb_query)
+        regrets.append(max(scores) - scores[nw])
+    return {'heuristic': heuristic,
+            'gamma': gamma,
+            'nb_loss_sample': nb_loss_sample,
+            'cpu_time': float(np.mean(cpu_times)),
+            'nb_queries': float(np.mean(nb_queries)),
+            'regret': float(np.mean(regrets)),
+            'exact': float(np.mean(np.array(regrets) == 0))}
+
+
+def pareto_front(settings, objectives=OBJECTIVES):
+    """
+    Return the settings which are not dominated on the objectives.
+
+    A setting is dominated if another one is at least as good on every
+    objective and strictly better on one of them.
+
+    Parameters
+    ----------
+    settings : LIST
+        The results of run_setting.
+    objectives : TUPLE
+        The criteria to minimize.
+
+    Returns
+    -------
+    front : LIST
+        The non dominated settings, sorted by CPU time.
+
+    """
+    values = np.array([[s[o] for o in objectives] for s in settings])
+    front = []
+    for i, s in enumerate(settings):
+        dominated = np.any(np.all(values <= values[i], axis=1)
+                           & np.any(values < values[i], axis=1))
+        if not dominated:
+            front.append(s)
+    return sorted(front, key=lambda s: s[objectives[0]])
+
+
+def run_pareto(heuristics=('IGB', 'ESB', 'EVOI'),
+               gammas=(25, 50, 100),
+               samples=(100, 300, 1000),
+               nb_user=5,
+               nb_item=4,
+               nb_group=5,
+               seed=0):
+    """
+    Return the criteria of every setting and the Pareto front.
+
+    Parameters
+    ----------
+    heuristics : LIST
+        The names of the heuristics.
+    gammas : LIST
+        The sample sizes of IGB and ESB (EVOI does not sample,
+        so it is only run with the first one).
+    samples : LIST
+        The sample sizes of the expected loss.
+    nb_user : INT
+        The number of users of the groups.
+    nb_item : INT
+        The number of items.
+    nb_group : INT
+        The number of groups every setting is evaluated on.
+    seed : INT
+        The seed of the random streams.
+
+    Returns
+    -------
+    settings : LIST
+        The results of run_setting.
+    front : LIST
+        The settings on the Pareto front.
+
+    """
+    rankings = sushi_rankings(nb_item)
+    groups = [make_group(rankings[g*nb_user:], nb_user)
+              for g in range(nb_group)]
+    settings = []
+    for heuristic, gamma, nb_loss_sample in product(heuristics,
+                                                    gammas,
+                                                    samples):
+        if heuristic == 'EVOI' and gamma != gammas[0]:
+            continue
+        # The same groups and random streams for every setting.
+        setting = run_setting(groups,
+                              heuristic,
+                              gamma,
+                              nb_loss_sample,
+                              rd.SeedSequence(seed))
+        settings.append(setting)
+        print('%-9s gamma=%-4s n=%-5s cpu=%.2f s queries=%.1f regret=%.2f'
+              % (heuristic, gamma, nb_loss_sample, setting['cpu_time'],
+                 setting['nb_queries'], setting['regret']))
+    return(settings, pareto_front(settings))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Trade-off between CPU time, queries and regret.')
+    parser.add_argument('output_path')
+    parser.add_argument('--heuristics', nargs='+',
+                        default=['IGB', 'ESB', 'EVOI'])
+    parser.add_argument('--gammas', type=int, nargs='+',
+                        default=[25, 50, 100])
+    parser.add_argument('--samples', type=int, nargs='+',
+                        default=[100, 300, 1000])
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--items', type=int, default=4)
+    parser.add_argument('--groups', type=int, default=5)
+    args = parser.parse_args()
+
+    all_settings, front_settings = run_pareto(args.heuristics,
+                                              args.gammas,
+                                              args.samples,
+                                              args.users,
+                                              args.items,
+                                              args.groups)
+    with open(args.output_path, 'w') as f:
+        json.dump({'settings': all_settings, 'front': front_settings},
+                  f, indent=1)
+    print('Pareto front:')
+    for s in front_settings:
+        print('%-9s gamma=%-4s n=%-5s cpu=%.2f s queries=%.1f regret=%.2f'
+              % (s['heuristic'], s['gamma'], s['nb_loss_sample'],
+                 s['cpu_time'], s['nb_queries'], s['regret']))
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Projecting rankings onto a subset of items.
+
+@author: Maeva.Caillat
+
+This module maps complete rankings (for instance the 10-sushi rankings)
+to the rankings they induce on any subset of items, relabelled 0 to k-1,
+and computes the index of every ranking in the permutations array
+vc = list(permutations(range(k))), so that the prior counts of the
+permutations are a single bincount.
+
+"""
+
+from math import factorial
+import numpy as np
+
+
+# pylint: disable=C0103
+def project_rankings(rankings, items):
+    """
+    Return the rankings induced on a subset of items.
+
+    Parameters
+    ----------
+    rankings : ARRAY
+        Complete rankings, one per line. First item: preferred item.
+    items : LIST
+        The items kept. Item items[i] is relabelled i.
+
+    Returns
+    -------
+    ARRAY
+        The int rankings on len(items) items, in the same order.
+
+    """
+    rankings = np.asarray(rankings)
+    items = np.asarray(items)
+    if len(np.unique(items)) != len(items):
+        raise ValueError('The items must be distinct')
+    # The new label of every item, -1 for the items left out.
+    labels = np.full(max(rankings.max(), items.max()) + 1, -1)
+    labels[items] = np.arange(len(items))
+    projected = labels[rankings]
+    kept = projected >= 0
+    if np.any(kept.sum(axis=1) != len(items)):
+        raise ValueError('Every ranking must contain all the items')
+    return projected[kept].reshape(len(rankings), len(items))
+
+
+def permutation_index(rankings):
+    """
+    Return the index of every ranking in list(permutations(range(k))).
+
+    The index is the Lehmer code of the ranking read in the factorial
+    base, which follows the lexicographic order of itertools.permutations.
+
+    Parameters
+    ----------
+    rankings : ARRAY
+        Rankings of the items 0 to k-1, one per line.
+
+    Returns
+    -------
+    ARRAY
+        The int indexes of the rankings in vc.
+
+    """
+    rankings = np.asarray(rankings)
+    nb_item = rankings.shape[-1]
+    # The number of items ranked after item i and lower than it.
+    after = np.triu(np.ones((nb_item, nb_item), dtype=bool), 1)
+    lehmer = np.sum((rankings[..., :, None] > rankings[..., None, :]) & after,
+                    axis=-1)
+    weights = np.array([factorial(nb_item - 1 - i) for i in range(nb_item)])
+    return lehmer @ weights
+
+
+def prior_counts(rankings):
+    """
+    Return the number of appearances of every permutation in rankings.
+
+    Parameters
+    ----------
+    rankings : ARRAY
+        Rankings of the items 0 to k-1, one per line.
+
+    Returns
+    -------
+    ARRAY
+        The k! counts, in the order of vc.
+
+    """
+    rankings = np.asarray(rankings)
+    return np.bincount(permutation_index(rankings),
+                       minlength=factorial(rankings.shape[-1]))
+
+
+def prior_distrib(rankings, nb_user):
+    """
+    Return the initial permutation distribution learnt from rankings.
+
+    It is the distribution of init_permut_proba_distrib (the frequencies
+    of the permutations with Laplace's principle), computed from counts.
+
+    Parameters
+    ----------
+    rankings : ARRAY
+        Rankings of the items 0 to k-1, one per line.
+    nb_user : INT
+        The number of users of the distribution.
+
+    Returns
+    -------
+    ARRAY
+        The nb_user x k! initial permutation distribution.
+
+    """
+    return counts_distrib(prior_counts(rankings), nb_user)
+
+
+def counts_distrib(counts, nb_user):
+    """
+    Return the initial permutation distribution of permutation counts.
+
+    Parameters
+    ----------
+    counts : ARRAY
+        The number of appearances of every permutation.
+    nb_user : INT
+        The number of users of the distribution.
+
+    Returns
+    -------
+    ARRAY
+        The nb_user x len(counts) initial permutation distribution.
+
+    """
+    # we use Laplace's principle
+    app = counts + 1.
+    app /= sum(app)
+    return np.tile(app, (nb_user, 1))
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Streaming the rankings of large files.
+
+@author: Maeva.Caillat
+
+This module reads ranking files block by block, so that priors can be
+learnt from files larger than memory (for instance the logs of canteen
+preferences). Every block is projected onto the items of the prior,
+mapped to permutation indexes and added to the counts, so only one block
+and the m! counts are held in memory.
+
+Run this module to learn the prior counts of a file, for instance:
+    python ranking_stream.py sushi3a.5000.10.order counts.npy
+        --format sushi --items 0 1 2 3 4 5
+
+"""
+
+from math import factorial
+import numpy as np
+import pandas as pd
+from ranking_projection import (counts_distrib,
+                                permutation_index,
+                                project_rankings)
+
+
+# pylint: disable=C0103
+FORMATS = {'sushi': {'sep': ' ', 'skiprows': 1},
+           'order': {'sep': '\t', 'skiprows': 0}}
+"""dict: The layouts of the ranking files.
+
+sushi is the layout of sushi3a.5000.10.order (a header line starting with
+the number of items, then the id and the length of every ranking), order
+the layout of the CROUS files (the id, then the items, left blank when
+missing). The columns of the items are read from the files (see
+item_columns).
+"""
+
+
+def item_columns(file_path, file_format='sushi'):
+    """
+    Return the columns of the items of a ranking file.
+
+    Parameters
+    ----------
+    file_path : STRING
+        The path of the ranking file.
+    file_format : STRING
+        The layout of the file (a key of FORMATS).
+
+    Returns
+    -------
+    RANGE
+        The columns of the items, from the header of a sushi file
+        or from the width of the first line of an order file.
+
+    """
+    sep = FORMATS[file_format]['sep']
+    with open(file_path) as f:
+        first_line = f.readline().rstrip('\r\n').split(sep)
+    if file_format == 'sushi':
+        # The header starts with the number of items.
+        return range(2, 2 + int(first_line[0]))
+    # The first column is the id of the voter.
+    return range(1, len(first_line))
+
+
+def read_ranking_chunks(file_path,
+                        sep=' ',
+                        skiprows=0,
+                        usecols=None,
+                        chunk_size=100000):
+    """
+    Yield the rankings of a file by blocks.
+
+    Parameters
+    ----------
+    file_path : STRING
+        The path of the ranking file.
+    sep : STRING
+        The separator of the columns.
+    skiprows : INT
+        The number of header lines.
+    usecols : LIST
+        The columns of the items (all of them by default).
+    chunk_size : INT
+        The number of rankings per block.
+
+    Yields
+    ------
+    ARRAY
+        The int rankings of a block, padded with -1 where items are missing.
+
+    """
+    reader = pd.read_csv(file_path,
+                         sep=sep,
+                         header=None,
+                         skiprows=skiprows,
+                         usecols=None if usecols is None else list(usecols),
+                         chunksize=chunk_size)
+    with reader:
+        for chunk in reader:
+            yield chunk.fillna(-1).values.astype(int)
+
+
+def accumulate_prior_counts(chunks, items, counts=None):
+    """
+    Return the counts of the permutations of items in blocks of rankings.
+
+    The rankings which do not rank all the items are skipped.
+
+    Parameters
+    ----------
+    chunks : ITERABLE
+        The blocks of rankings (see read_ranking_chunks).
+    items : LIST
+        The items of the prior. Item items[i] is relabelled i.
+    counts : ARRAY
+        Previous counts to add to, for instance of another file.
+
+    Returns
+    -------
+    counts : ARRAY
+        The len(items)! counts, in the order of
+        list(permutations(range(len(items)))).
+    nb_ranking : INT
+        The number of rankings counted.
+
+    """
+    if counts is None:
+        counts = np.zeros(factorial(len(items)), dtype=np.int64)
+    nb_ranking = 0
+    for chunk in chunks:
+        complete = np.isin(chunk, items).sum(axis=1) == len(items)
+        if not np.any(complete):
+            continue
+        projected = project_rankings(
+            np.where(chunk >= 0, chunk, max(items) + 1)[complete], items)
+        counts += np.bincount(permutation_index(projected),
+                              minlength=len(counts))
+        nb_ranking += len(projected)
+    return(counts, nb_ranking)
+
+
+def stream_prior_distrib(file_path,
+                         items,
+                         nb_user,
+                         file_format='sushi',
+                         chunk_size=100000):
+    """
+    Return the initial permutation distribution learnt from a file.
+
+    It is the distribution of init_permut_proba_distrib (the frequencies
+    of the permutations with Laplace's principle) on all the rankings
+    of the file, read block by block.
+
+    Parameters
+    ----------
+    file_path : STRING
+        The path of the ranking file.
+    items : LIST
+        The items of the distribution. Item items[i] is relabelled i.
+    nb_user : INT
+        The number of users of the distribution.
+    file_format : STRING
+        The layout of the file (a key of FORMATS).
+    chunk_size : INT
+        The number of rankings per block.
+
+    Returns
+    -------
+    ARRAY
+        The nb_user x len(items)! initial permutation distribution.
+
+    """
+    counts, _ = accumulate_prior_counts(
+        read_ranking_chunks(file_path,
+                            usecols=item_columns(file_path, file_format),
+                            chunk_size=chunk_size,
+                            **FORMATS[file_format]),
+        items)
+    return counts_distrib(counts, nb_user)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Count the permutations of items in a ranking file.')
+    parser.add_argument('file_path')
+    parser.add_argument('output_path')
+    parser.add_argument('--format', default='sushi', choices=list(FORMATS))
+    parser.add_argument('--items', type=int, nargs='+',
+                        default=[0, 1, 2, 3, 4, 5])
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    args = parser.parse_args()
+
+    file_counts, nb_counted = accumulate_prior_counts(
+        read_ranking_chunks(args.file_path,
+                            usecols=item_columns(args.file_path, args.format),
+                            chunk_size=args.chunk_size,
+                            **FORMATS[args.format]),
+        args.items)
+    np.save(args.output_path, file_counts)
+    print('%s rankings counted, %s permutations seen'
+          % (nb_counted, np.count_nonzero(file_counts)))
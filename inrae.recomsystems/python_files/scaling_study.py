@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""Scaling study of the heuristics.
+
+@author: Maeva.Caillat
+
+This module runs find_preferences for several numbers of users V and of
+items m, measures the latency per query, the peak memory and the number
+of queries until termination, and fits for every heuristic and criterion
+a power law
+    criterion = exp(c) * V^a * (m!)^b
+by least squares on the logarithms. The fitted laws predict the cost
+of larger groups, for instance a 40-person canteen group.
+
+Run this module to run a study, for instance:
+    python scaling_study.py study.json --users 5 7 10 --items 4 5
+        --predict 40 5 --target 2
+
+"""
+
+from math import factorial, log
+import json
+import timeit
+import tracemalloc
+import numpy as np
+from numpy import random as rd
+from benchmarks import make_group
+from datasets import sushi_rankings
+from find_preferences import find_preferences
+
+
+# pylint: disable=C0103
+CRITERIA = ('latency', 'latency_p95', 'nb_queries', 'peak_memory')
+"""tuple: The criteria measured for every run and fitted."""
+
+
+def measure_run(group, heuristic, gamma, israeli, seed, memory=True):
+    """
+    Return the costs of one run of find_preferences.
+
+    Parameters
+    ----------
+    group : DICT
+        The inputs returned by benchmarks.make_group.
+    heuristic : STRING
+        The name of the heuristic.
+    gamma : INT
+        The sample size of IGB and ESB.
+    israeli : BOOL
+        If True, the expected loss is not computed after every query.
+    seed : INT
+        The seed of the random generator.
+    memory : BOOL
+        If True, the run is repeated under tracemalloc to measure the peak
+        memory (tracemalloc slows the run down, so latencies come from
+        the first run).
+
+    Returns
+    -------
+    costs : DICT
+        The mean and 95th percentile latency per query (seconds),
+        the number of queries, the peak memory (bytes) and the runtime.
+
+    """
+    def run():
+        return find_preferences(group['v'],
+                                group['c'],
+                                group['vc'],
+                                gamma,
+                                group['rating'],
+                                group['distrib'],
+                                heuristic,
+                                0,
+                                0.15,
+                                0.05,
+                                israeli,
+                                rng=rd.default_rng(seed))
+
+    starttime = timeit.default_timer()
+    (_, _, _, _, time_array, nb_queries) = run()
+    runtime = timeit.default_timer() - starttime
+    latencies = np.diff(time_array)
+    costs = {'latency': float(np.mean(latencies)),
+             'latency_p95': float(np.percentile(latencies, 95)),
+             'nb_queries': nb_queries,
+             'runtime': runtime}
+    if memory:
+        tracemalloc.start()
+        run()
+        costs['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return costs
+
+
+def run_study(heuristics=('EVOI',),
+              users=(5, 7, 10),
+              items=(4, 5),
+              gamma=50,
+              israeli=True,
+              nb_run=1,
+              memory=True,
+              seed=0):
+    """
+    Return the costs of find_preferences for every heuristic, V and m.
+
+    Parameters
+    ----------
+    heuristics : LIST
+        The names of the heuristics.
+    users : LIST
+        The numbers of users V.
+    items : LIST
+        The numbers of items m.
+    gamma : INT
+        The sample size of IGB and ESB.
+    israeli : BOOL
+        If True, the expected loss is not computed after every query.
+    nb_run : INT
+        The number of runs per point (their costs are averaged).
+    memory : BOOL
+        If True, the peak memory is measured too.
+    seed : INT
+        The seed of the random generators.
+
+    Returns
+    -------
+    points : LIST
+        One dict per (heuristic, V, m) with the mean costs.
+
+    """
+    seed_sequences = rd.SeedSequence(seed)
+    points = []
+    for nb_item in items:
+        rankings = sushi_rankings(nb_item)
+        for nb_user in users:
+            group = make_group(rankings, nb_user)
+            for heuristic in heuristics:
+                runs = [measure_run(group,
+                                    heuristic,
+                                    gamma,
+                                    israeli,
+                                    seed_sequences.spawn(1)[0],
+                                    memory)
+                        for _ in range(nb_run)]
+                point = {key: float(np.mean([r[key] for r in runs]))
+                         for key in runs[0]}
+                point.update(heuristic=heuristic,
+                             nb_user=nb_user,
+                             nb_item=nb_item)
+                points.append(point)
+                print('%-9s V=%-3s m=%s %.4f s/query, %s queries'
+                      % (heuristic, nb_user, nb_item,
+                         point['latency'], point['nb_queries']))
+    return points
+
+
+def fit_power_law(points, criterion):
+    """
+    Return the power law criterion = exp(c) * V^a * (m!)^b fitting points.
+
+    Parameters
+    ----------
+    points : LIST
+        The points of one heuristic returned by run_study.
+    criterion : STRING
+        The criterion fitted (latency, nb_queries, peak_memory...).
+
+    Returns
+    -------
+    fit : DICT
+        The exponents a and b, the constant c and the coefficient
+        of determination r2 of the fit in log space.
+
+    """
+    x = np.array([[log(p['nb_user']), log(factorial(p['nb_item'])), 1]
+                  for p in points])
+    y = np.log([max(p[criterion], 1e-12) for p in points])
+    # Without several numbers of items, b cannot be identified.
+    if len(set(p['nb_item'] for p in points)) < 2:
+        x[:, 1] = 0
+    coef = np.linalg.lstsq(x, y, rcond=None)[0]
+    residual = y - x @ coef
+    total = np.sum((y - y.mean()) ** 2)
+    r2 = 1 - np.sum(residual ** 2) / total if total > 0 else 1.
+    return {'a': float(coef[0]),
+            'b': float(coef[1]),
+            'c': float(coef[2]),
+            'r2': float(r2)}
+
+
+def fit_study(points):
+    """
+    Return the power laws of every heuristic and criterion.
+
+    Parameters
+    ----------
+    points : LIST
+        The points returned by run_study.
+
+    Returns
+    -------
+    fits : DICT
+        fits[heuristic][criterion] is the result of fit_power_law.
+
+    """
+    fits = {}
+    for heuristic in sorted(set(p['heuristic'] for p in points)):
+        heuristic_points = [p for p in points if p['heuristic'] == heuristic]
+        fits[heuristic] = {criterion: fit_power_law(heuristic_points,
+                                                    criterion)
+                           for criterion in CRITERIA
+                           if criterion in heuristic_points[0]}
+    return fits
+
+
+def predict(fit, nb_user, nb_item):
+    """
+    Return the value of a fitted power law for V users and m items.
+
+    Parameters
+    ----------
+    fit : DICT
+        The result of fit_power_law.
+    nb_user : INT
+        The number of users V.
+    nb_item : INT
+        The number of items m.
+
+    Returns
+    -------
+    FLOAT
+        The predicted criterion.
+
+    """
+    return float(np.exp(fit['c']
+                        + fit['a'] * log(nb_user)
+                        + fit['b'] * log(factorial(nb_item))))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Fit the cost of the heuristics vs. users and items.')
+    parser.add_argument('output_path')
+    parser.add_argument('--heuristics', nargs='+', default=['EVOI'])
+    parser.add_argument('--users', type=int, nargs='+', default=[5, 7, 10])
+    parser.add_argument('--items', type=int, nargs='+', default=[4, 5])
+    parser.add_argument('--gamma', type=int, default=50)
+    parser.add_argument('--loss', action='store_true',
+                        help='compute the expected loss after every query')
+    parser.add_argument('--runs', type=int, default=1)
+    parser.add_argument('--no-memory', action='store_true')
+    parser.add_argument('--predict', type=int, nargs=2, default=None,
+                        metavar=('USERS', 'ITEMS'))
+    parser.add_argument('--target', type=float, default=None,
+                        help='the latency target per query (seconds)')
+    args = parser.parse_args()
+
+    study_points = run_study(args.heuristics, args.users, args.items,
+                             args.gamma, not args.loss, args.runs,
+                             not args.no_memory)
+    study_fits = fit_study(study_points)
+    with open(args.output_path, 'w') as f:
+        json.dump({'points': study_points, 'fits': study_fits}, f, indent=1)
+
+    for h_name, h_fits in study_fits.items():
+        for criterion_name, law in h_fits.items():
+            print('%-9s %-12s ~ V^%.2f * (m!)^%.2f (r2=%.3f)'
+                  % (h_name, criterion_name, law['a'], law['b'], law['r2']))
+        if args.predict is not None:
+            latency = predict(h_fits['latency'], *args.predict)
+            print('%-9s predicted latency for V=%s, m=%s: %.3f s/query'
+                  % ((h_name,) + tuple(args.predict) + (latency,)), end='')
+            if args.target is not None:
+                print(' (%s the %.3f s target)'
+                      % ('meets' if latency <= args.target else 'misses',
+                         args.target), end='')
+            print()
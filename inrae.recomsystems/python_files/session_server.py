@@ -0,0 +1,661 @@
+# -*- coding: utf-8 -*-
+"""Serving many elicitation sessions at once.
+
+@author: Maeva.Caillat
+
+This module contains:
+    - an asyncio server holding many ElicitationSession objects, spoken to
+      in JSON lines over TCP, which selects the queries (the CPU-heavy
+      IGB, ESB or EVOI scoring) in a pool of worker processes so that the
+      event loop stays free while the users answer,
+    - a load generator replaying sushi or CROUS users as simulated groups,
+      which measures the throughput and the latency of the server.
+
+The protocol is one JSON object per line, for instance:
+    {"op": "open", "nb_user": 5}
+        -> {"session": 0, "query": [vi, cj, ck]}
+    {"op": "answer", "session": 0, "answer": 1}
+        -> {"session": 0, "query": [...]}
+        or {"session": 0, "winner": 2, "nb_queries": 21}
+    {"op": "close", "session": 0} -> {"session": 0, "closed": true}
+With "concurrent": true in the open request, every voter has a query at
+the same time: the replies give the list of the new "queries" and the
+answers give their "voter".
+An invalid request, or a request which failed in the server, is answered
+with {"error": "..."}. If a worker dies, the pool is replaced for the next
+requests. A session left without a query to answer, because its next
+query could not be selected, is closed.
+
+Run this module to serve sessions, or to measure a running server, e.g.:
+    python session_server.py serve --port 8765 --heuristic EVOI
+    python session_server.py load --port 8765 --groups 500 --concurrency 200
+    python session_server.py bench --groups 200 (both in one process)
+
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import itertools
+import json
+import logging
+from math import factorial
+import multiprocessing
+import os
+import timeit
+import numpy as np
+from numpy import random as rd
+from batched_elicitation import elicitation_tables, random_groups
+from datasets import crous_rankings, sushi_rankings
+from elicitation_log import log_event
+from elicitation_session import ElicitationSession, rating_answers
+from find_preferences import select_queries, select_query
+from metrics import SELECTION_SECONDS
+from ranking_projection import prior_counts
+
+
+# pylint: disable=C0103
+DATASETS = {'sushi': sushi_rankings, 'crous': crous_rankings}
+"""dict: The loaders of the rankings replayed by the load generator."""
+
+MAX_SELECTIONS = 3
+"""int: The selections tried before a request fails.
+
+The state of a session is locked during its selection, so the queries
+selected are only rejected if a heuristic misbehaves.
+"""
+
+SPECULATION_NICENESS = 10
+"""int: The increment of the niceness of the speculation workers.
+
+The speculation only saves time if it does not delay the selections the
+users are waiting for, so its workers run at a lower priority.
+"""
+
+
+def remote_select(heuristic, nb_item, gamma, distrib, queries, seed, k=1,
+                  time_budget=None):
+    """
+    Return the next queries of a session, computed in a worker process.
+
+    Parameters
+    ----------
+    heuristic : STRING
+        The heuristic used to select the queries.
+    nb_item : INT
+        The number of candidates.
+    gamma : INT
+        The sample size for PrWin algo.
+    distrib : ARRAY
+        The current permutation distribution.
+    queries : LIST
+        The queries [vi, cj, ck] already known, with cj < ck.
+    seed : INT
+        The seed of the random generator of the selection.
+    k : INT
+        The number of queries, at most one per voter, selected in one
+        scoring round.
+    time_budget : FLOAT
+        If given, a single query is selected anytime within this time
+        (seconds).
+
+    Returns
+    -------
+    LIST
+        The queries [vi, cj, ck].
+
+    """
+    # A single query is selected as by ElicitationSession.select.
+    if k == 1:
+        query, _ = select_query(heuristic,
+                                np.arange(len(distrib)),
+                                np.arange(nb_item),
+                                elicitation_tables(nb_item)['vc'],
+                                gamma,
+                                distrib,
+                                queries,
+                                rd.default_rng(seed),
+                                time_budget)
+        return [[int(x) for x in query]]
+    chosen_queries, _ = select_queries(heuristic,
+                                       np.arange(len(distrib)),
+                                       np.arange(nb_item),
+                                       elicitation_tables(nb_item)['vc'],
+                                       gamma,
+                                       distrib,
+                                       queries,
+                                       k,
+                                       rd.default_rng(seed))
+    return [[int(x) for x in query] for query in chosen_queries]
+
+
+def warm_up(nb_item):
+    """Import the heuristics and build the tables of nb_item in a worker."""
+    elicitation_tables(nb_item)
+
+
+def lower_priority():
+    """Lower the priority of a speculation worker (where supported)."""
+    if hasattr(os, 'nice'):
+        os.nice(SPECULATION_NICENESS)
+
+
+class SessionServer:
+    """
+    Asyncio server of elicitation sessions.
+
+    Parameters
+    ----------
+    prior : ARRAY
+        The initial permutation distribution of a user (m! probabilities).
+    heuristic : STRING
+        The heuristic used to select the queries.
+    gamma : INT
+        The sample size for PrWin algo.
+    termination_value : FLOAT
+        Termination value for the expected loss.
+    israeli : BOOL
+        If True, stop on a necessary winner only,
+        else, use the expected loss too.
+    max_workers : INT
+        The number of worker processes (the number of CPUs by default).
+    seed : INT
+        The seed of the random streams (unpredictable by default).
+    speculative : BOOL
+        If True, the next query of a session is selected for both answers
+        while the user answers (see ElicitationSession.speculate), in a
+        pool of its own whose workers run at a lower priority.
+    time_budget : FLOAT
+        If given, every query is selected anytime within this time
+        (seconds), so that the server answers in a bounded time.
+    speculation_workers : INT
+        The number of worker processes of the speculation (half of
+        max_workers by default). A session does not speculate while two
+        selections per worker are running or waiting in this pool.
+
+    """
+
+    def __init__(self,
+                 prior,
+                 heuristic,
+                 gamma=50,
+                 termination_value=0,
+                 israeli=True,
+                 max_workers=None,
+                 seed=None,
+                 speculative=False,
+                 time_budget=None,
+                 speculation_workers=None):
+        self.prior = np.asarray(prior, dtype=float)
+        self.speculative = speculative
+        self.time_budget = time_budget
+        self.nb_item = nb_item_of(len(self.prior))
+        self.heuristic = heuristic
+        self.gamma = gamma
+        self.termination_value = termination_value
+        self.israeli = israeli
+        self.max_workers = max_workers or os.cpu_count()
+        self.pool = self.new_pool()
+        self.speculation_workers = (speculation_workers
+                                    or max(1, self.max_workers // 2))
+        self.speculation_pool = None
+        if speculative:
+            self.speculation_pool = self.new_pool(self.speculation_workers,
+                                                  lower_priority)
+        # The speculative selections submitted.
+        self.speculations = set()
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.sessions = {}
+        # One lock per session: a session handles one request at a time.
+        self.locks = {}
+        # The sessions asking all their voters at the same time.
+        self.concurrent = set()
+        # The tasks answering the open connections.
+        self.connections = set()
+        self.ids = itertools.count()
+
+    def new_pool(self, max_workers=None, initializer=None):
+        """Return a new pool of worker processes (max_workers by default)."""
+        # Spawned workers do not inherit the sockets of the connections.
+        return ProcessPoolExecutor(
+            max_workers or self.max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=initializer)
+
+    async def run_in_pool(self, function, *args):
+        """Return function(*args) computed in the pool, replaced if broken."""
+        pool = self.pool
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                pool, function, *args)
+        except BrokenProcessPool:
+            # The requests running on the broken pool all fail,
+            # the first one replaces it.
+            if self.pool is pool:
+                log_event(logging.ERROR, 'pool_broken')
+                self.pool = self.new_pool()
+                pool.shutdown(wait=False)
+            raise
+
+    async def select_next(self, session, k=1):
+        """Select queries for k idle voters of a session in the pool."""
+        for _ in range(MAX_SELECTIONS):
+            selection_time = timeit.default_timer()
+            chosen_queries = await self.run_in_pool(
+                remote_select,
+                session.heuristic,
+                len(session.c),
+                session.gamma,
+                session.distrib,
+                session.queries(list(session.outstanding)),
+                int(session.rng.integers(2 ** 63)),
+                k,
+                session.time_budget)
+            SELECTION_SECONDS.observe(timeit.default_timer() - selection_time,
+                                      heuristic=session.heuristic)
+            session.nb_selections += 1
+            new = [q for q in chosen_queries if session.propose_query(q)]
+            if new:
+                return new
+        raise ValueError('No query could be selected')
+
+    async def select_idle(self, session):
+        """Select a query for every idle voter of a session in the pool."""
+        nb_idle = len(session.idle_voters())
+        if nb_idle == 0:
+            return []
+        return await self.select_next(session, nb_idle)
+
+    async def open_session(self, message):
+        """Create a session for a group of message['nb_user'] users."""
+        nb_user = int(message['nb_user'])
+        if nb_user < 1:
+            raise ValueError('Invalid number of users')
+        session_id = next(self.ids)
+        session = ElicitationSession(
+            self.nb_item,
+            np.tile(self.prior, (nb_user, 1)),
+            self.heuristic,
+            self.gamma,
+            self.termination_value,
+            self.israeli,
+            rng=rd.default_rng(self.seed_sequence.spawn(1)[0]),
+            time_budget=self.time_budget)
+        if message.get('concurrent', False):
+            self.concurrent.add(session_id)
+        self.sessions[session_id] = session
+        self.locks[session_id] = asyncio.Lock()
+        try:
+            async with self.locks[session_id]:
+                if session_id in self.concurrent:
+                    return {'session': session_id,
+                            'queries': await self.select_idle(session)}
+                query, = await self.select_next(session)
+                if self.speculative:
+                    self.speculate(session)
+        except Exception:
+            # A session without a first query cannot be answered.
+            self.close_session(session_id)
+            raise
+        return {'session': session_id, 'query': query}
+
+    def close_session(self, session_id):
+        """Forget a session."""
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.cancel_speculation()
+        self.locks.pop(session_id, None)
+        self.concurrent.discard(session_id)
+
+    async def answer_session(self, message):
+        """Submit message['answer'] to a session and return what follows."""
+        session_id = message['session']
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise ValueError('Invalid session')
+        async with self.locks[session_id]:
+            if session.pending is None:
+                raise ValueError('No pending query')
+            voter = message.get('voter')
+            if session.israeli:
+                session.submit_answer(message['answer'], voter)
+            else:
+                # The expected loss is sampled out of the event loop.
+                await asyncio.get_running_loop().run_in_executor(
+                    None, session.submit_answer, message['answer'], voter)
+            if session.finished:
+                return {'session': session_id,
+                        'winner': session.winner,
+                        'nb_queries': session.nb_queries}
+            try:
+                if session_id in self.concurrent:
+                    return {'session': session_id,
+                            'queries': await self.select_idle(session)}
+                query = await self.speculated_query(session)
+                if query is None:
+                    query, = await self.select_next(session)
+            except Exception:
+                # Without a pending query, the session cannot go on.
+                if session.pending is None:
+                    self.close_session(session_id)
+                raise
+            if self.speculative:
+                self.speculate(session)
+        return {'session': session_id, 'query': query}
+
+    def speculate(self, session):
+        """Start the speculation of a session if its pool has room."""
+        self.speculations = {f for f in self.speculations if not f.done()}
+        if len(self.speculations) >= 2 * self.speculation_workers:
+            return
+        try:
+            self.speculations.update(session.speculate(self.speculation_pool))
+        except BrokenProcessPool:
+            log_event(logging.ERROR, 'speculation_pool_broken')
+            self.speculation_pool = self.new_pool(self.speculation_workers,
+                                                  lower_priority)
+
+    @staticmethod
+    async def speculated_query(session):
+        """Return the query selected during the answer, None if unusable."""
+        if session.speculated is None:
+            return None
+        future = session.speculated
+        session.speculated = None
+        wait_time = timeit.default_timer()
+        try:
+            speculated = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # The session was closed meanwhile.
+            if not future.cancelled():
+                raise
+            return None
+        except Exception as error:
+            # The query is selected again in the main pool.
+            log_event(logging.WARNING, 'speculation_failed',
+                      error=repr(error))
+            return None
+        if session.adopt(speculated):
+            # The selection made in the worker is recorded as the time the
+            # user waited for it.
+            SELECTION_SECONDS.observe(timeit.default_timer() - wait_time,
+                                      heuristic=session.heuristic)
+            return list(session.pending)
+        return None
+
+    async def dispatch(self, message):
+        """Return the reply to a request."""
+        op = message.get('op')
+        if op == 'open':
+            return await self.open_session(message)
+        if op == 'answer':
+            return await self.answer_session(message)
+        if op == 'close':
+            self.close_session(message.get('session'))
+            return {'session': message.get('session'), 'closed': True}
+        raise ValueError('Invalid operation')
+
+    async def handle(self, reader, writer):
+        """Answer the requests of a connection, one JSON object per line."""
+        self.connections.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    reply = await self.dispatch(json.loads(line))
+                except (ValueError, KeyError, TypeError) as error:
+                    reply = {'error': str(error)}
+                except Exception as error:
+                    # A failure of the server, the connection goes on.
+                    log_event(logging.ERROR, 'request_failed',
+                              error=repr(error))
+                    reply = {'error': repr(error)}
+                writer.write((json.dumps(reply) + '\n').encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            log_event(logging.WARNING, 'connection_lost')
+        finally:
+            self.connections.discard(asyncio.current_task())
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8765):
+        """Return the running asyncio server (port 0 for any free port)."""
+        # The workers are started before the first sessions.
+        await asyncio.gather(*(self.run_in_pool(warm_up, self.nb_item)
+                               for _ in range(self.max_workers)))
+        if self.speculation_pool is not None:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(self.speculation_pool,
+                                                        warm_up,
+                                                        self.nb_item)
+                                   for _ in range(self.speculation_workers)))
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def stop(self, running):
+        """Stop a running server once its connections are closed."""
+        running.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        self.pool.shutdown()
+        if self.speculation_pool is not None:
+            self.speculation_pool.shutdown(cancel_futures=True)
+
+
+def nb_item_of(nb_permut):
+    """Return the number of items m such that m! = nb_permut."""
+    nb_item = 1
+    while factorial(nb_item) < nb_permut:
+        nb_item += 1
+    if factorial(nb_item) != nb_permut:
+        raise ValueError('Invalid prior size')
+    return nb_item
+
+
+async def simulated_group(host, port, rating, think_time=0, concurrent=False):
+    """
+    Play a group of users answering from their rankings.
+
+    In concurrent mode, every voter answers its own query think_time
+    after receiving it, the earliest ready answer being sent first.
+
+    Parameters
+    ----------
+    host : STRING
+        The address of the server.
+    port : INT
+        The port of the server.
+    rating : ARRAY
+        The rankings of the candidates by the users.
+    think_time : FLOAT
+        The time taken by a user to answer (seconds).
+    concurrent : BOOL
+        If True, ask all the voters at the same time.
+
+    Returns
+    -------
+    latencies : LIST
+        The time between every request and its reply (seconds).
+    reply : DICT
+        The last reply, with the winner and the number of queries.
+    duration : FLOAT
+        The time taken to find the winner (seconds).
+
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    latencies = []
+
+    async def request(message):
+        start_time = timeit.default_timer()
+        writer.write((json.dumps(message) + '\n').encode('utf-8'))
+        await writer.drain()
+        line = await reader.readline()
+        latencies.append(timeit.default_timer() - start_time)
+        return json.loads(line)
+
+    answer = rating_answers(rating)
+    start_time = timeit.default_timer()
+    reply = await request({'op': 'open',
+                           'nb_user': len(rating),
+                           'concurrent': concurrent})
+    session_id = reply.get('session')
+    # The queries waiting for their answers, with the time they are ready.
+    waiting = []
+    while 'query' in reply or 'queries' in reply:
+        now = timeit.default_timer()
+        waiting += [(now + think_time, q)
+                    for q in reply.get('queries', [reply.get('query')])]
+        waiting.sort()
+        ready_time, query = waiting.pop(0)
+        await asyncio.sleep(max(0, ready_time - timeit.default_timer()))
+        reply = await request({'op': 'answer',
+                               'session': session_id,
+                               'voter': query[0],
+                               'answer': answer(*query)})
+    duration = timeit.default_timer() - start_time
+    await request({'op': 'close', 'session': session_id})
+    writer.close()
+    await writer.wait_closed()
+    return(latencies, reply, duration)
+
+
+async def run_load(host,
+                   port,
+                   groups,
+                   concurrency=100,
+                   think_time=0,
+                   concurrent=False):
+    """
+    Replay groups against a server and measure its performance.
+
+    Parameters
+    ----------
+    host : STRING
+        The address of the server.
+    port : INT
+        The port of the server.
+    groups : ARRAY
+        The rankings G x V x m of the simulated groups.
+    concurrency : INT
+        The number of groups connected at the same time.
+    think_time : FLOAT
+        The time taken by a user to answer (seconds).
+    concurrent : BOOL
+        If True, every group asks all its voters at the same time.
+
+    Returns
+    -------
+    DICT
+        The number of groups, requests and errors, the throughput
+        (requests per second), the mean, p50 and p99 latencies and the mean
+        time taken by a group to find its winner (seconds).
+
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(rating):
+        async with semaphore:
+            return await simulated_group(host, port, rating, think_time,
+                                         concurrent)
+
+    start_time = timeit.default_timer()
+    outcomes = await asyncio.gather(*(limited(g) for g in groups))
+    duration = timeit.default_timer() - start_time
+    latencies = np.concatenate([np.array(l) for l, _, _ in outcomes])
+    return {'nb_group': len(groups),
+            'nb_request': len(latencies),
+            'nb_error': sum('error' in r for _, r, _ in outcomes),
+            'duration': duration,
+            'throughput': len(latencies) / duration,
+            'mean_latency': float(np.mean(latencies)),
+            'p50_latency': float(np.percentile(latencies, 50)),
+            'p99_latency': float(np.percentile(latencies, 99)),
+            'mean_group_duration': float(np.mean([d for _, _, d in outcomes]))}
+
+
+def load_population(dataset, nb_item):
+    """
+    Return the rankings of a dataset and the prior learnt from them.
+
+    Parameters
+    ----------
+    dataset : STRING
+        sushi or crous.
+    nb_item : INT
+        The number of items.
+
+    Returns
+    -------
+    rankings : ARRAY
+        The rankings of the users.
+    prior : ARRAY
+        The m! probabilities of the permutations (Laplace's principle).
+
+    """
+    if dataset not in DATASETS:
+        raise ValueError('Invalid dataset')
+    rankings = DATASETS[dataset](nb_item)
+    # we use Laplace's principle
+    app = prior_counts(rankings) + 1.
+    return(rankings, app / sum(app))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Serve elicitation sessions or measure a server.')
+    parser.add_argument('mode', choices=('serve', 'load', 'bench'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--dataset', default='sushi', choices=list(DATASETS))
+    parser.add_argument('--items', type=int, default=5)
+    parser.add_argument('--heuristic', default='EVOI',
+                        choices=('EVOI', 'IGB', 'ESB', 'EVOI+IGB'))
+    parser.add_argument('--gamma', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--groups', type=int, default=200)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--think-time', type=float, default=0)
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help='select every query within this time (s)')
+    parser.add_argument('--speculate', action='store_true',
+                        help='select the next query while the users answer')
+    parser.add_argument('--speculation-workers', type=int, default=None)
+    parser.add_argument('--concurrent', action='store_true',
+                        help='ask all the voters of a group at the same time')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    population, population_prior = load_population(args.dataset, args.items)
+    load_groups = random_groups(population, args.groups, args.users,
+                                rd.default_rng(args.seed))
+
+    async def main():
+        """Run the mode of the command line."""
+        if args.mode == 'load':
+            print(json.dumps(await run_load(args.host, args.port, load_groups,
+                                            args.concurrency,
+                                            args.think_time,
+                                            args.concurrent), indent=1))
+            return
+        server = SessionServer(population_prior, args.heuristic, args.gamma,
+                               max_workers=args.workers, seed=args.seed,
+                               speculative=args.speculate,
+                               time_budget=args.time_budget,
+                               speculation_workers=args.speculation_workers)
+        running = await server.start(args.host,
+                                     0 if args.mode == 'bench' else args.port)
+        try:
+            if args.mode == 'serve':
+                await running.serve_forever()
+            port = running.sockets[0].getsockname()[1]
+            print(json.dumps(await run_load(args.host, port, load_groups,
+                                            args.concurrency,
+                                            args.think_time,
+                                            args.concurrent), indent=1))
+        finally:
+            await server.stop(running)
+
+    asyncio.run(main())
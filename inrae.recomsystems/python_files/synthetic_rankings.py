@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""Generating synthetic rankings.
+
+@author: Maeva.Caillat
+
+This module draws large populations of rankings, block by block, from:
+    - the uniform distribution on the permutations,
+    - a Mallows model around a reference ranking (repeated insertion),
+    - a Plackett-Luce model with item weights (Gumbel trick),
+and writes them in the .order layout of the sushi file or as a compact
+uint8 .npy array, with the matching prior counts if wanted.
+
+Run this module to generate a population, for instance:
+    python synthetic_rankings.py big.order --model mallows --phi 0.5
+        --nb-ranking 1000000 --nb-item 6 --prior prior.npy
+
+"""
+
+from math import factorial
+import numpy as np
+from numpy import random as rd
+from ranking_projection import prior_counts
+
+
+# pylint: disable=C0103
+MODELS = ('uniform', 'mallows', 'plackett_luce')
+"""tuple: The models of the generator."""
+
+
+def uniform_rankings(nb_ranking, nb_item, rng=None):
+    """
+    Return rankings drawn uniformly among the permutations.
+
+    Parameters
+    ----------
+    nb_ranking : INT
+        The number of rankings.
+    nb_item : INT
+        The number of items.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    ARRAY
+        The nb_ranking x nb_item rankings. First item: preferred item.
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+    return rng.permuted(np.tile(np.arange(nb_item), (nb_ranking, 1)), axis=1)
+
+
+def mallows_rankings(nb_ranking, reference, phi, rng=None):
+    """
+    Return rankings drawn from a Mallows model.
+
+    The probability of a ranking is proportional to phi ** d, d being its
+    Kendall tau distance to the reference. The rankings are drawn by
+    repeated insertion: the i-th item of the reference is inserted at
+    place j <= i with a probability proportional to phi ** (i - j).
+
+    Parameters
+    ----------
+    nb_ranking : INT
+        The number of rankings.
+    reference : ARRAY
+        The central ranking.
+    phi : FLOAT
+        The dispersion, between 0 (the reference only)
+        and 1 (the uniform distribution).
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    ARRAY
+        The nb_ranking x nb_item rankings. First item: preferred item.
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+    reference = np.asarray(reference)
+    nb_item = len(reference)
+    rankings = np.zeros((nb_ranking, nb_item), dtype=int)
+    places = np.arange(nb_item)
+    for i in range(nb_item):
+        # The cumulative probabilities of the places 0 to i.
+        weights = float(phi) ** (i - places[:i+1])
+        cumulative = np.cumsum(weights / weights.sum())
+        place = np.minimum(np.searchsorted(cumulative,
+                                           rng.random(nb_ranking)), i)
+        # The items from the place of insertion move down by one.
+        head = rankings[:, :i+1]
+        shifted = np.concatenate((head[:, :1], head[:, :-1]), axis=1)
+        column = places[:i+1]
+        rankings[:, :i+1] = np.where(column < place[:, None], head,
+                                     np.where(column == place[:, None],
+                                              reference[i], shifted))
+    return rankings
+
+
+def plackett_luce_rankings(nb_ranking, weights, rng=None):
+    """
+    Return rankings drawn from a Plackett-Luce model.
+
+    Sorting the log-weights perturbed by Gumbel noises draws the items
+    one after the other with probabilities proportional to their weights.
+
+    Parameters
+    ----------
+    nb_ranking : INT
+        The number of rankings.
+    weights : ARRAY
+        The positive weights of the items.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+
+    Returns
+    -------
+    ARRAY
+        The nb_ranking x nb_item rankings. First item: preferred item.
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+    utilities = np.log(weights) + rng.gumbel(size=(nb_ranking, len(weights)))
+    return np.argsort(-utilities, axis=1)
+
+
+def generate_rankings(model,
+                      nb_ranking,
+                      nb_item,
+                      chunk_size=100000,
+                      rng=None,
+                      **parameters):
+    """
+    Yield rankings drawn from a model, by blocks.
+
+    Parameters
+    ----------
+    model : STRING
+        The model (a name of MODELS).
+    nb_ranking : INT
+        The number of rankings.
+    nb_item : INT
+        The number of items.
+    chunk_size : INT
+        The number of rankings per block.
+    rng : GENERATOR
+        The random generator (a new unseeded one by default).
+    **parameters : DICT
+        reference and phi for mallows (the identity and 0.5 by default),
+        weights for plackett_luce (1, 1/2, ... 1/nb_item by default).
+
+    Yields
+    ------
+    ARRAY
+        The uint8 rankings of a block.
+
+    """
+    if rng is None:
+        rng = rd.default_rng()
+    for start in range(0, nb_ranking, chunk_size):
+        size = min(chunk_size, nb_ranking - start)
+        if model == 'uniform':
+            block = uniform_rankings(size, nb_item, rng)
+        elif model == 'mallows':
+            block = mallows_rankings(size,
+                                     parameters.get('reference',
+                                                    np.arange(nb_item)),
+                                     parameters.get('phi', 0.5),
+                                     rng)
+        elif model == 'plackett_luce':
+            block = plackett_luce_rankings(size,
+                                           parameters.get(
+                                               'weights',
+                                               1 / np.arange(1, nb_item+1)),
+                                           rng)
+        else:
+            raise ValueError('Invalid model')
+        yield block.astype(np.uint8)
+
+
+def write_rankings(file_path, blocks, nb_item, file_format='order',
+                   nb_ranking=None):
+    """
+    Write blocks of rankings in a file and return their prior counts.
+
+    The blocks are written one after the other, so only one of them
+    is held in memory.
+
+    Parameters
+    ----------
+    file_path : STRING
+        The path of the file.
+    blocks : ITERABLE
+        The blocks of rankings (see generate_rankings).
+    nb_item : INT
+        The number of items.
+    file_format : STRING
+        order for the layout of sushi3a.5000.10.order (a header line, then
+        0, the length and the items of every ranking, read back by
+        datasets.load_sushi_rankings), npy for a uint8 array.
+    nb_ranking : INT
+        The total number of rankings of the blocks, needed by the npy
+        format to size the array before writing it.
+
+    Returns
+    -------
+    counts : ARRAY
+        The nb_item! counts of the permutations written.
+
+    """
+    counts = np.zeros(factorial(nb_item), dtype=np.int64)
+    if file_format == 'npy':
+        if nb_ranking is None:
+            raise ValueError('Invalid number of rankings')
+        rankings = np.lib.format.open_memmap(file_path,
+                                             mode='w+',
+                                             dtype=np.uint8,
+                                             shape=(nb_ranking, nb_item))
+        start = 0
+        for block in blocks:
+            rankings[start:start+len(block)] = block
+            start += len(block)
+            counts += prior_counts(block)
+        rankings.flush()
+        del rankings
+        if start != nb_ranking:
+            raise ValueError('Invalid number of rankings')
+        return counts
+    if file_format != 'order':
+        raise ValueError('Invalid format')
+    with open(file_path, 'w') as f:
+        f.write('%s 1\n' % nb_item)
+        for block in blocks:
+            lines = np.column_stack((np.zeros(len(block), dtype=int),
+                                     np.full(len(block), nb_item),
+                                     block))
+            np.savetxt(f, lines, fmt='%d')
+            counts += prior_counts(block)
+    return counts
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Draw synthetic rankings for load tests.')
+    parser.add_argument('output_path')
+    parser.add_argument('--model', default='uniform', choices=MODELS)
+    parser.add_argument('--nb-ranking', type=int, default=100000)
+    parser.add_argument('--nb-item', type=int, default=6)
+    parser.add_argument('--phi', type=float, default=0.5)
+    parser.add_argument('--reference', type=int, nargs='+', default=None)
+    parser.add_argument('--weights', type=float, nargs='+', default=None)
+    parser.add_argument('--format', default='order', choices=('order', 'npy'))
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--prior', default=None,
+                        help='save the prior counts in this .npy file')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    model_parameters = {'phi': args.phi}
+    if args.reference is not None:
+        model_parameters['reference'] = np.array(args.reference)
+    if args.weights is not None:
+        model_parameters['weights'] = np.array(args.weights)
+    population_counts = write_rankings(
+        args.output_path,
+        generate_rankings(args.model,
+                          args.nb_ranking,
+                          args.nb_item,
+                          args.chunk_size,
+                          rd.default_rng(args.seed),
+                          **model_parameters),
+        args.nb_item,
+        args.format,
+        args.nb_ranking)
+    if args.prior is not None:
+        np.save(args.prior, population_counts)
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""Configuration of the tests.
+
+@author: Maeva.Caillat
+
+The modules of python_files import each other by their bare names,
+so their directory is put on the path.
+
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir,
+                                'python_files'))
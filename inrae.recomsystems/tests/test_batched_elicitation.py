@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Tests of the batched elicitation engine against find_preferences.
+
+@author: Maeva.Caillat
+
+"""
+
+from math import factorial
+import numpy as np
+from numpy import random as rd
+import pytest
+from batched_elicitation import elicitation_tables, run_batched
+from find_preferences import find_preferences
+
+
+# pylint: disable=C0103
+NB_ITEM = 4
+"""int: The number of candidates."""
+
+NB_USER = 3
+"""int: The number of users of a group."""
+
+NB_GROUP = 8
+"""int: The number of groups."""
+
+
+def random_rating(seed):
+    """Return the random rankings G x V x m of NB_GROUP groups."""
+    rng = rd.default_rng(seed)
+    return np.array([[rng.permutation(NB_ITEM) for _ in range(NB_USER)]
+                     for _ in range(NB_GROUP)])
+
+
+def borda_winners(rating):
+    """Return the set of the Borda winners of every group."""
+    scores = (NB_ITEM - 1 - np.argsort(rating, axis=-1)).sum(axis=1)
+    return [set(np.flatnonzero(s == s.max())) for s in scores]
+
+
+@pytest.mark.parametrize('heuristic', ['EVOI', 'IGB'])
+def test_batched_winners_match_find_preferences(heuristic):
+    rating = random_rating(0)
+    vc = elicitation_tables(NB_ITEM)['vc']
+    distrib = np.full((NB_USER, factorial(NB_ITEM)), 1 / factorial(NB_ITEM))
+    winners, nb_queries, necessary, _ = run_batched(
+        rating, distrib, heuristic, rng=rd.default_rng(1))
+    assert necessary.all()
+    assert (nb_queries <= NB_USER * NB_ITEM * (NB_ITEM - 1) // 2).all()
+    for group, winner, expected in zip(rating, winners, borda_winners(rating)):
+        single = find_preferences(np.arange(NB_USER), np.arange(NB_ITEM), vc,
+                                  50, group, distrib.copy(), heuristic, 0,
+                                  0.1, 0.1, True, rng=rd.default_rng(1))
+        # The engines break the ties differently, so they may stop on
+        # different co-winners.
+        assert winner in expected and single[0] in expected
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Tests of the elicitation sessions.
+
+@author: Maeva.Caillat
+
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from numpy import random as rd
+import pytest
+import elicitation_session
+from elicitation_session import (ElicitationSession,
+                                 rating_answers,
+                                 run_session,
+                                 run_session_speculative)
+from metrics import SELECTION_SECONDS
+
+
+# pylint: disable=C0103
+NB_ITEM = 4
+"""int: The number of candidates of the sessions."""
+
+RATING = np.array([[0, 1, 2, 3],
+                   [1, 0, 3, 2],
+                   [0, 2, 1, 3]])
+"""array: The rankings of the users, the preferred candidate first."""
+
+WINNER = 0
+"""int: The Borda winner of RATING."""
+
+
+class IdleExecutor:
+    """An executor whose futures never run."""
+
+    @staticmethod
+    def submit(*_):
+        """Return a pending future."""
+        return Future()
+
+
+def recording(answer_source, asked):
+    """Return an answer source appending the queries to asked."""
+    def answer(vi, cj, ck):
+        asked.append((vi, cj, ck))
+        return answer_source(vi, cj, ck)
+    return answer
+
+
+def make_session(heuristic='EVOI', seed=0, **settings):
+    """Return a session of RATING from the uniform distribution."""
+    nb_permut = 24
+    distrib = np.full((len(RATING), nb_permut), 1 / nb_permut)
+    return ElicitationSession(NB_ITEM, distrib, heuristic,
+                              rng=rd.default_rng(seed), **settings)
+
+
+def test_query_is_pending_until_answered():
+    session = make_session()
+    query = session.next_query()
+    assert session.next_query() == query
+    session.submit_answer(rating_answers(RATING)(*query))
+    assert session.nb_queries == 1
+    assert session.pending != query
+
+
+def test_answer_without_pending_query_is_refused():
+    session = make_session()
+    with pytest.raises(ValueError):
+        session.submit_answer(1)
+    session.next_query()
+    with pytest.raises(ValueError):
+        session.submit_answer(1, voter=len(RATING))
+
+
+def test_known_and_busy_queries_are_rejected():
+    session = make_session()
+    assert session.propose_query([0, 0, 1])
+    assert not session.propose_query([0, 2, 3])
+    session.submit_answer(1)
+    # 0 > 1 is known, and so is its reverse.
+    assert not session.propose_query([0, 0, 1])
+    assert not session.propose_query([0, 1, 0])
+    assert session.propose_query([1, 0, 1])
+
+
+def test_rejected_selection_raises(monkeypatch):
+    session = make_session()
+    session.propose_query([0, 0, 1])
+    session.submit_answer(1)
+    monkeypatch.setattr(elicitation_session, 'select_query',
+                        lambda *args: ([0, 0, 1], 0.))
+    with pytest.raises(ValueError):
+        session.next_query()
+
+
+def test_every_voter_has_one_outstanding_query():
+    session = make_session()
+    queries = session.next_queries()
+    assert sorted(q[0] for q in queries) == list(range(len(RATING)))
+    assert session.idle_voters() == []
+    assert session.next_queries() == []
+    vi, cj, ck = queries[-1]
+    session.submit_answer(rating_answers(RATING)(vi, cj, ck), voter=vi)
+    assert session.idle_voters() == [vi]
+    assert [q[0] for q in session.next_queries()] == [vi]
+
+
+@pytest.mark.parametrize('batch_size', [1, 2])
+def test_session_finds_the_borda_winner(batch_size):
+    session = make_session()
+    winner, nb_queries = run_session(session, rating_answers(RATING),
+                                     batch_size)
+    assert winner == WINNER
+    assert session.finished and nb_queries == session.nb_queries
+    assert session.next_query() is None
+    assert session.next_queries() == []
+
+
+@pytest.mark.parametrize('heuristic, israeli',
+                         [('EVOI', True), ('IGB', True), ('ESB', False)])
+def test_speculation_keeps_the_queries_of_a_seed(heuristic, israeli):
+    settings = {'gamma': 20, 'israeli': israeli, 'nb_loss_sample': 100}
+    asked, speculated = [], []
+    run_session(make_session(heuristic, 7, **settings),
+                recording(rating_answers(RATING), asked))
+    with ThreadPoolExecutor(2) as executor:
+        run_session_speculative(make_session(heuristic, 7, **settings),
+                                recording(rating_answers(RATING), speculated),
+                                executor)
+    assert speculated == asked
+
+
+def test_unused_speculation_is_cancelled():
+    session = make_session()
+    session.next_query()
+    futures = session.speculate(IdleExecutor())
+    assert len(futures) == 2
+    session.submit_answer(1)
+    assert futures[0].cancelled() and session.speculated is futures[1]
+    session.cancel_speculation()
+    assert futures[1].cancelled() and session.speculated is None
+
+
+def test_every_query_is_timed_once_with_speculation():
+    nb_timed = SELECTION_SECONDS.count(heuristic='IGB')
+    with ThreadPoolExecutor(2) as executor:
+        _, nb_queries, _ = run_session_speculative(
+            make_session('IGB', gamma=20), rating_answers(RATING), executor)
+    assert SELECTION_SECONDS.count(heuristic='IGB') - nb_timed == nb_queries
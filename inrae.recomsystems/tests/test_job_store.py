@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Tests of the claim protocol of the job store.
+
+@author: Maeva.Caillat
+
+"""
+
+import sqlite3
+import pytest
+import job_store
+from job_store import (DONE,
+                       FAILED,
+                       PENDING,
+                       RUNNING,
+                       add_cells,
+                       claim_cell,
+                       complete_cell,
+                       count_cells,
+                       fail_cell,
+                       load_results,
+                       open_store,
+                       reset_cells)
+
+
+# pylint: disable=C0103
+RESULT = (50., 0.1, 3, [0.5, 0.])
+"""tuple: A result of run_experiment."""
+
+
+def make_tasks(nb_replica=3, **settings):
+    """Return the tasks of a small grid."""
+    task = {'heuristic': 'IGB', 'nb_user': 4, 'database': 'sushi',
+            'seed': 0, 'nb_item': 4, 'gamma': 50, 'termination_value': 0,
+            'epsilon': 0.1, 'delta': 0.1, 'nb_matrix': 1,
+            'nb_user_init_distrib': 100, 'israeli': True}
+    task.update(settings)
+    return [dict(task, replica=replica) for replica in range(nb_replica)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Return the path of a job store holding three pending cells."""
+    path = str(tmp_path / 'store.sqlite')
+    conn = open_store(path)
+    add_cells(conn, make_tasks())
+    conn.close()
+    return path
+
+
+def statuses(conn):
+    """Return the status of every cell, by replica."""
+    return dict(conn.execute('SELECT replica, status FROM cells'))
+
+
+def test_workers_claim_distinct_cells(store):
+    conn_a, conn_b = open_store(store), open_store(store)
+    claimed = []
+    for conn, worker in ((conn_a, 'a'), (conn_b, 'b')) * 2:
+        task = claim_cell(conn, worker)
+        if task is not None:
+            claimed.append(task['replica'])
+    assert sorted(claimed) == [0, 1, 2]
+    assert claim_cell(conn_a, 'a') is None
+
+
+def test_reset_keeps_live_claims(store):
+    conn = open_store(store)
+    task = claim_cell(conn, 'a')
+    # A second sweep joining the grid.
+    assert reset_cells(conn) == 0
+    assert statuses(conn)[task['replica']] == RUNNING
+    assert complete_cell(conn, task, RESULT, worker='a')
+    assert statuses(conn)[task['replica']] == DONE
+
+
+def test_reset_reclaims_expired_leases(store, monkeypatch):
+    conn = open_store(store)
+    task = claim_cell(conn, 'a')
+    monkeypatch.setattr(job_store, 'now', lambda: 1e12)
+    assert reset_cells(conn, lease=3600) == 1
+    assert statuses(conn)[task['replica']] == PENDING
+    # The cell is run again by b, the late result of a is dropped.
+    assert claim_cell(conn, 'b')['replica'] == task['replica']
+    assert not complete_cell(conn, task, RESULT, worker='a')
+    assert not fail_cell(conn, task, 'error', worker='a')
+    assert complete_cell(conn, task, RESULT, worker='b')
+
+
+def test_failed_cells_are_retried_on_request(store):
+    conn = open_store(store)
+    task = claim_cell(conn, 'a')
+    assert fail_cell(conn, task, 'error', worker='a')
+    assert reset_cells(conn) == 0
+    assert statuses(conn)[task['replica']] == FAILED
+    assert reset_cells(conn, retry_failed=True) == 1
+    assert statuses(conn)[task['replica']] == PENDING
+
+
+def test_settings_are_part_of_the_key(store):
+    conn = open_store(store)
+    add_cells(conn, make_tasks(gamma=300))
+    assert count_cells(conn) == {PENDING: 6}
+    task = claim_cell(conn, 'a')
+    complete_cell(conn, task, RESULT, worker='a')
+    (key,) = load_results(conn)
+    assert key[:5] == ('IGB', 4, 'sushi', task['replica'], 0)
+    assert key[5] == job_store.config_hash(task)
+
+
+def test_old_store_is_refused(tmp_path):
+    path = str(tmp_path / 'old.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE cells (heuristic TEXT, nb_user INTEGER, '
+                 'database TEXT, replica INTEGER, seed INTEGER, '
+                 'status TEXT, task TEXT)')
+    conn.close()
+    with pytest.raises(ValueError):
+        open_store(path)
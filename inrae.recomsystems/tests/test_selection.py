@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Tests of the query selection paths.
+
+@author: Maeva.Caillat
+
+"""
+
+import numpy as np
+from numpy import random as rd
+import pytest
+import anytime_selection
+from anytime_selection import anytime_query
+from batched_elicitation import elicitation_tables
+from esb import weighted_expect_max
+from find_preferences import select_queries, select_query
+from igb import weighted_info_gain
+from successive_halving import halving_query
+
+
+# pylint: disable=C0103
+NB_ITEM = 4
+"""int: The number of candidates."""
+
+GAMMA = 2000
+"""int: A sample size large enough for the estimates to agree."""
+
+TOLERANCE = 0.03
+"""float: The gap allowed between the full values of the chosen queries."""
+
+NB_CROWD = 50
+"""int: The voters of a crowd, whose 300 candidates are ranked one by one."""
+
+
+class TickingClock:
+    """A clock advancing by one second at every reading."""
+
+    def __init__(self):
+        self.now = 0.
+
+    def default_timer(self):
+        """Return the time, one second after the last reading."""
+        self.now += 1.
+        return self.now
+
+
+def group_distrib(nb_user, seed):
+    """Return a random permutation distribution of nb_user voters."""
+    vc = elicitation_tables(NB_ITEM)['vc']
+    return rd.default_rng(seed).dirichlet(np.full(len(vc), 0.3),
+                                          size=nb_user)
+
+
+@pytest.mark.parametrize('heuristic, values, name',
+                         [('IGB', weighted_info_gain, 'WIG'),
+                          ('ESB', weighted_expect_max, 'WEM')])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_halving_agrees_with_the_full_selection(heuristic, values, name,
+                                                seed):
+    vc = elicitation_tables(NB_ITEM)['vc']
+    v, c = np.arange(2), np.arange(NB_ITEM)
+    distrib = group_distrib(len(v), seed)
+    queries = [[0, 0, 1]]
+    full = values(v, c, vc, GAMMA, distrib, queries, rd.default_rng(seed))
+    query, _ = halving_query(heuristic, v, c, vc, GAMMA, distrib,
+                             queries, rd.default_rng(seed))
+    assert query not in queries
+    full_value = full['%s(%s,%s,%s)' % (name, *query)]
+    assert full_value >= max(full.values()) - TOLERANCE
+
+
+@pytest.mark.parametrize('heuristic', ['EVOI', 'IGB', 'ESB'])
+@pytest.mark.parametrize('time_budget', [100, 400])
+def test_anytime_selection_keeps_its_budget(monkeypatch, heuristic,
+                                            time_budget):
+    # Every step of the selection reads the clock once: the budget is a
+    # number of steps.
+    clock = TickingClock()
+    events = []
+    monkeypatch.setattr(anytime_selection, 'timeit', clock)
+    monkeypatch.setattr(anytime_selection, 'log_event',
+                        lambda level, event, **fields: events.append(fields))
+    vc = elicitation_tables(NB_ITEM)['vc']
+    v, c = np.arange(NB_CROWD), np.arange(NB_ITEM)
+    distrib = group_distrib(len(v), 0)
+    queries = [[0, 0, 1]]
+    query, _ = anytime_query(heuristic, v, c, vc, 50, distrib, queries,
+                             time_budget, rd.default_rng(0))
+    # The deadline is read once more when it is passed.
+    assert clock.now <= time_budget + 2
+    assert query not in queries
+    (anytime,) = [e for e in events if 'nb_evaluated' in e]
+    nb_candidates = len(v) * NB_ITEM * (NB_ITEM - 1) // 2 - len(queries)
+    assert anytime['nb_candidates'] == nb_candidates
+    # The candidates are evaluated after their ranking, one step each.
+    assert anytime['nb_evaluated'] <= max(0, time_budget - nb_candidates)
+    assert (anytime['nb_evaluated'] > 0) == (time_budget > nb_candidates)
+
+
+@pytest.mark.parametrize('k', [1, 2, 3])
+def test_batch_selection_picks_the_best_query_per_voter(k):
+    vc = elicitation_tables(NB_ITEM)['vc']
+    v, c = np.arange(3), np.arange(NB_ITEM)
+    distrib = group_distrib(len(v), 0)
+    queries = [[0, 0, 1], [1, 2, 3]]
+    chosen, values = select_queries('EVOI', v, c, vc, 0, distrib, queries, k,
+                                    rd.default_rng(0))
+    assert len({query[0] for query in chosen}) == len(chosen) == k
+    assert not any(query in queries for query in chosen)
+    assert list(values) == sorted(values, reverse=True)
+    # The first query is the one of the single selection (EVOI is exact).
+    _, value = select_query('EVOI', v, c, vc, 0, distrib, queries,
+                            rd.default_rng(0))
+    assert values[0] == value
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Tests of the session server.
+
+@author: Maeva.Caillat
+
+"""
+
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from numpy import random as rd
+import pytest
+from elicitation_session import ElicitationSession, rating_answers
+from session_server import SessionServer, simulated_group
+
+
+# pylint: disable=C0103
+PRIOR = np.full(24, 1 / 24)
+"""array: The uniform prior of 4 items."""
+
+RATING = np.array([[0, 1, 2, 3],
+                   [1, 0, 3, 2],
+                   [0, 2, 1, 3]])
+"""array: The rankings of the users, the preferred candidate first."""
+
+WINNER = 0
+"""int: The Borda winner of RATING."""
+
+
+async def run_in_process(function, *args):
+    """Return function(*args), computed in the event loop."""
+    return function(*args)
+
+
+def failing_selection(server, error):
+    """
+    Run the selections of a server in process, failing once armed.
+
+    The selections fail as soon as a query already answered is put in the
+    list returned: as if a worker died ('broken'), or by selecting this
+    query again ('rejected').
+    """
+    armed = []
+
+    async def run_in_pool(function, *args):
+        if not armed:
+            return await run_in_process(function, *args)
+        if error == 'broken':
+            raise BrokenProcessPool('A worker died')
+        return [armed[0]]
+    server.run_in_pool = run_in_pool
+    return armed
+
+
+@pytest.mark.parametrize('concurrent', [False, True])
+def test_group_finds_its_winner(concurrent):
+
+    async def play():
+        server = SessionServer(PRIOR, 'EVOI', max_workers=1, seed=0)
+        running = await server.start(port=0)
+        try:
+            port = running.sockets[0].getsockname()[1]
+            return await simulated_group('127.0.0.1', port, RATING,
+                                         concurrent=concurrent)
+        finally:
+            await server.stop(running)
+
+    _, reply, _ = asyncio.run(play())
+    assert reply['winner'] == WINNER
+    assert reply['nb_queries'] >= len(RATING)
+
+
+@pytest.mark.parametrize('error', ['broken', 'rejected'])
+def test_failed_selection_closes_the_session(error):
+
+    async def play():
+        server = SessionServer(PRIOR, 'EVOI', max_workers=1, seed=0)
+        armed = failing_selection(server, error)
+        reply = await server.dispatch({'op': 'open', 'nb_user': len(RATING)})
+        armed.append(reply['query'])
+        with pytest.raises((BrokenProcessPool, ValueError)):
+            await server.dispatch({'op': 'answer',
+                                   'session': reply['session'],
+                                   'answer': 1})
+        assert reply['session'] not in server.sessions
+        with pytest.raises(ValueError, match='Invalid session'):
+            await server.dispatch({'op': 'answer',
+                                   'session': reply['session'],
+                                   'answer': 1})
+        server.pool.shutdown()
+
+    asyncio.run(play())
+
+
+def test_concurrent_session_survives_a_failed_selection():
+
+    async def play():
+        server = SessionServer(PRIOR, 'EVOI', max_workers=1, seed=0)
+        armed = failing_selection(server, 'broken')
+        reply = await server.dispatch({'op': 'open',
+                                       'nb_user': len(RATING),
+                                       'concurrent': True})
+        session = server.sessions[reply['session']]
+        vi, cj, ck = reply['queries'][0]
+        armed.append([vi, cj, ck])
+        with pytest.raises(BrokenProcessPool):
+            await server.dispatch({'op': 'answer',
+                                   'session': reply['session'],
+                                   'voter': vi,
+                                   'answer': 1})
+        # The other voters still answer, and vi is asked again.
+        armed.clear()
+        vj, _, _ = reply['queries'][1]
+        reply = await server.dispatch({'op': 'answer',
+                                       'session': reply['session'],
+                                       'voter': vj,
+                                       'answer': 1})
+        assert sorted(q[0] for q in reply['queries']) == sorted([vi, vj])
+        assert session.nb_queries == 2
+        server.pool.shutdown()
+
+    asyncio.run(play())
+
+
+@pytest.mark.parametrize('heuristic', ['EVOI', 'IGB'])
+def test_served_session_asks_the_queries_of_a_local_one(heuristic):
+    # The first session of a server draws the first stream of its seed.
+    session = ElicitationSession(
+        4, np.tile(PRIOR, (len(RATING), 1)), heuristic,
+        rng=rd.default_rng(np.random.SeedSequence(0).spawn(1)[0]))
+    answer = rating_answers(RATING)
+
+    async def play():
+        server = SessionServer(PRIOR, heuristic, max_workers=1, seed=0)
+        server.run_in_pool = run_in_process
+        reply = await server.dispatch({'op': 'open',
+                                       'nb_user': len(RATING),
+                                       'concurrent': True})
+        waiting = list(session.next_queries())
+        assert reply['queries'] == [list(q) for q in waiting]
+        # The voters answer in the order of their queries.
+        while waiting:
+            query = waiting.pop(0)
+            reply = await server.dispatch({'op': 'answer',
+                                           'session': reply['session'],
+                                           'voter': query[0],
+                                           'answer': answer(*query)})
+            if session.submit_answer(answer(*query), voter=query[0]):
+                assert reply['winner'] == session.winner
+                break
+            new = session.next_queries()
+            assert reply['queries'] == [list(q) for q in new]
+            waiting += new
+        server.pool.shutdown()
+
+    asyncio.run(play())